@@ -1,13 +1,12 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, get_flashed_messages, g, session
+from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, get_flashed_messages, g, session, Response, stream_with_context, make_response
 import sqlite3
 import os
 from datetime import datetime, timedelta, date
 import uuid
 import threading
-import shutil
 import time
 from werkzeug.utils import secure_filename
-from logger import logger
+from logger import logger, configure_levels
 import logging
 import hashlib  
 
@@ -16,11 +15,20 @@ import hashlib
 logging.getLogger('werkzeug').setLevel(logging.DEBUG)
 # ou, pour les masquer complètement :
 # logging.getLogger('werkzeug').setLevel(logging.WARNING)
-import json
 from jinja2.runtime import Undefined
 from tasks import get_all_tasks, TASKS
 from config import DATABASE_PATH
+from db import get_db, transaction, close_db, backup_to, restore_from
+from db_indexes import hot_query
+from dates import parse_date, normalize_date
+from expirations import extend_expirations
+import http_client
+import events
+import i18n
+import log_reader
+import log_store
 from mailer import send_email
+import settings_helper
 from settings_helper import get_settings
 from disable_expired_users import disable_expired_users
 from plex_share_helper import share_user_libraries, unshare_all_libraries, set_user_libraries, set_user_libraries_via_api, share_user_libraries_plexapi
@@ -29,6 +37,7 @@ from plex_share_helper import share_user_libraries, unshare_all_libraries, set_u
    
 
 import send_reminder_emails
+import send_mail_queue
 import check_servers
 import update_plex_users
 
@@ -38,12 +47,18 @@ app.secret_key = "une_clé_secrète_ultra_random"
 
 # 📁 Dossier temporaire pour les fichiers joints
 TEMP_FOLDER = os.path.join(os.getcwd(), "appdata/temp")
+LOG_PAGE_LINES = 500  # lignes affichées / renvoyées au plus par /logs et /api/logs
 os.makedirs(TEMP_FOLDER, exist_ok=True)
 
 @app.context_processor
 def inject_app_name():
     return {"APP_NAME": "Vodum"}  # change ici si tu renomme l’outil
 
+@app.teardown_appcontext
+def release_db(exc):
+    # Une connexion par thread de requête (cf. db.py) : on la rend en fin de requête
+    close_db()
+
 
 
 def _ensure_meta_tables(conn: sqlite3.Connection):
@@ -98,9 +113,10 @@ def create_tables_once():
     default_data_path = os.path.join(base_dir, "default_data.sql")
 
     changed = False
+    migrated = False
 
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with transaction() as conn:
             _ensure_meta_tables(conn)
 
             # 1) tables.sql (une seule fois)
@@ -145,6 +161,10 @@ def create_tables_once():
                     logger.info("📜 Exécution de updates.sql (nouvelle version détectée)")
                     with open(updates_sql_path, "r", encoding="utf-8") as f:
                         conn.executescript(f.read())
+                    # updates.sql finit par PRAGMA foreign_keys=on : on revient au défaut de db.py,
+                    # sinon le réglage reste sur la connexion du thread (cf. close_db plus bas)
+                    conn.execute("PRAGMA foreign_keys=off")
+                    migrated = True
                     conn.execute(
                         "INSERT INTO schema_migrations (name, checksum, applied_at) VALUES (?, ?, datetime('now'))",
                         ("updates.sql", checksum)
@@ -154,7 +174,9 @@ def create_tables_once():
             else:
                 logger.debug(f"updates.sql introuvable ({updates_sql_path}) — skip")
 
-            conn.commit()
+        if migrated:
+            # Le script a pu modifier d'autres réglages de la connexion : on repart d'une connexion neuve
+            close_db()
 
         # 4) Compléments de schéma (ajouts de colonnes si manquantes)
         from update_vodum import update_vodum
@@ -173,11 +195,10 @@ def create_tables_once():
 
 def cleanup_locks():
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM locks")
         conn.commit()
-        conn.close()
         logger.info("🔓 Tous les locks ont été réinitialisés au démarrage.")
     except Exception as e:
         logger.warning(f"⚠️ Échec lors du nettoyage des locks : {e}")
@@ -194,23 +215,10 @@ def load_lang():
     lang = get_locale()
     g.translations = load_translations(lang)
 
-def _parse_date_any(d):
-    """Accepte YYYY-MM-DD ou DD/MM/YYYY ; renvoie date() ou None."""
-    if not d:
-        return None
-    s = str(d).strip()
-    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
-        try:
-            return datetime.strptime(s.replace(" ", ""), fmt).date()
-        except ValueError:
-            continue
-    return None
-
 # Route pour afficher la liste des utilisateurs
 @app.route("/users")
 def get_users_page():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
     # On lit le statut calculé par les scripts (status), pas un "statut" maison
@@ -219,12 +227,11 @@ def get_users_page():
         FROM users
     """)
     rows = cur.fetchall()
-    conn.close()
 
     today = date.today()
     users = []
     for r in rows:
-        exp = _parse_date_any(r["expiration_date"])
+        exp = parse_date(r["expiration_date"])
         jours_restants = (exp - today).days if exp else None
 
         users.append({
@@ -255,13 +262,15 @@ def sync_users_manual():
 @app.route("/update_expiration", methods=["POST"])
 def update_expiration():
     user_id = request.form.get("user_id")
-    new_date = request.form.get("new_date")
+    new_date = normalize_date(request.form.get("new_date"))
+    if new_date is None:
+        flash("❌ Date d'expiration invalide", "danger")
+        return redirect(url_for("get_users_page"))
 
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET expiration_date = ? WHERE id = ?", (new_date, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cur = conn.execute("UPDATE users SET expiration_date = ? WHERE id = ?", (new_date, user_id))
+        if cur.rowcount:
+            events.publish("users", [user_id])
 
     return redirect(url_for("get_users_page"))
 
@@ -272,7 +281,7 @@ def update_user():
     user_id = request.form.get("user_id")
     username = request.form.get("username")
     email = request.form.get("email")
-    new_expiration = request.form.get("expiration_date")
+    new_expiration = normalize_date(request.form.get("expiration_date"))
     firstname = request.form.get("firstname")
     lastname = request.form.get("lastname")
     second_email = request.form.get("second_email")
@@ -282,33 +291,35 @@ def update_user():
         f"firstname={firstname}, lastname={lastname}, second_email={second_email}")
 
 
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    cursor = conn.cursor()
-
-    # Récupérer l'ancienne date d'expiration
-    cursor.execute("SELECT expiration_date FROM users WHERE id = ?", (user_id,))
-    result = cursor.fetchone()
-    old_expiration = result[0] if result else None
+    with transaction() as conn:
+        cursor = conn.cursor()
 
-    # Mise à jour en fonction des champs envoyés
-    if username and email:
-        cursor.execute("""
-            UPDATE users SET username = ?, email = ?, expiration_date = ?, firstname = ?, lastname = ?, second_email = ?
-            WHERE id = ?
-        """, (username, email, new_expiration, firstname, lastname, second_email, user_id))
-    #else:
-    #    cursor.execute("""
-    #        UPDATE users SET expiration_date = ?
-    #        WHERE id = ?
-    #    """, (new_expiration, user_id))
-
-    # Réinitialisation des envois si la date change
-    if new_expiration != old_expiration:
-        cursor.execute("DELETE FROM sent_emails WHERE user_id = ?", (user_id,))
-        logger.info(f"🧹 Envois réinitialisés pour l'utilisateur {user_id} (date changée)")
+        # Récupérer l'ancienne date d'expiration
+        cursor.execute("SELECT expiration_date FROM users WHERE id = ?", (user_id,))
+        result = cursor.fetchone()
+        old_expiration = result[0] if result else None
+        if new_expiration is None and request.form.get("expiration_date"):
+            flash("⚠️ Date d'expiration invalide : date inchangée.", "warning")
+            new_expiration = old_expiration
 
-    conn.commit()
-    conn.close()
+        # Mise à jour en fonction des champs envoyés
+        if username and email:
+            cursor.execute("""
+                UPDATE users SET username = ?, email = ?, expiration_date = ?, firstname = ?, lastname = ?, second_email = ?
+                WHERE id = ?
+            """, (username, email, new_expiration, firstname, lastname, second_email, user_id))
+            if cursor.rowcount:
+                events.publish("users", [user_id])
+        #else:
+        #    cursor.execute("""
+        #        UPDATE users SET expiration_date = ?
+        #        WHERE id = ?
+        #    """, (new_expiration, user_id))
+
+        # Réinitialisation des envois si la date change
+        if new_expiration != old_expiration:
+            cursor.execute("DELETE FROM sent_emails WHERE user_id = ?", (user_id,))
+            logger.info(f"🧹 Envois réinitialisés pour l'utilisateur {user_id} (date changée)")
 
     return redirect(url_for("get_users_page"))
 
@@ -316,11 +327,10 @@ def update_user():
 
 @app.route("/delete_user/<int:user_id>", methods=["POST"])
 def delete_user(user_id):
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cur = conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        if cur.rowcount:
+            events.publish("users", [user_id])  # la ligne disparaît des autres onglets
     return redirect(url_for("get_users_page"))
 
 
@@ -328,15 +338,13 @@ def delete_user(user_id):
 
 @app.route("/user/<int:user_id>")
 def get_user_page(user_id):
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
 
     # Récupère l'utilisateur
     cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     row = cursor.fetchone()
     if not row:
-        conn.close()
         return "Utilisateur non trouvé", 404
 
     user = dict(row)
@@ -369,7 +377,7 @@ def get_user_page(user_id):
     expiration = user.get("expiration_date")
     if expiration:
         try:
-            expiration_date = datetime.strptime(expiration, "%Y-%m-%d").date()
+            expiration_date = parse_date(expiration)
             jours_restants = (expiration_date - datetime.now().date()).days
             if jours_restants > 60:
                 statut = "🟢 Actif"
@@ -380,13 +388,18 @@ def get_user_page(user_id):
         except Exception:
             statut = "⚠️ Date invalide"
 
-    conn.close()
     return render_template("edit_user.html", statut=statut, user=user)
 
+# Comptes d'utilisateurs par server_id (texte), lus sur idx_user_servers_server
+SERVER_USER_COUNTS_SQL = hot_query("app.servers_page.user_counts", """
+    SELECT us.server_id, COUNT(DISTINCT us.user_id) AS n
+    FROM user_servers us
+    GROUP BY us.server_id
+""")
+
 @app.route("/servers")
 def servers_page():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
     # récupère tous les serveurs
@@ -394,11 +407,7 @@ def servers_page():
     rows = cur.fetchall()
 
     # récupère les comptes d'utilisateurs par server_id (texte)
-    cur.execute("""
-        SELECT us.server_id, COUNT(DISTINCT us.user_id) AS n
-        FROM user_servers us
-        GROUP BY us.server_id
-    """)
+    cur.execute(SERVER_USER_COUNTS_SQL)
     counts = {r["server_id"]: r["n"] for r in cur.fetchall()}
 
     # transforme en dict et ajoute user_count
@@ -408,7 +417,6 @@ def servers_page():
         d["user_count"] = counts.get(r["server_id"], 0)
         servers.append(d)
 
-    conn.close()
     return render_template("servers.html", servers=servers)
 
 
@@ -416,47 +424,46 @@ def servers_page():
 def servers_offer_time(server_row_id):
     data = request.get_json(silent=True) or {}
     days = int(data.get("days", 0))
-    print(f"🎁 [DEBUG] Offer time route called: server_row_id={server_row_id}, days={days}", flush=True)
+    logger.debug(f"🎁 Offer time : server_row_id={server_row_id}, days={days}")
     if days <= 0:
         return jsonify({"error": "Durée invalide"}), 400
 
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    # Récupération de l’ID texte du serveur
-    cur.execute("SELECT name, server_id FROM servers WHERE id = ?", (server_row_id,))
-    row = cur.fetchone()
+    row = get_db().execute("SELECT name FROM servers WHERE id = ?", (server_row_id,)).fetchone()
     if not row:
-        conn.close()
         return jsonify({"error": "Serveur introuvable"}), 404
 
-    server_name = row["name"]
-    server_id_text = row["server_id"]
-
-    # Récupération des utilisateurs liés
-    cur.execute("""
-        SELECT u.id AS user_id, u.expiration_date
-        FROM users u
-        JOIN user_servers us ON us.user_id = u.id
-        WHERE us.server_id = ?
-    """, (server_id_text,))
-    users = cur.fetchall()
+    updated = extend_expirations(days, server_row_id=server_row_id)
+    logger.info(f"🎁 {days} jour(s) offert(s) à {updated} utilisateur(s) du serveur {row['name']}")
 
-    today = date.today()
-    updated = 0
+    return jsonify({"success": True, "server": row["name"], "days": days, "users": updated})
 
-    for u in users:
-        current = _parse_date_any(u["expiration_date"])
-        base = current if current and current >= today else today
-        new_date = (base + timedelta(days=days)).strftime("%Y-%m-%d")
-        cur.execute("UPDATE users SET expiration_date = ? WHERE id = ?", (new_date, u["user_id"]))
-        updated += 1
 
-    conn.commit()
-    conn.close()
+@app.route("/api/users/extend_expiration", methods=["POST"])
+def api_extend_expiration():
+    """
+    Prolongation en masse : {"days": 30, "server_id": <servers.id>, "status": "active", "library_id": <libraries.id>}
+    Au moins un filtre est requis (ou "all": true). Retourne le nombre d'utilisateurs prolongés.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        days = int(data.get("days", 0))
+        server_row_id = int(data["server_id"]) if data.get("server_id") not in (None, "") else None
+        library_id = int(data["library_id"]) if data.get("library_id") not in (None, "") else None
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Paramètres invalides"}), 400
+    status = (data.get("status") or "").strip() or None
 
-    return jsonify({"success": True, "server": server_name, "days": days, "users": updated})
+    if days <= 0:
+        return jsonify({"success": False, "error": "Durée invalide"}), 400
+    if server_row_id is None and status is None and library_id is None and not data.get("all"):
+        return jsonify({"success": False, "error": "Aucun filtre (server_id, status, library_id ou all)"}), 400
+
+    updated = extend_expirations(days, server_row_id=server_row_id, status=status, library_id=library_id)
+    logger.info(
+        f"🎁 {days} jour(s) offert(s) à {updated} utilisateur(s) "
+        f"(serveur={server_row_id}, statut={status}, bibliothèque={library_id})"
+    )
+    return jsonify({"success": True, "days": days, "users": updated})
 
 
 @app.route("/servers/add", methods=["POST"])
@@ -468,14 +475,13 @@ def add_server():
 
     try:
         # Vérifie si le serveur Plex répond
-        import requests
-        res = requests.get(f"{plex_url}/identity", headers={"X-Plex-Token": plex_token}, timeout=5)
+        res = http_client.get(f"{plex_url}/identity", headers={"X-Plex-Token": plex_token}, timeout=5, retries=0)
         if res.status_code != 200:
             flash(f"❌ Le serveur Plex ne répond pas correctement (HTTP {res.status_code})", "danger")
             return redirect("/servers")
 
         # Connexion et vérification doublon
-        with sqlite3.connect(DATABASE_PATH, timeout=10) as conn:
+        with transaction() as conn:
             cursor = conn.cursor()
 
             cursor.execute("""
@@ -492,7 +498,6 @@ def add_server():
                     plex_url, plex_token, tautulli_url, tautulli_api_key
                 ) VALUES (?, ?, ?, ?)
             """, (plex_url, plex_token, tautulli_url, tautulli_api_key))
-            conn.commit()
 
         flash("✅ Serveur ajouté avec succès", "success")
 
@@ -511,12 +516,10 @@ def add_server():
 
 @app.route("/server/<int:server_id>")
 def edit_server(server_id):
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM servers WHERE id = ?", (server_id,))
     server = cursor.fetchone()
-    conn.close()
 
     if not server:
         return "Serveur introuvable", 404
@@ -527,7 +530,7 @@ def edit_server(server_id):
 @app.route("/update_server", methods=["POST"])
 def update_server():
     data = request.form
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("""
         UPDATE servers
@@ -542,7 +545,6 @@ def update_server():
         data["id"]
     ))
     conn.commit()
-    conn.close()
     flash("✅ Serveur mis à jour avec succès", "success")
     return redirect("/servers")
 
@@ -551,10 +553,9 @@ def update_server():
 @app.route("/servers/delete/<int:server_id>", methods=["POST"])
 def delete_server(server_id):
     try:
-        with sqlite3.connect(DATABASE_PATH, timeout=10) as conn:
+        with transaction() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM servers WHERE id = ?", (server_id,))
-            conn.commit()
         flash("✅ Serveur supprimé", "success")
     except Exception as e:
         flash(f"❌ Erreur suppression : {e}", "danger")
@@ -563,19 +564,34 @@ def delete_server(server_id):
 
 
 
-@app.route("/libraries")
-def libraries_page():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("""
+def _ids_filter(column, ids):
+    """Clause SQL optionnelle `AND column IN (...)` pour les rafraîchissements ciblés."""
+    if ids is None:
+        return "", ()
+    return f" AND {column} IN ({','.join('?' for _ in ids)})", tuple(ids)
+
+
+def _request_ids():
+    """?ids=1,2,3 → [1, 2, 3] ; absent → None (liste complète)."""
+    raw = request.args.get("ids")
+    if raw is None:
+        return None
+    return [int(x) for x in raw.split(",") if x.strip().isdigit()]
+
+
+def get_all_libraries(ids=None):
+    where, params = _ids_filter("l.id", ids)
+    return get_db().execute(f"""
         SELECT l.*, s.name AS server_name
         FROM libraries l
         LEFT JOIN servers s ON l.server_id = s.server_id
-    """)
+        WHERE 1{where}
+    """, params).fetchall()
+
 
-    libraries = cursor.fetchall()
-    conn.close()
+@app.route("/libraries")
+def libraries_page():
+    libraries = get_all_libraries()
     return render_template("libraries.html", libraries=libraries)
 
 
@@ -594,11 +610,10 @@ def mailling():
 
 @app.route("/api/email_templates")
 def get_email_templates():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT type, subject, body, days_before FROM email_templates")
     rows = cursor.fetchall()
-    conn.close()
 
     result = {
         row[0]: {
@@ -621,7 +636,7 @@ def update_email_template(template_type):
     if not subject or not body:
         return jsonify({"error": "Champs manquants"}), 400
 
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("""
         UPDATE email_templates
@@ -629,21 +644,13 @@ def update_email_template(template_type):
         WHERE type = ?
     """, (subject, body, days_before, template_type))
     conn.commit()
-    conn.close()
 
     return jsonify({"status": "ok"})
 
 
 @app.route("/settings", methods=["GET"])
 def get_settings_page():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM settings LIMIT 1")
-    row = cursor.fetchone()
-    conn.close()
-
-    settings = dict(row) if row else {}
+    settings = get_settings()
 
     lang = get_locale()
     translations = load_translations(lang)  # ✅ Ajoute ceci
@@ -686,7 +693,7 @@ def save_settings():
 
     logger.info(f"🧪 disable_on_expiry reçu = {data['disable_on_expiry']}")
 
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
+    conn = get_db()
     cursor = conn.cursor()
 
     # Vérifie s’il y a déjà une ligne
@@ -733,7 +740,8 @@ def save_settings():
         """, data)
 
     conn.commit()
-    conn.close()
+    settings_helper.invalidate()
+    configure_levels()
 
     # Support AJAX/fetch (ex : bouton test email)
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
@@ -765,7 +773,7 @@ def save_backup():
     os.makedirs(backup_dir, exist_ok=True)
 
     backup_file = os.path.join(backup_dir, f"database_{timestamp}.db")
-    shutil.copy2(DATABASE_PATH, backup_file)
+    backup_to(backup_file)
 
     flash(f"Sauvegarde effectuée : {os.path.basename(backup_file)}", "success")
     return redirect("/backup")
@@ -805,7 +813,7 @@ def backup_bdd():
             # Créer une nouvelle sauvegarde
             timestamp = now.strftime("%Y-%m-%d_%H%M%S")
             backup_file = os.path.join(backup_dir, f"database_{timestamp}.db")
-            shutil.copy2(DATABASE_PATH, backup_file)
+            backup_to(backup_file)
             print(f"[🗃️ Backup] Sauvegarde créée : {backup_file}")
 
             # Garde uniquement les 6 plus récentes
@@ -840,7 +848,13 @@ def restore_combined_backup():
         if not filename.endswith(".db"):
             flash("❌ Fichier invalide", "danger")
             return redirect("/backup")
-        file.save(DATABASE_PATH)
+        upload_path = os.path.join(TEMP_FOLDER, f"restore_{uuid.uuid4().hex}.db")
+        file.save(upload_path)
+        try:
+            restore_from(upload_path)
+            settings_helper.invalidate()
+        finally:
+            os.remove(upload_path)
         flash(f"✅ Base restaurée depuis le fichier envoyé : {filename}", "success")
 
     elif selected_file:
@@ -849,7 +863,8 @@ def restore_combined_backup():
         if not os.path.exists(backup_path):
             flash("❌ Fichier introuvable", "danger")
             return redirect("/backup")
-        shutil.copy2(backup_path, DATABASE_PATH)
+        restore_from(backup_path)
+        settings_helper.invalidate()
         flash(f"✅ Sauvegarde restaurée : {selected_file}", "success")
 
     else:
@@ -869,46 +884,25 @@ def get_backup_info(filename):
 
     return jsonify({"size": size_kb, "modified": modified})
 
-def get_settings():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM settings LIMIT 1")
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else {}
-
-def detect_level(line):
-    for level in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
-        if f"[{level}]" in line:
-            return level
-    return "INFO"
-
+def _request_log_levels(default=("INFO", "WARNING", "ERROR", "CRITICAL")):
+    """Niveaux demandés (?levels=INFO,ERROR) ; par défaut tout sauf DEBUG, comme les cases de la page."""
+    raw = request.args.get("levels")
+    if raw is None:
+        return set(default)
+    return {lvl.strip().upper() for lvl in raw.split(",") if lvl.strip().upper() in log_reader.LEVELS}
 
 
 @app.route("/logs")
 def logs_page():
-    def detect_level(line):
-        for level in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
-            if f"[{level}]" in line:
-                return level
-        return "INFO"
-
-    log_path = os.path.join(os.path.dirname(DATABASE_PATH), "logs", "app.log")
-    log_lines = []
-
-    if os.path.exists(log_path):
-        with open(log_path, "r", encoding="utf-8") as f:
-            for line in reversed(f.readlines()[-500:]):  # Charge les 500 dernières lignes
-                line = line.replace("\n", " ").replace("\r", " ").strip()
-                if not line:
-                    continue
-                log_lines.append({
-                    "text": line,
-                    "level": detect_level(line)
-                })
-
-    return render_template("logs.html", log_lines=log_lines, translations=g.translations)
+    levels = _request_log_levels()
+    log_lines, cursor = log_reader.tail(LOG_PAGE_LINES, levels)
+    return render_template(
+        "logs.html",
+        log_lines=log_lines,
+        cursor=cursor,
+        levels=levels,
+        translations=g.translations,
+    )
 
 @app.route("/test_email", methods=["GET", "POST"])
 def test_email():
@@ -986,12 +980,10 @@ def format_datetime(dt_str):
 
 @app.route("/tasks")
 def tasks():
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM task_status")
     rows = {row["name"]: row for row in cursor.fetchall()}
-    conn.close()
 
     tasks = []
     for name, meta in TASKS.items():
@@ -1042,7 +1034,7 @@ def get_user_status(days_left, thresholds):
 def update_task_status(task_name, interval_seconds=None):
     now = datetime.now()
     next_run = (now + timedelta(seconds=interval_seconds)).strftime("%Y-%m-%d %H:%M:%S") if interval_seconds else None
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("""
         INSERT INTO task_status (name, last_run, next_run)
@@ -1052,11 +1044,9 @@ def update_task_status(task_name, interval_seconds=None):
             next_run = excluded.next_run
     """, (task_name, now.strftime("%Y-%m-%d %H:%M:%S"), next_run))
     conn.commit()
-    conn.close()
 
 def get_locale():
-    user_setting = get_settings()
-    return user_setting.get("default_language") or request.accept_languages.best_match(get_available_languages().keys()) or "en"
+    return settings_helper.get_setting("default_language") or request.accept_languages.best_match(get_available_languages().keys()) or "en"
 
 
 
@@ -1066,13 +1056,8 @@ def get_locale():
 
 
 def load_translations(lang_code):
-    path = os.path.join(os.path.dirname(__file__), "lang", f"{lang_code}.json")
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"❌ Erreur de chargement des traductions ({lang_code}): {e}")
-        return {}
+    """Catalogue figé de la langue (cf. i18n.py : chargé une fois, relu si le fichier change)."""
+    return i18n.get_catalog(lang_code)
 
 def _(key):
     return g.translations.get(key, key)
@@ -1087,44 +1072,20 @@ def inject_translation_function():
     return dict(_=safe_translate)
 
 def get_available_languages():
-    lang_dir = os.path.join(os.path.dirname(__file__), "lang")
-    langs = {}
-    for filename in os.listdir(lang_dir):
-        if filename.endswith(".json"):
-            code = filename[:-5]
-            try:
-                with open(os.path.join(lang_dir, filename), "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    label = str(data.get("lang_label", code) or code)
-                    langs[code] = label
-            except Exception as e:
-                print(f"❌ Erreur lecture {filename} : {e}")
-    return langs
-
-
-def _parse_date(d):
-    if not d:
-        return None
-    s = str(d).strip()
-    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
-        try:
-            return datetime.strptime(s.replace(" ", ""), fmt).date()
-        except Exception:
-            pass
-    return None
+    return i18n.available_languages()
 
-def get_all_users():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
+
+def get_all_users(ids=None):
+    conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT id, username, email, avatar, expiration_date, status FROM users")
+    where, params = _ids_filter("id", ids)
+    cur.execute(f"SELECT id, username, email, avatar, expiration_date, status FROM users WHERE 1{where}", params)
     rows = cur.fetchall()
-    conn.close()
 
     today = date.today()
     users = []
     for r in rows:
-        exp = _parse_date(r["expiration_date"])
+        exp = parse_date(r["expiration_date"])
         jours_restants = (exp - today).days if exp else None
         users.append({
             "id": r["id"],
@@ -1161,41 +1122,61 @@ def about():
         content = _("INFO file not found.")
     return render_template("about.html", info_content=content)
 
+@app.route("/api/db/explain")
+def api_db_explain():
+    """Plan d'exécution des requêtes chaudes (scans complets signalés par 'flagged')."""
+    from db_indexes import explain_hot_queries
+    report = explain_hot_queries()
+    return jsonify({
+        "queries": report,
+        "flagged": sum(1 for q in report if q["flagged"]),
+    })
+
 @app.route("/api/tasks")
 def api_tasks():
     tasks = get_all_tasks()
     return render_template("partials/tasks_table.html", tasks=tasks)
 
-user_refresh_flag = False
-
-def trigger_user_refresh_flag():
-    global user_refresh_flag
-    user_refresh_flag = True
-
-def clear_user_refresh_flag():
-    global user_refresh_flag
-    user_refresh_flag = False
+# --- Notifications de changement vers l'UI (cf. events.py) ---
 
-def should_refresh_users():
-    return user_refresh_flag
-
-# --- Triggers exposés pour les autres process (cron) ---
-
-@app.route("/api/trigger-refresh/users", methods=["POST"])
-def api_trigger_refresh_users():
-    trigger_user_refresh_flag()  # met le flag global du process Flask
+@app.route("/api/trigger-refresh/<kind>", methods=["POST"])
+def api_trigger_refresh(kind):
+    """Pour les outils externes (les process Vodum publient directement) : {"ids": [...]} optionnel."""
+    if kind not in events.KINDS:
+        return jsonify({"error": "Type inconnu"}), 404
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids") if isinstance(data, dict) else data
+    if ids is not None:
+        if not isinstance(data, dict) or not isinstance(ids, list) \
+                or not all(str(i).strip().isdigit() for i in ids):
+            return jsonify({"error": "ids doit être une liste d'identifiants entiers"}), 400
+        ids = [int(i) for i in ids]
+    events.publish(kind, ids)
     return "", 204
 
-@app.route("/api/trigger-refresh/libraries", methods=["POST"])
-def api_trigger_refresh_libraries():
-    trigger_library_refresh_flag()  # met le flag global du process Flask
-    return "", 204
 
-# (optionnel si tu veux un trigger serveurs aussi)
-@app.route("/api/trigger-refresh/servers", methods=["POST"])
-def api_trigger_refresh_servers():
-    trigger_server_refresh_flag()  # si tu as déjà cette fonction
-    return "", 204
+@app.route("/api/events")
+def api_events():
+    """Flux Server-Sent Events des changements (users / servers / libraries)."""
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("since")
+    seq = int(last_id) if last_id and last_id.isdigit() else events.current_seq()
+
+    def stream(seq):
+        yield "retry: 5000\n\n"
+        while True:
+            batch = events.wait_events(seq, timeout=15)
+            if not batch:
+                yield ": ping\n\n"  # garde la connexion ouverte derrière un proxy
+                continue
+            for event in batch:
+                seq = event["seq"]
+                yield events.format_sse(event)
+
+    return Response(
+        stream_with_context(stream(seq)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 def get_mail_days():
     """
@@ -1205,7 +1186,7 @@ def get_mail_days():
     - fin d'abonnement
     Retourne un dict avec les valeurs trouvées ou des valeurs par défaut.
     """
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute("""
@@ -1214,7 +1195,6 @@ def get_mail_days():
         WHERE type IN ('preavis', 'relance', 'fin')
     """)
     rows = cur.fetchall()
-    conn.close()
 
     values = {"preavis": 30, "relance": 7, "fin": 0}  # valeurs par défaut
 
@@ -1233,46 +1213,19 @@ def api_mail_days():
 
 @app.route("/api/users")
 def api_users():
-    users = get_all_users()
+    users = get_all_users(_request_ids())
     return render_template("partials/users_table.html", users=users)
 
-@app.route("/api/should-refresh/users")
-def api_should_refresh_users():
-    from flask import jsonify
-    return jsonify({"refresh": should_refresh_users()})
-
-@app.route("/api/clear-refresh/users", methods=["POST"])
-def api_clear_refresh_users():
-    clear_user_refresh_flag()
-    return "", 204
-
-server_refresh_flag = False
-
-def trigger_server_refresh_flag():
-    global server_refresh_flag
-    server_refresh_flag = True
-
-def clear_server_refresh_flag():
-    global server_refresh_flag
-    server_refresh_flag = False
-
-def should_refresh_servers():
-    return server_refresh_flag
-
 @app.route("/api/servers")
 def api_servers():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM servers")
+    where, params = _ids_filter("id", _request_ids())
+    cur.execute(f"SELECT * FROM servers WHERE 1{where}", params)
     rows = cur.fetchall()
 
-    cur.execute("""
-        SELECT us.server_id, COUNT(DISTINCT us.user_id) AS n
-        FROM user_servers us
-        GROUP BY us.server_id
-    """)
+    cur.execute(SERVER_USER_COUNTS_SQL)
     counts = {r["server_id"]: r["n"] for r in cur.fetchall()}
 
     servers = []
@@ -1282,57 +1235,69 @@ def api_servers():
         servers.append(d)
 
 
-    conn.close()
     return render_template("partials/servers_table.html", servers=servers)
 
 
-@app.route("/api/should-refresh/servers")
-def api_should_refresh_servers():
-    from flask import jsonify
-    return jsonify({"refresh": should_refresh_servers()})
-
-@app.route("/api/clear-refresh/servers", methods=["POST"])
-def api_clear_refresh_servers():
-    clear_server_refresh_flag()
-    return "", 204
-
 @app.route("/api/logs")
 def api_logs():
-    log_lines = get_log_lines()  # ta fonction existante
-    return render_template("partials/logs_table.html", log_lines=log_lines)
+    """
+    Lignes de log (plus récentes d'abord) en HTML partiel.
+    ?after=<curseur> : seulement les lignes écrites depuis ; le nouveau curseur est dans X-Log-Cursor.
+    """
+    levels = _request_log_levels()
+    after = request.args.get("after")
+    if after:
+        log_lines, cursor = log_reader.read_since(after, LOG_PAGE_LINES, levels)
+    else:
+        log_lines, cursor = log_reader.tail(LOG_PAGE_LINES, levels)
+    resp = make_response(render_template("partials/logs_table.html", log_lines=log_lines))
+    resp.headers["X-Log-Cursor"] = cursor
+    return resp
 
-library_refresh_flag = False
 
-def trigger_library_refresh_flag():
-    global library_refresh_flag
-    library_refresh_flag = True
+@app.route("/api/logs/events")
+def api_log_events():
+    """
+    Journal structuré (cf. log_store.py), plus récents d'abord. Filtres :
+    ?since=&until= (AAAA-MM-JJ ou ISO), level= (minimal), task=, run=, user_id=, server_id=,
+    q= (texte), limit=, before= (id, pour la page suivante).
+    """
+    args = request.args
+    try:
+        rows = log_store.query(
+            since=args.get("since"),
+            until=args.get("until"),
+            min_level=args.get("level"),
+            task=args.get("task"),
+            run_id=args.get("run"),
+            user_id=args.get("user_id"),
+            server_id=args.get("server_id"),
+            text=args.get("q"),
+            before_id=args.get("before"),
+            limit=args.get("limit", 200),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"events": rows, "next_before": rows[-1]["id"] if rows else None})
 
-def clear_library_refresh_flag():
-    global library_refresh_flag
-    library_refresh_flag = False
 
-def should_refresh_libraries():
-    return library_refresh_flag
+@app.route("/api/logs/runs")
+def api_log_runs():
+    """Dernières exécutions des tâches (?task=check_servers) : début, fin, nombre d'événements, pire niveau."""
+    try:
+        runs = log_store.recent_runs(request.args.get("task"), request.args.get("limit", 50))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"runs": runs})
 
 @app.route("/api/libraries")
 def api_libraries():
-    libraries = get_all_libraries()
+    libraries = get_all_libraries(_request_ids())
     return render_template("partials/libraries_table.html", libraries=libraries)
 
-@app.route("/api/should-refresh/libraries")
-def api_should_refresh_libraries():
-    from flask import jsonify
-    return jsonify({"refresh": should_refresh_libraries()})
-
-@app.route("/api/clear-refresh/libraries", methods=["POST"])
-def api_clear_refresh_libraries():
-    clear_library_refresh_flag()
-    return "", 204
-
 @app.route('/edit_user/<int:user_id>', methods=['GET', 'POST'])
 def edit_user(user_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
 
     user_id = int(user_id)  # S'assure que c'est bien un int (utile dans le POST aussi)
@@ -1343,7 +1308,6 @@ def edit_user(user_id):
         user = cursor.fetchone()
         if not user:
             flash("Utilisateur introuvable.", "danger")
-            conn.close()
             return redirect(url_for('get_users_page'))
 
         # Récupère les serveurs de type 'plex' auxquels cet utilisateur a accès
@@ -1391,7 +1355,6 @@ def edit_user(user_id):
         if not user:
             logger.warning(f"❌ [edit_user] Utilisateur {user_id} introuvable en base (POST)")
             flash("Utilisateur introuvable.", "danger")
-            conn.close()
             return redirect(url_for('get_users_page'))
         else:
             logger.info(f"👤 [edit_user] Utilisateur trouvé : username={user['username']} (id={user_id})")
@@ -1402,31 +1365,39 @@ def edit_user(user_id):
         second_email = request.form.get('second_email')
         firstname = request.form.get('firstname')
         lastname = request.form.get('lastname')
-        expiration_date = request.form.get('expiration_date')
+        raw_expiration = request.form.get('expiration_date')
+        expiration_date = normalize_date(raw_expiration)
+        if raw_expiration and expiration_date is None:
+            logger.warning(f"⚠️ [edit_user] Date d'expiration invalide ignorée : {raw_expiration!r}")
+            flash("⚠️ Date d'expiration invalide : date inchangée.", "warning")
+            expiration_date = user["expiration_date"]
         logger.info(f"📝 [edit_user] Mise à jour infos utilisateur : second_email={second_email}, firstname={firstname}, lastname={lastname}, expiration_date={expiration_date}")
 
-        # 3. Mets à jour l'utilisateur
-        cursor.execute("""
-            UPDATE users
-            SET second_email = ?, firstname = ?, lastname = ?, expiration_date = ?
-            WHERE id = ?
-        """, (second_email, firstname, lastname, expiration_date, user_id))
-        logger.info("[edit_user] Infos utilisateur mises à jour en base")
-
-        # 4. Gestion des accès aux bibliothèques
         selected_library_ids = request.form.getlist('library_ids')
         selected_library_ids = [int(x) for x in selected_library_ids]
-        logger.info(f"🗃️ [edit_user] Bibliothèques sélectionnées : {selected_library_ids}")
 
-        cursor.execute("DELETE FROM user_libraries WHERE user_id = ?", (user_id,))
-        logger.info(f"🗑️ [edit_user] Anciennes associations user_libraries supprimées pour user_id={user_id}")
+        with transaction():
+            # 3. Mets à jour l'utilisateur
+            cursor.execute("""
+                UPDATE users
+                SET second_email = ?, firstname = ?, lastname = ?, expiration_date = ?
+                WHERE id = ?
+            """, (second_email, firstname, lastname, expiration_date, user_id))
+            logger.info("[edit_user] Infos utilisateur mises à jour en base")
+
+            # 4. Gestion des accès aux bibliothèques
+            logger.info(f"🗃️ [edit_user] Bibliothèques sélectionnées : {selected_library_ids}")
+
+            cursor.execute("DELETE FROM user_libraries WHERE user_id = ?", (user_id,))
+            logger.info(f"🗑️ [edit_user] Anciennes associations user_libraries supprimées pour user_id={user_id}")
+
+            for lib_id in selected_library_ids:
+                cursor.execute(
+                    "INSERT INTO user_libraries (user_id, library_id) VALUES (?, ?)",
+                    (user_id, lib_id)
+                )
 
-        for lib_id in selected_library_ids:
-            cursor.execute(
-                "INSERT INTO user_libraries (user_id, library_id) VALUES (?, ?)",
-                (user_id, lib_id)
-            )
-        conn.commit()
+            events.publish("users", [user_id])
         logger.info(f"✅ [edit_user] Nouvelles associations user_libraries insérées ({len(selected_library_ids)} bibliothèques)")
 
         # 5. Synchronise Plex pour CHAQUE serveur (par noms de bibliothèques)
@@ -1487,7 +1458,6 @@ def edit_user(user_id):
             else:
                 logger.info(f"🚫 [edit_user] Retrait de tous les partages pour user={user['username']} sur serveur {srv['name']}")
 
-        conn.close()
         logger.info(f"🏁 [edit_user] POST terminé pour user_id={user_id}")
         flash("Accès mis à jour pour l'utilisateur !", "success")
         return redirect(url_for('get_users_page'))
@@ -1514,54 +1484,23 @@ def api_mailing_send_to_server():
             }), 400
 
         # ✅ Connexion directe à la base
-        conn = sqlite3.connect(DATABASE_PATH)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
+        conn = get_db()
 
-        # 🔧 Récupère tous les utilisateurs selon leur statut
-        cur.execute("""
-            SELECT id, email
-            FROM users
-            WHERE LOWER(status) IN ('actif', 'active', 'préavis', 'preavis', 'relance')
-              AND email IS NOT NULL
-              AND TRIM(email) <> ''
-        """)
-        users = cur.fetchall()
-        count = len(users)
+        # 🔧 Crée la campagne et alimente la file d'envoi (INSERT ... SELECT depuis users)
+        campaign_id, inserted = send_mail_queue.create_campaign(
+            conn, server_id, subject, html_content, attachment_path
+        )
 
-        if count == 0:
-            conn.close()
+        if campaign_id is None:
             logger.warning(f"[MAILING] Aucun utilisateur actif/préavis/relance trouvé pour la campagne du serveur {server_id}")
             return jsonify({
                 "ok": False,
                 "error": "Aucun utilisateur trouvé pour ce statut."
             }), 404
 
-        # 🔧 Crée la campagne
-        cur.execute("""
-            INSERT INTO mail_campaigns (server_id, subject, html_content, attachment_path, status, created_at)
-            VALUES (?, ?, ?, ?, 'pending', datetime('now'))
-        """, (server_id, subject, html_content, attachment_path))
-        campaign_id = cur.lastrowid
-
-        # 🔧 Alimente la file d'envoi
-        inserted = 0
-        for u in users:
-            email = (u["email"] or "").strip()
-            if not email:
-                continue
-            cur.execute("""
-                INSERT INTO mail_queue (campaign_id, user_id, server_id, subject, html_content, email, status)
-                VALUES (?, ?, ?, ?, ?, ?, 'pending')
-            """, (campaign_id, u["id"], server_id, subject, html_content, email))
-            inserted += 1
-
-        conn.commit()
-
         # ✅ Log clair après le commit
-        logger.info(f"[MAILING] Campagne #{campaign_id} créée pour {inserted}/{count} utilisateurs (serveur_id={server_id})")
+        logger.info(f"[MAILING] Campagne #{campaign_id} créée pour {inserted} utilisateurs (serveur_id={server_id})")
 
-        conn.close()
 
         return jsonify({
             "ok": True,
@@ -1572,7 +1511,7 @@ def api_mailing_send_to_server():
     except Exception as e:
         if conn:
             logger.error(f"[MAILING] Erreur création campagne : {e}")
-            conn.close()
+            conn.rollback()
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
@@ -1585,8 +1524,7 @@ def api_mailing_send_to_server():
 @app.route("/api/servers_list", methods=["GET"])
 def api_servers_list():
     try:
-        conn = sqlite3.connect(DATABASE_PATH, timeout=30)
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         cur = conn.cursor()
 
         cur.execute("""
@@ -1595,7 +1533,6 @@ def api_servers_list():
             ORDER BY name ASC
         """)
         servers = [dict(row) for row in cur.fetchall()]
-        conn.close()
 
         logger.info(f"/api/servers_list -> {len(servers)} serveurs trouvés")
         return jsonify(servers)
@@ -1645,8 +1582,10 @@ def upload_attachment():
 if __name__ == "__main__":
     create_tables_once()
     cleanup_locks()
-    settings = get_settings() 
-    logger.setLevel(logging.DEBUG if settings.get("log_level") == "DEBUG" else logging.INFO)
+    configure_levels()  # settings.log_level (ensuite relu à chaud par le thread d'écriture des logs)
     #start_background_jobs()
+    # Worker résident de la file mail (VODUM_MAIL_WORKER=0 si un process dédié tourne : send_mail_queue.py --worker)
+    if os.getenv("VODUM_MAIL_WORKER", "1") == "1":
+        send_mail_queue.start_worker()
     app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
 
@@ -1,12 +1,12 @@
 # /app/backup.py
 import os
-import shutil
 from datetime import datetime
-from config import DATABASE_PATH
+from config import APPDATA_DIR, DATABASE_PATH
 from logger import logger
+from db import backup_to
 from tasks import update_task_status
 
-BACKUP_DIR = "/app/appdata/backup"
+BACKUP_DIR = os.path.join(APPDATA_DIR, "backup")
 MAX_BACKUPS = 7  # Nombre max de fichiers à conserver
 
 def run_backup():
@@ -21,7 +21,7 @@ def run_backup():
     backup_file = os.path.join(BACKUP_DIR, f"database_{ts}.db")
 
     try:
-        shutil.copy2(DATABASE_PATH, backup_file)
+        backup_to(backup_file)
         logger.info(f"✅ Sauvegarde créée : {backup_file}")
         update_task_status("backup")            # ⬅️ ajouter
     except Exception as e:
@@ -1,21 +1,23 @@
 import discord
 import os
 import logger
-import requests
+import http_client
+import plex_cache
 import asyncio
-import sqlite3
 import xml.etree.ElementTree as ET
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 import update_plex_users  # Importer la fonction de mise à jour
-import json
 from datetime import datetime, timedelta
-from app import get_settings
+from settings_helper import get_settings, get_int
 #import logger
 from logger import logger
-from config import DATABASE_PATH
+from db import get_db, transaction
+from dates import parse_date, normalize_date
+import events
+import i18n
 
 config = get_settings()
 DISCORD_TOKEN = config.get("discord_token")
@@ -74,12 +76,13 @@ intents.members = True
 bot = commands.Bot(command_prefix="!", intents=intents)
 
 class Database:
+    """Curseur sur la connexion partagée du bot (cf. db.py)."""
     def __init__(self):
-        self.conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+        self.conn = get_db()
         self.cursor = self.conn.cursor()
 
     def close(self):
-        self.conn.close()
+        self.cursor.close()
 
 
 @tasks.loop(minutes=10)
@@ -108,7 +111,7 @@ async def on_command_error(ctx, error):
 # Vérification des permissions d'admin
 def is_admin():
     async def predicate(ctx):
-        admin_id = int(config.get("discord_user_id") or 0)
+        admin_id = get_int("discord_user_id")
         if ctx.author.id == admin_id:
             return True
         await ctx.send("⛔ Tu n'es pas autorisé à utiliser cette commande.")
@@ -133,7 +136,7 @@ async def plex_users(ctx):
         for srv in servers:
             try:
                 headers = {"X-Plex-Token": srv["plex_token"]}
-                response = requests.get(f"{srv['plex_url']}/status/sessions", headers=headers, timeout=10)
+                response = http_client.get(f"{srv['plex_url']}/status/sessions", headers=headers, timeout=10)
 
                 if response.status_code != 200:
                     await ctx.send(f"❌ Erreur de connexion à Plex pour {srv['name']}")
@@ -180,7 +183,7 @@ async def tautulli_stats(ctx):
             "cmd": "get_activity"
         }
         
-        response = requests.get(f"{TAUTULLI_URL}/api/v2", params=params, timeout=10)
+        response = http_client.get(f"{TAUTULLI_URL}/api/v2", params=params, timeout=10)
         data = response.json()
         
         if not data["response"]["data"]["sessions"]:
@@ -212,7 +215,7 @@ async def ajouter_plex(ctx, email: str):
             "Content-Type": "application/json"
         }
         
-        response = requests.post(
+        response = http_client.post(
             f"{PLEX_URL}/users",
             headers=headers,
             json={"email": email},
@@ -220,6 +223,7 @@ async def ajouter_plex(ctx, email: str):
         )
         
         if response.status_code == 201:
+            plex_cache.invalidate()
             await ctx.send(f"✅ Utilisateur {email} ajouté à Plex")
         else:
             await ctx.send(f"❌ Erreur lors de l'ajout de l'utilisateur : {response.text}")
@@ -352,8 +356,8 @@ async def abonnés(ctx):
 # ... (le reste du code)
 
 def get_db_connection():
-    """Retourne une connexion SQLite"""
-    return sqlite3.connect(DATABASE_PATH)
+    """Retourne la connexion SQLite partagée"""
+    return get_db()
 
 # Commande pour ajouter un utilisateur
 @bot.command()
@@ -361,31 +365,34 @@ def get_db_connection():
 async def abonner(ctx, member: discord.Member, jours: int, start_date: str = None):
     """📌 Abonne un utilisateur pour une durée définie."""
     try:
-        # Déterminer la date de début
+        # Déterminer la date de début (AAAA-MM-JJ ou JJ/MM/AAAA)
         if start_date:
-            try:
-                start_date = datetime.strptime(start_date, "%Y-%m-%d")
-            except ValueError:
+            start_date = parse_date(start_date)
+            if start_date is None:
                 await ctx.send("❌ Format de date invalide. Utilisez AAAA-MM-JJ.")
                 return
         else:
-            start_date = datetime.now()
+            start_date = datetime.now().date()
 
-        # Calculer la date de fin
-        end_date = start_date + timedelta(days=jours)
+        # Calculer la date de fin, stockée sous forme canonique dans expiration_date
+        end_date = normalize_date(start_date + timedelta(days=jours))
 
         # Mise à jour dans la base de données
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE users 
-            SET start_date = ?, end_date = ? 
-            WHERE discord_user_id = ?;
-        """, (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), str(member.id)))
-        conn.commit()
-        conn.close()
-
-        await ctx.send(f"✅ {member.mention} a été abonné jusqu'au {end_date.strftime('%Y-%m-%d')}.")
+        with transaction() as conn:
+            user_ids = [row["id"] for row in conn.execute("""
+                UPDATE users
+                SET expiration_date = ?
+                WHERE discord_user_id = ?
+                RETURNING id;
+            """, (end_date, str(member.id)))]
+            if user_ids:
+                events.publish("users", user_ids)
+
+        if not user_ids:
+            await ctx.send(f"👤 {member.mention} n'est lié à aucun utilisateur Plex.")
+            return
+
+        await ctx.send(f"✅ {member.mention} a été abonné jusqu'au {end_date}.")
 
     except Exception as e:
         logger.error(f"Erreur dans abonner : {e}")
@@ -436,13 +443,10 @@ async def list_plex_users(ctx):
 # Charger la langue depuis les variables d’environnement du conteneur
 LANGUAGE = os.getenv("BOT_LANGUAGE", "fr")  # Par défaut, français
 
-# Charger les traductions
-with open("translations.json", "r", encoding="utf-8") as f:
-    TRANSLATIONS = json.load(f)
-
+# Traductions : catalogues partagés avec l'app (cf. i18n.py, translations.json + lang/)
 def get_translation(key):
     """📌 Récupère la traduction pour une clé donnée."""
-    return TRANSLATIONS.get(LANGUAGE, {}).get(key, key)  # Retourne la clé si non trouvée
+    return i18n.translate(key, LANGUAGE)  # Retourne la clé si non trouvée
 
 # Log pour vérifier la langue chargée
 logger.info(f"🌍 Langue du bot chargée : {LANGUAGE}")
@@ -1,169 +1,224 @@
-# /app/check_libraries.py
-import sqlite3
-from logger import logger
-from config import DATABASE_PATH
-from plexapi.server import PlexServer
-from tasks import update_task_status
-
-
-def check_libraries():
-    logger.info("📚 Vérification des bibliothèques Plex")
-
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT id,
-               name,
-               server_id,
-               COALESCE(url, plex_url)   AS base_url,
-               COALESCE(token, plex_token) AS token
-        FROM servers
-        WHERE LOWER(type)='plex'
-    """)
-    servers = cursor.fetchall()
-    logger.info(f"🔧 {len(servers)} serveur(s) Plex trouvé(s) en base")
-
-    if not servers:
-        logger.warning("⚠️ Aucun serveur Plex configuré.")
-        conn.close()
-        return
-
-    for srv_dbid, srv_name, server_identifier, base_url, token in servers:
-        if not base_url or not token:
-            logger.error(f"❌ Serveur {srv_name} (id={srv_dbid}) sans url/token — ignoré")
-            continue
-
-        logger.info(f"🔍 Vérification des bibliothèques pour {srv_name} ({base_url})")
-
-        try:
-            plex = PlexServer(base_url, token)
-            plex_names = {s.title for s in plex.library.sections()}
-            logger.info(
-                f"📡 Bibliothèques trouvées sur Plex ({srv_name}): "
-                f"{', '.join(sorted(plex_names)) if plex_names else '(aucune)'}"
-            )
-        except Exception as e:
-            logger.error(f"❌ Connexion Plex échouée ({srv_name}, {base_url}) : {e}")
-            continue
-
-        cursor.execute("SELECT id, name FROM libraries WHERE server_id = ?", (server_identifier,))
-        db_libraries = cursor.fetchall()
-        db_names = {name for _, name in db_libraries}
-        logger.info(
-            f"💾 Bibliothèques en base ({srv_name}): "
-            f"{', '.join(sorted(db_names)) if db_names else '(aucune)'}"
-        )
-
-        deleted = 0
-        for lib_id, name in db_libraries:
-            if name not in plex_names:
-                logger.warning(f"🗑️ Suppression de la bibliothèque '{name}' du serveur {srv_name}")
-                cursor.execute("DELETE FROM libraries WHERE id = ?", (lib_id,))
-                conn.commit()
-                deleted += 1
-
-        if deleted == 0:
-            logger.info(f"✅ Aucune bibliothèque à supprimer pour le serveur {srv_name}")
-        else:
-            logger.info(f"🗑️ {deleted} bibliothèque(s) supprimée(s) pour le serveur {srv_name}")
-
-    cursor.execute("""
-        SELECT id, name, server_id
-        FROM libraries
-        WHERE server_id NOT IN (SELECT server_id FROM servers)
-           OR server_id IS NULL
-           OR server_id = ''
-    """)
-    orphans = cursor.fetchall()
-
-    if orphans:
-        for lib_id, name, server_id in orphans:
-            logger.warning(f"🗑️ Bibliothèque orpheline trouvée : '{name}' (server_id={server_id})")
-        cursor.executemany("DELETE FROM libraries WHERE id = ?", [(lib_id,) for lib_id, _, _ in orphans])
-        conn.commit()
-        logger.warning(f"🗑️ {len(orphans)} bibliothèque(s) orpheline(s) supprimée(s)")
-
-    # 👉 AJOUT ESSENTIEL : synchronise les accès utilisateurs depuis Plex
-    try:
-        sync_user_libraries_from_plex()
-    except Exception as e:
-        logger.error(f"❌ Erreur lors de sync_user_libraries_from_plex : {e}")
-
-    conn.close()
-    update_task_status("check_libraries")
-    logger.info("🏁 Vérification des bibliothèques terminée.")
-
-
-
-def sync_user_libraries_from_plex():
-    import sqlite3
-    from plexapi.server import PlexServer
-    from config import DATABASE_PATH
-    from logger import logger
-
-    logger.info("🔄 Synchronisation des accès bibliothèques pour tous les utilisateurs Plex...")
-
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, plex_url, plex_token, server_id FROM servers WHERE type='plex'")
-    servers = cur.fetchall()
-
-    for srv in servers:
-        logger.info(f"🖥️ Serveur {srv['server_id']} – {srv['plex_url']}")
-
-        try:
-            plex = PlexServer(srv["plex_url"], srv["plex_token"])
-            account = plex.myPlexAccount()
-        except Exception as e:
-            logger.error(f"❌ Impossible de se connecter au serveur Plex : {e}")
-            continue
-
-        cur.execute("SELECT id, username FROM users")
-        users = cur.fetchall()
-
-        for user in users:
-            username = user["username"]
-            user_id = user["id"]
-
-            try:
-                plex_user = account.user(username)
-            except:
-                logger.warning(f"⚠️ Utilisateur {username} non trouvé sur Plex.")
-                continue
-
-            shared_sections = []
-            for section in plex.library.sections():
-                try:
-                    if plex_user in section.sharedUsers:
-                        shared_sections.append(section.title)
-                except:
-                    pass
-
-            logger.info(f"👤 {username} → accès Plex : {shared_sections}")
-
-            cur.execute("DELETE FROM user_libraries WHERE user_id=?", (user_id,))
-
-            for title in shared_sections:
-                cur.execute("""
-                    SELECT id FROM libraries
-                    WHERE name=? AND server_id=?
-                """, (title, srv["server_id"]))
-                row = cur.fetchone()
-                if row:
-                    cur.execute("""
-                        INSERT INTO user_libraries (user_id, library_id)
-                        VALUES (?, ?)
-                    """, (user_id, row["id"]))
-
-    conn.commit()
-    conn.close()
-    logger.info("✅ Synchronisation user_libraries terminée !")
-
-
-
-if __name__ == "__main__":
-    check_libraries()
-    sync_user_libraries_from_plex()
+# /app/check_libraries.py
+from logger import logger
+from db import get_db, transaction
+from db_indexes import hot_query
+from plexapi.server import PlexServer
+from tasks import update_task_status
+from plex_fetch import PlexFetcher
+import http_client
+import events
+from update_plex_users import PLEX_SHARED_SERVERS_URL, fetch_shared_servers
+
+
+SERVER_LIBRARIES_SQL = hot_query(
+    "check_libraries.server_libraries",
+    "SELECT id, name FROM libraries WHERE server_id = ?",
+)
+
+# Accès relevés sur Plex (cf. sync_user_libraries_from_plex)
+PLEX_ACCESS_DDL = (
+    # clé primaire : le NOT EXISTS de la suppression y cherche chaque lien existant
+    """CREATE TEMP TABLE plex_access (
+           user_id INTEGER, section_id TEXT, server_id TEXT,
+           PRIMARY KEY (user_id, section_id, server_id)
+       )""",
+    "CREATE TEMP TABLE plex_access_servers (server_id TEXT PRIMARY KEY)",
+)
+
+DELETE_STALE_ACCESS_SQL = hot_query("check_libraries.delete_stale_access", """
+    DELETE FROM user_libraries
+    WHERE library_id IN (
+        SELECT l.id FROM libraries l
+        JOIN plex_access_servers ps ON ps.server_id = l.server_id
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM plex_access pa
+        JOIN libraries l ON l.section_id = pa.section_id AND l.server_id = pa.server_id
+        WHERE pa.user_id = user_libraries.user_id
+          AND l.id = user_libraries.library_id
+    )
+    RETURNING user_id
+""", setup=PLEX_ACCESS_DDL)
+
+INSERT_ACCESS_SQL = hot_query("check_libraries.insert_access", """
+    INSERT INTO user_libraries (user_id, library_id)
+    SELECT DISTINCT pa.user_id, l.id
+    FROM plex_access pa
+    JOIN libraries l ON l.section_id = pa.section_id AND l.server_id = pa.server_id
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_libraries ul
+        WHERE ul.user_id = pa.user_id AND ul.library_id = l.id
+    )
+    RETURNING user_id
+""", setup=PLEX_ACCESS_DDL, expect_scan=("pa",))
+
+
+def check_libraries():
+    logger.info("📚 Vérification des bibliothèques Plex")
+
+    conn = get_db()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT id,
+               name,
+               server_id,
+               COALESCE(url, plex_url)   AS base_url,
+               COALESCE(token, plex_token) AS token
+        FROM servers
+        WHERE LOWER(type)='plex'
+    """)
+    servers = cursor.fetchall()
+    logger.info(f"🔧 {len(servers)} serveur(s) Plex trouvé(s) en base")
+
+    if not servers:
+        logger.warning("⚠️ Aucun serveur Plex configuré.")
+        return
+
+    for srv_dbid, srv_name, server_identifier, base_url, token in servers:
+        if not base_url or not token:
+            logger.error(f"❌ Serveur {srv_name} (id={srv_dbid}) sans url/token — ignoré")
+            continue
+
+        logger.info(f"🔍 Vérification des bibliothèques pour {srv_name} ({base_url})")
+
+        try:
+            plex = PlexServer(base_url, token, session=http_client.get_session())
+            plex_names = {s.title for s in plex.library.sections()}
+            logger.info(
+                f"📡 Bibliothèques trouvées sur Plex ({srv_name}): "
+                f"{', '.join(sorted(plex_names)) if plex_names else '(aucune)'}"
+            )
+        except Exception as e:
+            logger.error(f"❌ Connexion Plex échouée ({srv_name}, {base_url}) : {e}")
+            continue
+
+        cursor.execute(SERVER_LIBRARIES_SQL, (server_identifier,))
+        db_libraries = cursor.fetchall()
+        db_names = {name for _, name in db_libraries}
+        logger.info(
+            f"💾 Bibliothèques en base ({srv_name}): "
+            f"{', '.join(sorted(db_names)) if db_names else '(aucune)'}"
+        )
+
+        deleted = 0
+        for lib_id, name in db_libraries:
+            if name not in plex_names:
+                logger.warning(f"🗑️ Suppression de la bibliothèque '{name}' du serveur {srv_name}")
+                cursor.execute("DELETE FROM libraries WHERE id = ?", (lib_id,))
+                events.publish("libraries", [lib_id])
+                conn.commit()
+                deleted += 1
+
+        if deleted == 0:
+            logger.info(f"✅ Aucune bibliothèque à supprimer pour le serveur {srv_name}")
+        else:
+            logger.info(f"🗑️ {deleted} bibliothèque(s) supprimée(s) pour le serveur {srv_name}")
+
+    cursor.execute("""
+        SELECT id, name, server_id
+        FROM libraries
+        WHERE server_id NOT IN (SELECT server_id FROM servers)
+           OR server_id IS NULL
+           OR server_id = ''
+    """)
+    orphans = cursor.fetchall()
+
+    if orphans:
+        for lib_id, name, server_id in orphans:
+            logger.warning(f"🗑️ Bibliothèque orpheline trouvée : '{name}' (server_id={server_id})")
+        cursor.executemany("DELETE FROM libraries WHERE id = ?", [(lib_id,) for lib_id, _, _ in orphans])
+        events.publish("libraries", [lib_id for lib_id, _, _ in orphans])
+        conn.commit()
+        logger.warning(f"🗑️ {len(orphans)} bibliothèque(s) orpheline(s) supprimée(s)")
+
+    # 👉 AJOUT ESSENTIEL : synchronise les accès utilisateurs depuis Plex
+    try:
+        sync_user_libraries_from_plex()
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de sync_user_libraries_from_plex : {e}")
+
+    update_task_status("check_libraries")
+    logger.info("🏁 Vérification des bibliothèques terminée.")
+
+
+
+def sync_user_libraries_from_plex():
+    """
+    Recalcule user_libraries à partir d'un seul appel plex.tv /shared_servers par serveur
+    (carte complète utilisateur → bibliothèques), appliqué en une transaction.
+    """
+    logger.info("🔄 Synchronisation des accès bibliothèques pour tous les utilisateurs Plex...")
+
+    conn = get_db()
+    servers = conn.execute("""
+        SELECT server_id, plex_token
+        FROM servers
+        WHERE type = 'plex'
+          AND server_id IS NOT NULL AND server_id != ''
+          AND plex_token IS NOT NULL AND plex_token != ''
+    """).fetchall()
+    users_by_plex_id = {
+        row["plex_id"]: row["id"]
+        for row in conn.execute("SELECT id, plex_id FROM users WHERE plex_id IS NOT NULL")
+    }
+
+    synced_servers = []
+    access_rows = []
+
+    with PlexFetcher() as fetcher:
+        for srv in servers:
+            fetcher.submit(PLEX_SHARED_SERVERS_URL.format(server_id=srv["server_id"]), srv["plex_token"])
+
+        for srv in servers:
+            try:
+                shared = fetch_shared_servers(srv["server_id"], srv["plex_token"], fetcher)
+            except Exception as e:
+                # Serveur ignoré : ses liens existants sont conservés tels quels
+                logger.error(f"❌ Impossible de récupérer les partages du serveur {srv['server_id']} : {e}")
+                continue
+
+            synced_servers.append((srv["server_id"],))
+            for plex_id, libs in shared.items():
+                user_id = users_by_plex_id.get(plex_id)
+                if user_id is None:
+                    logger.debug(f"⏭️ Utilisateur Plex {plex_id} inconnu en base — ignoré")
+                    continue
+                for lib in libs:
+                    access_rows.append((user_id, str(lib["section_id"]), lib["server_id"]))
+
+            logger.info(f"🖥️ Serveur {srv['server_id']} : {len(shared)} utilisateur(s) avec partages")
+
+    if not synced_servers:
+        logger.warning("⚠️ Aucun serveur Plex n'a pu être synchronisé.")
+        return
+
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("DROP TABLE IF EXISTS temp.plex_access")
+        cur.execute("DROP TABLE IF EXISTS temp.plex_access_servers")
+        for ddl in PLEX_ACCESS_DDL:
+            cur.execute(ddl)
+        cur.executemany("INSERT OR IGNORE INTO plex_access VALUES (?, ?, ?)", access_rows)
+        cur.executemany("INSERT OR IGNORE INTO plex_access_servers VALUES (?)", synced_servers)
+
+        # ➖ Liens vers les bibliothèques des serveurs synchronisés qui ne sont plus partagés
+        removed_for = [row["user_id"] for row in cur.execute(DELETE_STALE_ACCESS_SQL)]
+
+        # ➕ Nouveaux liens
+        added_for = [row["user_id"] for row in cur.execute(INSERT_ACCESS_SQL)]
+
+        cur.execute("DROP TABLE temp.plex_access")
+        cur.execute("DROP TABLE temp.plex_access_servers")
+
+        # Lignes des utilisateurs dont les accès ont changé, publié avec la synchro
+        if removed_for or added_for:
+            events.publish("users", removed_for + added_for)
+
+    logger.info(f"✅ Synchronisation user_libraries terminée ! ({len(added_for)} ajout(s), {len(removed_for)} suppression(s))")
+
+
+
+if __name__ == "__main__":
+    check_libraries()
+    sync_user_libraries_from_plex()
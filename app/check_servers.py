@@ -1,46 +1,22 @@
-import os
 import time
 import sqlite3
 import requests
+import http_client
+import plex_cache
+import events
 from logger import logger
+from db import get_db, transaction
 from datetime import datetime, timezone
 import xml.etree.ElementTree as ET
 
 # --- Configuration ---
-DATABASE_PATH = "/app/appdata/database.db"
 UPDATE_INTERVAL = 3600  # utilisé seulement par auto_check()
-BASE_URL = os.getenv("VODUM_API_BASE", "http://127.0.0.1:5000")
-
-
-# --- Helpers DB ---
-def open_db():
-    """Connexion courte et robuste à SQLite."""
-    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
-    conn.row_factory = sqlite3.Row
-    # réduire les locks
-    try:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA busy_timeout=5000;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-    except Exception:
-        pass
-    return conn
-
-
-# --- Notif UI ---
-def trigger_refresh_servers():
-    """Demande au serveur Flask de rafraîchir la page Serveurs."""
-    try:
-        requests.post(f"{BASE_URL}/api/trigger-refresh/servers", timeout=2)
-    except Exception:
-        # ne pas casser le script juste pour la notif UI
-        pass
 
 
 # --- Checks externes ---
 def check_plex_server(url, token):
     try:
-        res = requests.get(f"{url}/identity", headers={"X-Plex-Token": token}, timeout=5)
+        res = http_client.get(f"{url}/identity", headers={"X-Plex-Token": token}, timeout=5, retries=1)
         if res.status_code == 200:
             return "🟢 OK"
         else:
@@ -62,7 +38,7 @@ def check_plex_server(url, token):
 
 def check_tautulli(url, api_key):
     try:
-        res = requests.get(f"{url}/api/v2?apikey={api_key}&cmd=status", timeout=5)
+        res = http_client.get(f"{url}/api/v2?apikey={api_key}&cmd=status", timeout=5, retries=1)
         return "🟢 OK" if res.status_code == 200 else "🔴 Erreur"
     except Exception:
         return "🔴 Injoignable"
@@ -70,7 +46,7 @@ def check_tautulli(url, api_key):
 
 def get_server_name_from_plex_tv(server_id, plex_token):
     try:
-        res = requests.get(
+        res = plex_cache.get(
             "https://plex.tv/api/resources?includeHttps=1",
             headers={"X-Plex-Token": plex_token},
             timeout=30,
@@ -92,7 +68,7 @@ def update_statuses():
     now_utc = datetime.now(timezone.utc)
     last_checked = now_utc.isoformat()
 
-    conn = open_db()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT id, plex_url, plex_token, tautulli_url, tautulli_api_key, name FROM servers")
     servers = cursor.fetchall()
@@ -128,7 +104,7 @@ def update_statuses():
 
         # ✅ Vérif Plex /identity
         try:
-            res = requests.get(f"{plex_url}/identity", headers={"X-Plex-Token": plex_token}, timeout=5)
+            res = http_client.get(f"{plex_url}/identity", headers={"X-Plex-Token": plex_token}, timeout=5, retries=1)
             if res.status_code == 200:
                 plex_status = "🟢 OK"
                 xml = ET.fromstring(res.text)
@@ -151,7 +127,7 @@ def update_statuses():
         # ✅ Vérif Tautulli
         if tautulli_url and tautulli_api_key:
             try:
-                tres = requests.get(f"{tautulli_url}/api/v2?apikey={tautulli_api_key}&cmd=status", timeout=5)
+                tres = http_client.get(f"{tautulli_url}/api/v2?apikey={tautulli_api_key}&cmd=status", timeout=5, retries=1)
                 tautulli_status = "🟢 OK" if tres.status_code == 200 else "🔴 Erreur"
             except Exception:
                 tautulli_status = "🔴 Injoignable"
@@ -187,35 +163,26 @@ def update_statuses():
             logger.error(f"❌ SQLite verrouillée lors de l’update serveur ID={sid} : {e}")
             continue
 
+    # Notifie l’UI (lignes vérifiées), commité avec les mises à jour
+    events.publish("servers", [row["id"] for row in servers])
     conn.commit()
-    conn.close()
     logger.info("✅ Statuts et métadonnées mises à jour.")
 
-    # Notifie l’UI (flag refresh)
-    trigger_refresh_servers()
-
 
 # --- Suivi d'exécution ---
 def update_task_status(task_name: str):
     """Marque la dernière exécution de la tâche dans task_status."""
     try:
-        conn = open_db()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT OR REPLACE INTO task_status (name, last_run, next_run)
-            VALUES (?, ?, NULL)
-            """,
-            (task_name, datetime.now(timezone.utc).isoformat()),
-        )
-        conn.commit()
+        with transaction() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO task_status (name, last_run, next_run)
+                VALUES (?, ?, NULL)
+                """,
+                (task_name, datetime.now(timezone.utc).isoformat()),
+            )
     except Exception as e:
         logger.warning(f"⚠️ Impossible de mettre à jour task_status pour {task_name} : {e}")
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
 
 # --- Boucle auto si besoin (pas utilisée par le cron) ---
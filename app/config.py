@@ -1 +1,6 @@
-DATABASE_PATH = "/app/appdata/database.db"
+import os
+
+# Données persistantes (base, logs, sauvegardes) ; VODUM_APPDATA permet de les placer ailleurs
+# (lancement hors conteneur, tests)
+APPDATA_DIR = os.getenv("VODUM_APPDATA", "/app/appdata")
+DATABASE_PATH = os.path.join(APPDATA_DIR, "database.db")
@@ -0,0 +1,46 @@
+# /app/dates.py
+"""
+Dates d'expiration : une seule forme stockée en base, AAAA-MM-JJ (ISO).
+
+- parse_date(value)     : date() depuis AAAA-MM-JJ[...] ou JJ/MM/AAAA (anciennes saisies), sinon None
+- normalize_date(value) : chaîne canonique AAAA-MM-JJ, ou None si vide / illisible
+
+La forme ISO se compare en texte : `expiration_date BETWEEN ? AND ?` ou
+`expiration_date < date('now', 'localtime')` utilisent idx_users_expiration, sans re-parser
+chaque ligne en Python. Ne pas envelopper la colonne (DATE(expiration_date)...) : l'index
+ne serait plus utilisé.
+"""
+from datetime import date, datetime
+
+ISO_FORMAT = "%Y-%m-%d"
+# GLOB d'une date déjà canonique (utilisé par la migration de update_vodum)
+ISO_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"
+
+_FORMATS = (ISO_FORMAT, "%d/%m/%Y")
+
+
+def parse_date(value):
+    """Accepte une date, AAAA-MM-JJ (avec heure éventuelle) ou JJ/MM/AAAA ; renvoie date() ou None."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    s = str(value).strip().replace(" ", "")
+    for fmt in _FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            continue
+    # ISO avec heure : 2025-01-31T00:00:00, 2025-01-31 00:00:00
+    try:
+        return datetime.fromisoformat(str(value).strip().replace("Z", "+00:00")).date()
+    except ValueError:
+        return None
+
+
+def normalize_date(value):
+    """Forme canonique stockée en base (AAAA-MM-JJ), ou None si la valeur est vide ou illisible."""
+    d = parse_date(value)
+    return d.strftime(ISO_FORMAT) if d else None
@@ -0,0 +1,116 @@
+# /app/db.py
+"""
+Accès SQLite partagé par l'app Flask, les scripts cron et le bot Discord.
+
+- get_db()      : connexion du thread courant (créée une fois, réutilisée)
+- transaction() : bloc `with` qui commit en sortie, rollback sur exception
+- on_commit(fn) : appelle fn() après le commit du bloc transaction() le plus externe
+- close_db()    : ferme la connexion du thread courant (fin de requête / de script)
+
+Toutes les connexions sont ouvertes avec les mêmes pragmas (WAL, busy_timeout,
+synchronous=NORMAL) pour éviter les "database is locked" pendant les syncs.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import DATABASE_PATH
+
+CONNECT_TIMEOUT = 30      # secondes (attente d'un verrou côté module sqlite3)
+BUSY_TIMEOUT_MS = 5000    # millisecondes (attente d'un verrou côté SQLite)
+
+_local = threading.local()
+
+
+def _configure(conn: sqlite3.Connection):
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+    except sqlite3.DatabaseError:
+        # base en lecture seule / fichier pas encore créé : on garde les défauts
+        pass
+
+
+def get_db() -> sqlite3.Connection:
+    """Retourne la connexion SQLite du thread courant (ouverte à la demande)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_PATH, timeout=CONNECT_TIMEOUT)
+        _configure(conn)
+        _local.conn = conn
+        _local.depth = 0
+        _local.on_commit = []
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Transaction sur la connexion du thread courant.
+    Réentrant : seul le bloc le plus externe commit (ou rollback).
+    """
+    conn = get_db()
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth -= 1
+        if _local.depth == 0:
+            _local.on_commit = []
+            conn.rollback()
+        raise
+    else:
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn.commit()
+            callbacks, _local.on_commit = _local.on_commit, []
+            for callback in callbacks:
+                callback()
+
+
+def on_commit(callback):
+    """
+    Appelle callback() une fois les écritures en cours visibles des autres connexions :
+    après le commit du bloc transaction() le plus externe (jamais en cas de rollback),
+    ou tout de suite hors transaction.
+    """
+    if getattr(_local, "depth", 0) > 0:
+        _local.on_commit.append(callback)
+    else:
+        callback()
+
+
+def close_db():
+    """Ferme la connexion du thread courant (rollback de tout ce qui n'a pas été commit)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    _local.depth = 0
+    _local.on_commit = []
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def backup_to(dest_path: str):
+    """Copie cohérente de la base (API backup SQLite, WAL inclus) vers dest_path."""
+    dest = sqlite3.connect(dest_path)
+    try:
+        get_db().backup(dest)
+    finally:
+        dest.close()
+
+
+def restore_from(src_path: str):
+    """Remplace le contenu de la base par celui de src_path (via la connexion courante)."""
+    src = sqlite3.connect(src_path)
+    try:
+        src.backup(get_db())
+    finally:
+        src.close()
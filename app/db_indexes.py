@@ -0,0 +1,174 @@
+# /app/db_indexes.py
+"""
+Index secondaires des tables "chaudes" + rapport EXPLAIN QUERY PLAN.
+
+- ensure_indexes(cur)   : crée les index manquants (appelé par update_vodum au démarrage)
+- hot_query(...)        : déclare une requête chaude (appelé par le module qui l'exécute)
+- explain_hot_queries() : passe chaque requête déclarée dans EXPLAIN QUERY PLAN
+                          et signale les scans complets de table
+
+Usage manuel : python3 db_indexes.py
+"""
+import importlib
+
+from db import get_db
+from logger import logger
+
+
+# (nom, table, colonnes) — CREATE INDEX IF NOT EXISTS, donc idempotent
+INDEXES = [
+    ("idx_users_status",             "users",          "status, expiration_date"),
+    ("idx_users_expiration",         "users",          "expiration_date"),
+    ("idx_users_discord_id",         "users",          "discord_id"),
+    ("idx_users_discord_user_id",    "users",          "discord_user_id"),
+    ("idx_users_plex_id",            "users",          "plex_id"),
+    ("idx_sent_emails_lookup",       "sent_emails",    "user_id, type, expiration_snapshot"),
+    ("idx_mail_queue_campaign",      "mail_queue",     "campaign_id, status"),
+    ("idx_mail_queue_status",        "mail_queue",     "status, lease_expires_at"),
+    ("idx_mail_queue_reminder",      "mail_queue",     "user_id, reminder_type"),
+    ("idx_libraries_server_name",    "libraries",      "server_id, name"),
+    ("idx_user_libraries_library",   "user_libraries", "library_id"),
+    ("idx_user_servers_server",      "user_servers",   "server_id, user_id"),
+]
+
+
+# Requêtes des chemins chauds, déclarées par les modules qui les exécutent (cf. hot_query) :
+# le rapport porte toujours sur le SQL réellement exécuté. Clé = nom "module.requête".
+HOT_QUERIES = {}
+
+# Modules importés par explain_hot_queries() pour que leurs requêtes soient déclarées.
+# app.py déclare les siennes à son import : elles figurent dans /api/db/explain.
+HOT_QUERY_MODULES = (
+    "send_reminder_emails",
+    "delete_expired_users",
+    "disable_expired_users",
+    "send_mail_queue",
+    "expirations",
+    "update_user_status",
+    "rebuild_user_servers",
+    "update_plex_users",
+    "check_libraries",
+)
+
+
+def hot_query(name, sql, setup=(), expect_scan=None):
+    """
+    Déclare une requête chaude pour le rapport EXPLAIN et retourne `sql` tel quel :
+        CLAIM_SQL = hot_query("send_mail_queue.claim", "UPDATE mail_queue ...")
+    expect_scan=True : le scan complet est voulu (la requête lit toute la table).
+    expect_scan=("t",) : seuls les scans de ces tables (alias tels qu'affichés dans le plan) sont voulus,
+                         ex. une petite table ou une table temporaire qui pilote la jointure.
+    setup : requêtes exécutées avant l'EXPLAIN (tables temporaires...), annulées ensuite.
+    """
+    HOT_QUERIES[name] = {"name": name, "sql": sql, "setup": tuple(setup), "expect_scan": expect_scan}
+    return sql
+
+
+def ensure_indexes(cur) -> int:
+    """Crée les index manquants. Retourne le nombre d'index réellement ajoutés."""
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    existing = {row[0] for row in cur.fetchall()}
+
+    created = 0
+    for name, table, columns in INDEXES:
+        if name in existing:
+            logger.debug(f"✔️ Index '{name}' déjà présent")
+            continue
+        # Les anciennes migrations ont pu retirer des colonnes (ex: users.discord_id)
+        cur.execute(f"PRAGMA table_info({table})")
+        table_columns = {row[1] for row in cur.fetchall()}
+        missing = [c.strip() for c in columns.split(",") if c.strip() not in table_columns]
+        if missing:
+            logger.debug(f"⏭️ Index '{name}' ignoré (colonnes absentes dans '{table}' : {missing})")
+            continue
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+        logger.info(f"➕ Index '{name}' créé sur {table}({columns})")
+        created += 1
+
+    if created:
+        # Donne au planificateur des statistiques à jour pour choisir les nouveaux index
+        cur.execute("ANALYZE")
+    return created
+
+
+def _is_full_scan(detail: str) -> bool:
+    # "SCAN users" = table lue entièrement ; "SEARCH ..." ou "... USING INDEX" = accès indexé
+    return detail.startswith("SCAN ") and "INDEX" not in detail
+
+
+def _unexpected_scans(full_scans, expect_scan):
+    if expect_scan is True:
+        return []
+    expected = set(expect_scan or ())
+    return [d for d in full_scans if d.split()[1] not in expected]
+
+
+def _explain(conn, q):
+    params = [None] * q["sql"].count("?")
+    setup = q["setup"]
+    if not setup:
+        return conn.execute(f"EXPLAIN QUERY PLAN {q['sql']}", params).fetchall()
+    conn.execute("SAVEPOINT explain_setup")
+    try:
+        for stmt in setup:
+            conn.execute(stmt)
+        return conn.execute(f"EXPLAIN QUERY PLAN {q['sql']}", params).fetchall()
+    finally:
+        conn.execute("ROLLBACK TO explain_setup")
+        conn.execute("RELEASE explain_setup")
+
+
+def _import_hot_query_modules():
+    """Importe les modules déclarants ; retourne {module: erreur} pour ceux qui n'ont pas pu l'être."""
+    failed = {}
+    for module in HOT_QUERY_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            failed[module] = str(e)
+    return failed
+
+
+def explain_hot_queries():
+    """
+    Retourne une liste de dicts :
+      {name, plan: [detail...], full_scans: [detail...], flagged: bool, error}
+    Un module déclarant impossible à importer donne une entrée en erreur à son nom.
+    """
+    failed = _import_hot_query_modules()
+    conn = get_db()
+    report = [
+        {"name": module, "plan": [], "full_scans": [], "flagged": False, "error": f"import impossible ({error})"}
+        for module, error in failed.items()
+    ]
+    for q in HOT_QUERIES.values():
+        entry = {"name": q["name"], "plan": [], "full_scans": [], "flagged": False, "error": None}
+        try:
+            entry["plan"] = [row["detail"] for row in _explain(conn, q)]
+            entry["full_scans"] = [d for d in entry["plan"] if _is_full_scan(d)]
+            entry["flagged"] = bool(_unexpected_scans(entry["full_scans"], q.get("expect_scan")))
+        except Exception as e:
+            entry["error"] = str(e)
+        report.append(entry)
+    return report
+
+
+def log_explain_report():
+    report = explain_hot_queries()
+    flagged = 0
+    for entry in report:
+        if entry["error"]:
+            logger.warning(f"⚠️ {entry['name']} : requête invalide ({entry['error']})")
+        elif entry["flagged"]:
+            flagged += 1
+            logger.warning(f"🐢 {entry['name']} : scan complet → {' | '.join(entry['full_scans'])}")
+        else:
+            logger.info(f"✅ {entry['name']} : {' | '.join(entry['plan'])}")
+    logger.info(f"📊 {len(report)} requêtes analysées, {flagged} scan(s) complet(s) signalé(s)")
+    return report
+
+
+if __name__ == "__main__":
+    # Les modules déclarent leurs requêtes dans le module "db_indexes", pas dans __main__
+    import db_indexes
+    db_indexes.log_explain_report()
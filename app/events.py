@@ -0,0 +1,178 @@
+# /app/events.py
+"""
+Bus de notifications de changement partagé par l'app Flask, les scripts cron et le bot Discord.
+
+Les événements sont des lignes de la table change_log (base SQLite commune) : n'importe quel
+process peut publier, n'importe quel process peut lire depuis la dernière séquence vue.
+
+- publish(kind, ids=None)          : signale un changement ("users", "servers", "libraries"),
+                                     avec les id (clé primaire) des lignes touchées si connus
+- read_since(last_seq, kinds=None) : événements de séquence > last_seq (sans attendre)
+- wait_events(last_seq, timeout)   : idem, en attendant au plus timeout s s'il n'y en a pas
+- format_sse(event)                : encode un événement au format text/event-stream
+
+Appelé dans une transaction (cf. db.transaction), publish est commité avec la modification
+qu'il annonce. Les séquences (AUTOINCREMENT) ne sont jamais réutilisées : un lecteur qui
+revient avec une séquence purgée, ou plus grande que la dernière (base restaurée), reçoit
+un seul événement kind="*" qui demande un rechargement complet.
+
+Côté UI, la séquence est renvoyée au navigateur comme `id:` SSE (route /api/events) :
+à la reconnexion, EventSource renvoie Last-Event-ID et on reprend là où il s'était arrêté.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from db import get_db, on_commit, transaction
+from logger import logger
+
+KINDS = ("users", "servers", "libraries")
+KEEP_EVENTS = 10000    # événements gardés dans change_log pour les reprises
+PRUNE_EVERY = 100      # purge tous les N événements publiés
+POLL_INTERVAL = 0.5    # secondes entre deux vérifications des écritures des autres process
+READ_LIMIT = 500       # événements renvoyés au plus par lecture
+
+SOURCE = f"{os.path.basename(sys.argv[0] or 'python')}:{os.getpid()}"
+
+# Dernière séquence connue dans ce process (publications locales + surveillance de la base)
+_cond = threading.Condition()
+_head = 0
+_watcher = None
+
+
+def ensure_tables(cur):
+    """Crée change_log si besoin (appelé par update_vodum au démarrage)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            ids TEXT,                                  -- liste JSON, NULL = tout recharger
+            source TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _advance(seq):
+    global _head
+    with _cond:
+        if seq > _head:
+            _head = seq
+            _cond.notify_all()
+
+
+def publish(kind, ids=None):
+    """
+    Publie un changement. ids=None : la liste entière est à recharger.
+    Retourne la séquence, ou None si l'événement n'a pas pu être écrit
+    (une notification ne doit jamais faire échouer la tâche qui l'envoie).
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Type d'événement inconnu : {kind}")
+    payload = json.dumps(sorted({int(i) for i in ids})) if ids is not None else None
+    try:
+        with transaction() as conn:
+            seq = conn.execute(
+                "INSERT INTO change_log (kind, ids, source) VALUES (?, ?, ?)",
+                (kind, payload, SOURCE),
+            ).lastrowid
+            if seq % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM change_log WHERE seq <= ?", (seq - KEEP_EVENTS,))
+            # Réveil des lecteurs du process seulement une fois la ligne commitée (transaction
+            # englobante comprise) : avant, ils ne la verraient pas et la sauteraient
+            on_commit(lambda: _advance(seq))
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ Notification '{kind}' non publiée : {e}")
+        return None
+    return seq
+
+
+def current_seq():
+    """Dernière séquence attribuée (0 si aucun événement n'a jamais été publié)."""
+    row = get_db().execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'change_log'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def _row_to_event(row):
+    return {
+        "seq": row["seq"],
+        "kind": row["kind"],
+        "ids": json.loads(row["ids"]) if row["ids"] is not None else None,
+    }
+
+
+def read_since(last_seq, kinds=None, limit=READ_LIMIT):
+    """
+    Événements de séquence > last_seq, dans l'ordre (filtrés sur `kinds` si fourni).
+    Si last_seq est inconnu (purgé, ou d'avant une restauration de la base), retourne
+    un seul événement kind="*" à la séquence courante.
+    """
+    conn = get_db()
+    head = current_seq()
+    oldest = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+    if last_seq > head or (oldest is not None and last_seq < oldest - 1):
+        return [{"seq": head, "kind": "*", "ids": None}]
+
+    sql = "SELECT seq, kind, ids FROM change_log WHERE seq > ?"
+    params = [last_seq]
+    if kinds:
+        sql += f" AND kind IN ({','.join('?' * len(kinds))})"
+        params += list(kinds)
+    sql += " ORDER BY seq LIMIT ?"
+    params.append(limit)
+    return [_row_to_event(r) for r in conn.execute(sql, params).fetchall()]
+
+
+def _watch():
+    """Thread de surveillance : détecte les événements publiés par les autres process."""
+    conn = get_db()
+    version = None
+    while True:
+        try:
+            # data_version ne change que si un autre process a écrit dans la base
+            v = conn.execute("PRAGMA data_version").fetchone()[0]
+            if v != version:
+                version = v
+                _advance(current_seq())
+        except sqlite3.Error as e:
+            logger.debug(f"🔁 Surveillance change_log : {e}")
+        time.sleep(POLL_INTERVAL)
+
+
+def _ensure_watcher():
+    global _watcher
+    with _cond:
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch, name="events-watcher", daemon=True)
+            _watcher.start()
+
+
+def wait_events(last_seq, timeout=15.0, kinds=None):
+    """Comme read_since, mais attend au plus `timeout` secondes si rien n'est encore publié."""
+    events = read_since(last_seq, kinds)
+    if events:
+        return events
+    _ensure_watcher()
+    deadline = time.monotonic() + timeout
+    while True:
+        with _cond:
+            if _head <= last_seq:
+                _cond.wait(max(0.0, deadline - time.monotonic()))
+            seen = _head
+        if seen > last_seq:
+            events = read_since(last_seq, kinds)
+            if events:
+                return events
+            # événements d'autres types : on continue d'attendre à partir de la nouvelle tête
+            last_seq = seen
+        if time.monotonic() >= deadline:
+            return []
+
+
+def format_sse(event):
+    return f"id: {event['seq']}\nevent: change\ndata: {json.dumps(event)}\n\n"
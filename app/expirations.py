@@ -0,0 +1,67 @@
+# /app/expirations.py
+"""
+Prolongation groupée des abonnements (temps offert par serveur, bibliothèque ou statut).
+
+- extend_expirations(days, ...) : un seul UPDATE ... RETURNING sur users, publié sur le bus d'événements
+
+Les filtres sont des IN (sous-requête) plutôt que des EXISTS corrélés : les utilisateurs ciblés
+sont trouvés par index (idx_user_servers_server, idx_user_libraries_library) au lieu de parcourir users.
+"""
+import events
+from dates import ISO_GLOB
+from db import transaction
+from db_indexes import hot_query
+
+
+# {where} = filtres joints par AND ; paramètres : (days, *paramètres des filtres)
+EXTEND_SQL = f"""
+    UPDATE users
+    SET expiration_date = date(
+        CASE
+            WHEN expiration_date GLOB '{ISO_GLOB}'
+             AND expiration_date > date('now', 'localtime') THEN expiration_date
+            ELSE date('now', 'localtime')
+        END,
+        '+' || ? || ' days'
+    )
+    WHERE {{where}}
+    RETURNING id
+"""
+
+# Filtres cumulables
+BY_SERVER_FILTER = """users.id IN (
+        SELECT us.user_id FROM user_servers us JOIN servers s ON s.server_id = us.server_id
+        WHERE s.id = ?
+    )"""
+BY_STATUS_FILTER = "users.status = ?"
+BY_LIBRARY_FILTER = "users.id IN (SELECT ul.user_id FROM user_libraries ul WHERE ul.library_id = ?)"
+
+hot_query("expirations.extend_expirations.by_server", EXTEND_SQL.format(where=BY_SERVER_FILTER))
+hot_query("expirations.extend_expirations.by_library", EXTEND_SQL.format(where=BY_LIBRARY_FILTER))
+
+
+def extend_expirations(days, server_row_id=None, status=None, library_id=None):
+    """
+    Prolonge de `days` jours l'abonnement des utilisateurs filtrés, en un seul UPDATE.
+    Base = max(aujourd'hui, date actuelle) calculée en SQL sur la date ISO (cf. dates.py) :
+    une date absente, passée ou illisible repart d'aujourd'hui.
+    Filtres cumulables : serveur (servers.id), statut, bibliothèque (libraries.id).
+    Retourne le nombre d'utilisateurs prolongés.
+    """
+    where, params = [], []
+    if server_row_id is not None:
+        where.append(BY_SERVER_FILTER)
+        params.append(server_row_id)
+    if status:
+        where.append(BY_STATUS_FILTER)
+        params.append(status)
+    if library_id is not None:
+        where.append(BY_LIBRARY_FILTER)
+        params.append(library_id)
+
+    with transaction() as conn:
+        sql = EXTEND_SQL.format(where=" AND ".join(where) or "1")
+        user_ids = [row["id"] for row in conn.execute(sql, (int(days), *params))]
+        if user_ids:
+            events.publish("users", user_ids)
+    return len(user_ids)
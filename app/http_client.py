@@ -0,0 +1,114 @@
+# /app/http_client.py
+"""
+Client HTTP partagé pour tous les appels Plex / plex.tv / Tautulli.
+
+- une seule requests.Session par processus : pools de connexions par hôte,
+  keep-alive (évite de refaire la poignée de main TLS vers plex.tv à chaque appel)
+- timeouts (connexion, lecture) toujours appliqués, configurables par variables d'env
+- nouvelles tentatives avec backoff exponentiel + jitter sur 429 / 5xx / erreur réseau
+  (POST : uniquement sur 429, la requête n'ayant alors pas été traitée)
+
+Usage :
+    import http_client
+    r = http_client.get(url, headers={"X-Plex-Token": token})
+    plex = PlexServer(url, token, session=http_client.get_session())
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger import logger
+
+CONNECT_TIMEOUT = float(os.getenv("VODUM_HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("VODUM_HTTP_READ_TIMEOUT", "30"))
+MAX_RETRIES = int(os.getenv("VODUM_HTTP_RETRIES", "3"))
+BACKOFF_BASE = 0.5   # secondes : 0.5, 1, 2, 4... (+ jitter)
+BACKOFF_MAX = 30     # secondes
+POOL_SIZE = 16       # connexions gardées ouvertes par hôte
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Session du processus (créée à la demande), aussi utilisable par plexapi."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _backoff(attempt):
+    # "full jitter" : étale les reprises de plusieurs workers dans le temps
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return min(BACKOFF_MAX, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def request(method, url, timeout=None, retries=None, **kwargs) -> requests.Response:
+    """
+    requests.request avec session partagée, timeout par défaut et reprises.
+    timeout : secondes ou tuple (connexion, lecture) ; retries : 0 pour désactiver.
+    """
+    method = method.upper()
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    retries = MAX_RETRIES if retries is None else retries
+    idempotent = method in IDEMPOTENT_METHODS
+    session = get_session()
+
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= retries or not idempotent:
+                raise
+            delay = _backoff(attempt)
+            logger.debug(f"🔁 {method} {url} : {e} — nouvelle tentative dans {delay:.1f}s")
+        else:
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            if not retryable or attempt >= retries:
+                return response
+            delay = _retry_after(response)
+            if delay is None:
+                delay = _backoff(attempt)
+            logger.debug(f"🔁 {method} {url} : HTTP {response.status_code} — nouvelle tentative dans {delay:.1f}s")
+            response.close()
+
+        attempt += 1
+        time.sleep(delay)
+
+
+def get(url, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs) -> requests.Response:
+    return request("PUT", url, **kwargs)
+
+
+def delete(url, **kwargs) -> requests.Response:
+    return request("DELETE", url, **kwargs)
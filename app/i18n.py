@@ -0,0 +1,155 @@
+# /app/i18n.py
+"""
+Catalogues de traduction partagés par l'app Flask (lang/<code>.json) et le bot Discord (translations.json).
+
+- get_catalog(lang)       : dict figé des traductions de `lang`, clés manquantes déjà résolues
+- translate(key, lang)    : traduction de `key` (la clé elle-même si introuvable)
+- available_languages()   : {code: libellé} des langues de lang/
+- reload()                : force la relecture des fichiers
+
+Les fichiers sont lus et fusionnés une seule fois ; chaque catalogue applique sa chaîne de repli
+(ex. "fr-CA" -> "fr" -> "en") au chargement, une traduction est donc une simple lecture de dict.
+Au plus toutes les CHECK_INTERVAL secondes, on compare les mtime des fichiers : une traduction
+modifiée (ou une langue ajoutée) est prise en compte sans redémarrage.
+"""
+import json
+import os
+import threading
+import time
+
+from logger import logger
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LANG_DIR = os.path.join(BASE_DIR, "lang")
+BOT_TRANSLATIONS = os.path.join(BASE_DIR, "translations.json")
+DEFAULT_LANG = "en"
+CHECK_INTERVAL = 2.0   # secondes entre deux vérifications des mtime
+
+
+class FrozenDict(dict):
+    """dict en lecture seule (reste sérialisable en JSON, ex. `translations|tojson`)."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Catalogue de traduction en lecture seule")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+_lock = threading.Lock()
+_signature = None      # (nom, mtime) des fichiers sources lors du dernier chargement
+_checked_at = 0.0
+_sources = {}          # code -> dict brut (lang/<code>.json par-dessus translations.json[code])
+_labels = {}           # code -> libellé
+_catalogs = {}         # code demandé -> FrozenDict résolu
+
+
+def _source_files():
+    files = []
+    try:
+        with os.scandir(LANG_DIR) as it:
+            files = [e.path for e in it if e.name.endswith(".json")]
+    except OSError:
+        pass
+    if os.path.exists(BOT_TRANSLATIONS):
+        files.append(BOT_TRANSLATIONS)
+    return sorted(files)
+
+
+def _signature_of(files):
+    sig = []
+    for path in files:
+        try:
+            sig.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            continue
+    return tuple(sig)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"❌ Erreur de chargement des traductions ({os.path.basename(path)}) : {e}")
+        return {}
+
+
+def _load(files, signature):
+    global _sources, _labels, _catalogs, _signature
+    sources, labels = {}, {}
+
+    if BOT_TRANSLATIONS in files:
+        for code, entries in _read_json(BOT_TRANSLATIONS).items():
+            if isinstance(entries, dict):
+                sources.setdefault(code, {}).update(entries)
+
+    for path in files:
+        if path == BOT_TRANSLATIONS:
+            continue
+        code = os.path.basename(path)[:-5]
+        data = _read_json(path)
+        sources.setdefault(code, {}).update(data)
+        labels[code] = str(data.get("lang_label", code) or code)
+
+    _sources, _labels, _catalogs, _signature = sources, labels, {}, signature
+    logger.debug(f"🌍 Traductions chargées : {', '.join(sorted(sources)) or '(aucune)'}")
+
+
+def _refresh():
+    """Recharge les fichiers si leurs mtime ont changé (vérifié au plus toutes les CHECK_INTERVAL s)."""
+    global _checked_at
+    now = time.monotonic()
+    if _signature is not None and now - _checked_at < CHECK_INTERVAL:
+        return
+    with _lock:
+        if _signature is not None and now - _checked_at < CHECK_INTERVAL:
+            return
+        files = _source_files()
+        signature = _signature_of(files)
+        if signature != _signature:
+            _load(files, signature)
+        _checked_at = now
+
+
+def reload():
+    global _signature
+    with _lock:
+        _signature = None
+    _refresh()
+
+
+def _fallback_chain(lang):
+    chain = []
+    if lang:
+        lang = str(lang).replace("_", "-")
+        chain.append(lang)
+        base = lang.split("-")[0]
+        if base != lang:
+            chain.append(base)
+    if DEFAULT_LANG not in chain:
+        chain.append(DEFAULT_LANG)
+    return chain
+
+
+def get_catalog(lang):
+    """Traductions de `lang` ; les clés absentes sont prises dans la langue de repli."""
+    _refresh()
+    catalog = _catalogs.get(lang)
+    if catalog is None:
+        sources, catalogs = _sources, _catalogs  # même génération, même si un rechargement a lieu
+        merged = {}
+        for code in reversed(_fallback_chain(lang)):
+            merged.update(sources.get(code, {}))
+        catalog = FrozenDict(merged)
+        with _lock:
+            catalogs[lang] = catalog
+    return catalog
+
+
+def translate(key, lang=DEFAULT_LANG):
+    return get_catalog(lang).get(key, key)
+
+
+def available_languages():
+    _refresh()
+    return dict(_labels)
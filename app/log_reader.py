@@ -0,0 +1,159 @@
+# /app/log_reader.py
+"""
+Lecture de la fin des logs (app.log et ses rotations app.log.1..N) pour la page /logs et /api/logs.
+
+- tail(limit, levels)               : les `limit` dernières lignes (plus récentes d'abord) + curseur
+- read_since(cursor, limit, levels) : lignes ajoutées depuis `cursor` (plus récentes d'abord) + nouveau curseur
+- detect_level(line)                : niveau d'une ligne "AAAA-MM-JJ HH:MM:SS,mmm [NIVEAU] message"
+
+Le fichier est lu à rebours par blocs de BLOCK_SIZE octets depuis la fin : afficher 500 lignes
+ne lit que quelques blocs, quelle que soit la taille du fichier. Les rotations ne sont ouvertes
+que s'il manque des lignes.
+
+Le curseur ("inode-offset") désigne la fin de ce qui a déjà été renvoyé : le navigateur ne
+redemande que la suite. Si app.log a tourné entre-temps, on reprend dans app.log.1 ; si le
+curseur n'est plus reconnu, on renvoie simplement la fin du fichier.
+"""
+import os
+import re
+from collections import deque
+
+from logger import LOG_FILE, LOG_BACKUP_COUNT
+
+BLOCK_SIZE = 64 * 1024
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+_LEVEL_RE = re.compile(r"^\S+ \S+ \[([A-Z]+)\]")
+
+
+def detect_level(line):
+    m = _LEVEL_RE.match(line)
+    if m and m.group(1) in LEVELS:
+        return m.group(1)
+    for level in LEVELS:
+        if f"[{level}]" in line:
+            return level
+    return "INFO"
+
+
+def _entry(raw, levels):
+    text = raw.decode("utf-8", errors="replace").replace("\r", " ").strip()
+    if not text:
+        return None
+    level = detect_level(text)
+    if levels is not None and level not in levels:
+        return None
+    return {"text": text, "level": level}
+
+
+def _reverse_lines(path, end=None):
+    """Lignes brutes de `path` de la fin (ou de l'offset `end`) vers le début."""
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        if end is not None:
+            pos = min(pos, end)
+        rest = b""
+        while pos > 0:
+            step = min(BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + rest).split(b"\n")
+            rest = lines.pop(0)  # début de ligne coupé : complété au bloc suivant
+            yield from reversed(lines)
+        if rest:
+            yield rest
+
+
+def _rotated(path, n):
+    return path if n == 0 else f"{path}.{n}"
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _cursor(st, offset=None):
+    if st is None:
+        return "0-0"
+    return f"{st.st_ino}-{st.st_size if offset is None else offset}"
+
+
+def _parse_cursor(cursor):
+    try:
+        ino, offset = (int(x) for x in str(cursor).split("-", 1))
+        return ino, offset
+    except (TypeError, ValueError):
+        return None
+
+
+def tail(limit=500, levels=None, path=LOG_FILE):
+    """Les `limit` dernières lignes (filtrées sur `levels`), des rotations si besoin."""
+    st = _stat(path)
+    lines = []
+    for n in range(LOG_BACKUP_COUNT + 1):
+        # le fichier courant n'est lu que jusqu'à la taille du curseur : rien n'est renvoyé deux fois
+        end = st.st_size if n == 0 and st else None
+        for raw in _reverse_lines(_rotated(path, n), end):
+            entry = _entry(raw, levels)
+            if entry:
+                lines.append(entry)
+                if len(lines) >= limit:
+                    return lines, _cursor(st)
+    return lines, _cursor(st)
+
+
+def _read_forward(path, start, end, levels, keep):
+    """
+    Lignes complètes entre start et end, ajoutées à `keep` (deque bornée : seules les dernières restent).
+    Retourne l'offset atteint : une ligne en cours d'écriture sera relue au prochain appel.
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return start
+    pos = start
+    with f:
+        f.seek(start)
+        while pos < end:
+            chunk = f.readlines(min(BLOCK_SIZE, end - pos))
+            if not chunk:
+                break
+            for raw in chunk:
+                if not raw.endswith(b"\n") or pos + len(raw) > end:
+                    return pos
+                pos += len(raw)
+                entry = _entry(raw, levels)
+                if entry:
+                    keep.append(entry)
+    return pos
+
+
+def read_since(cursor, limit=500, levels=None, path=LOG_FILE):
+    """
+    Lignes écrites après `cursor` (au plus les `limit` dernières), plus récentes d'abord,
+    et le curseur à renvoyer au prochain appel.
+    """
+    parsed = _parse_cursor(cursor)
+    st = _stat(path)
+    if parsed is None or st is None:
+        return tail(limit, levels, path)
+    ino, offset = parsed
+
+    keep = deque(maxlen=limit)
+    if ino == st.st_ino and offset <= st.st_size:
+        pos = _read_forward(path, offset, st.st_size, levels, keep)
+    else:
+        # app.log a tourné : la suite est dans app.log.1, puis tout le nouveau app.log
+        prev = _stat(_rotated(path, 1))
+        if prev is None or prev.st_ino != ino or offset > prev.st_size:
+            return tail(limit, levels, path)
+        _read_forward(_rotated(path, 1), offset, prev.st_size, levels, keep)
+        pos = _read_forward(path, 0, st.st_size, levels, keep)
+    return list(reversed(keep)), _cursor(st, pos)
@@ -0,0 +1,272 @@
+# /app/log_store.py
+"""
+Journal structuré des logs (base SQLite logs.db, à côté de database.db), interrogeable depuis /api/logs/events.
+
+Chaque enregistrement garde : horodatage UTC, niveau, module, tâche + id d'exécution, user_id, server_id, message.
+- écrit par lots par le thread d'écriture des logs (cf. logger.py) : jamais dans le thread appelant
+- index sur le temps, le niveau, la tâche, l'exécution et l'utilisateur ; recherche plein texte (FTS5)
+- purge des événements plus vieux que RETENTION_DAYS
+
+Contexte ajouté automatiquement aux logs :
+- un script cron (python check_servers.py...) est une tâche : task="check_servers", run_id unique par lancement
+- log_context(user_id=..., server_id=..., task=...) : bloc `with` pour le code appelant
+- logger.info("...", extra={"user_id": 12}) : pour un seul message
+
+Usage :
+    from log_store import log_context
+    with log_context(user_id=user["id"]):
+        logger.info("👋 Unfriend Plex")
+
+    log_store.query(user_id=12, since="2025-01-31", min_level="WARNING")
+"""
+import contextvars
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, UTC, timedelta
+
+from config import DATABASE_PATH
+
+LOG_DB_PATH = os.path.join(os.path.dirname(DATABASE_PATH), "logs.db")
+STORE_LEVEL = os.getenv("VODUM_LOG_STORE_LEVEL", "INFO")
+RETENTION_DAYS = int(os.getenv("VODUM_LOG_RETENTION_DAYS", "30"))
+BATCH_SIZE = 500        # enregistrements écrits au plus par transaction
+PRUNE_INTERVAL = 3600   # secondes entre deux purges
+PRUNE_CHUNK = 5000      # lignes supprimées par transaction lors d'une purge
+QUERY_LIMIT = 1000
+
+FIELDS = ("task", "run_id", "user_id", "server_id")
+
+# Process lancés comme tâche (scripts cron) : tout leur log porte le nom de la tâche
+_NOT_TASKS = {"", "app", "bot_plex", "start", "-c", "python", "python3"}
+_script = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ""))[0]
+_PROCESS_CONTEXT = (
+    {"task": _script, "run_id": f"{_script}-{datetime.now(UTC):%Y%m%dT%H%M%S}-{os.getpid()}"}
+    if _script not in _NOT_TASKS else {}
+)
+
+_context = contextvars.ContextVar("log_context", default={})
+_local = threading.local()
+
+
+def _db():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(LOG_DB_PATH, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        _ensure_schema(conn)
+        _local.conn = conn
+    return conn
+
+
+def _ensure_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_events (
+            id INTEGER PRIMARY KEY,
+            ts TEXT NOT NULL,                 -- ISO UTC, millisecondes
+            level TEXT NOT NULL,
+            levelno INTEGER NOT NULL,
+            module TEXT,
+            task TEXT,
+            run_id TEXT,
+            user_id INTEGER,
+            server_id INTEGER,
+            message TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_log_events_ts ON log_events(ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_log_events_level ON log_events(levelno, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_log_events_task ON log_events(task, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_log_events_run ON log_events(run_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_log_events_user ON log_events(user_id, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_log_events_server ON log_events(server_id, ts)")
+    # Index plein texte "externe" : le texte n'est stocké qu'une fois (dans log_events)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS log_events_fts
+        USING fts5(message, content='log_events', content_rowid='id')
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS log_events_ai AFTER INSERT ON log_events BEGIN
+            INSERT INTO log_events_fts(rowid, message) VALUES (new.id, new.message);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS log_events_ad AFTER DELETE ON log_events BEGIN
+            INSERT INTO log_events_fts(log_events_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+    """)
+    conn.commit()
+
+
+# --- Contexte ---
+
+@contextmanager
+def log_context(**fields):
+    """Ajoute task / run_id / user_id / server_id aux logs émis dans le bloc (threads et tâches asyncio)."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copie le contexte courant dans l'enregistrement (dans le thread appelant, avant la mise en file)."""
+
+    def filter(self, record):
+        ctx = _context.get()
+        for field in FIELDS:
+            if getattr(record, field, None) is None:
+                setattr(record, field, ctx.get(field, _PROCESS_CONTEXT.get(field)))
+        return True
+
+
+# --- Écriture (thread d'écriture des logs uniquement) ---
+
+class StoreHandler(logging.Handler):
+    """Accumule les enregistrements ; flush() les écrit en une transaction (appelé quand la file est vide)."""
+
+    def __init__(self, level=STORE_LEVEL):
+        super().__init__(level)
+        self._rows = []
+        self._next_prune = 0.0
+
+    def emit(self, record):
+        self._rows.append((
+            datetime.fromtimestamp(record.created, UTC).isoformat(timespec="milliseconds"),
+            record.levelname,
+            record.levelno,
+            record.module,
+            getattr(record, "task", None),
+            getattr(record, "run_id", None),
+            _as_int(getattr(record, "user_id", None)),
+            _as_int(getattr(record, "server_id", None)),
+            record.getMessage(),
+        ))
+        if len(self._rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
+        try:
+            conn = _db()
+            with conn:
+                conn.executemany("""
+                    INSERT INTO log_events
+                        (ts, level, levelno, module, task, run_id, user_id, server_id, message)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+            if time.monotonic() >= self._next_prune:
+                self._next_prune = time.monotonic() + PRUNE_INTERVAL
+                prune(conn)
+        except sqlite3.Error as e:
+            # pas de logger ici : on est dans le thread d'écriture des logs
+            print(f"⚠️ log_store : {len(rows)} événements non enregistrés ({e})", file=sys.stderr)
+
+
+def _as_int(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def prune(conn=None, retention_days=RETENTION_DAYS):
+    """Supprime (par paquets) les événements plus vieux que retention_days. Retourne le nombre supprimé."""
+    conn = conn or _db()
+    cutoff = (datetime.now(UTC) - timedelta(days=retention_days)).isoformat(timespec="milliseconds")
+    deleted = 0
+    while True:
+        with conn:
+            n = conn.execute("""
+                DELETE FROM log_events WHERE id IN (
+                    SELECT id FROM log_events WHERE ts < ? LIMIT ?
+                )
+            """, (cutoff, PRUNE_CHUNK)).rowcount
+        deleted += n
+        if n < PRUNE_CHUNK:
+            return deleted
+
+
+# --- Lecture ---
+
+def _to_utc_iso(value, end_of_day=False):
+    """'2025-01-31' / '2025-01-31T22:00' / '...+02:00' -> ISO UTC comparable à la colonne ts."""
+    dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if end_of_day and len(str(value).strip()) == 10:
+        dt += timedelta(days=1)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC).isoformat(timespec="milliseconds")
+
+
+def query(since=None, until=None, min_level=None, task=None, run_id=None, user_id=None,
+          server_id=None, text=None, before_id=None, limit=200):
+    """
+    Événements (plus récents d'abord) filtrés par période, niveau minimal, tâche, exécution,
+    utilisateur, serveur et texte (mots du message, syntaxe FTS5 non interprétée).
+    before_id : pagination, événements d'id < before_id.
+    Lève ValueError si une date ou un niveau est illisible.
+    """
+    where, params = [], []
+    if since:
+        where.append("ts >= ?")
+        params.append(_to_utc_iso(since))
+    if until:
+        where.append("ts < ?")
+        params.append(_to_utc_iso(until, end_of_day=True))
+    if min_level:
+        levelno = logging.getLevelName(str(min_level).upper())
+        if not isinstance(levelno, int):
+            raise ValueError(f"Niveau inconnu : {min_level}")
+        where.append("levelno >= ?")
+        params.append(levelno)
+    for column, value in (("task", task), ("run_id", run_id)):
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    for column, value in (("user_id", user_id), ("server_id", server_id)):
+        if value not in (None, ""):
+            where.append(f"{column} = ?")
+            params.append(int(value))
+    if text:
+        # chaque mot est une phrase FTS5 : pas d'opérateurs ni d'erreur de syntaxe possibles
+        terms = " ".join('"' + w.replace('"', '""') + '"' for w in str(text).split())
+        where.append("id IN (SELECT rowid FROM log_events_fts WHERE log_events_fts MATCH ?)")
+        params.append(terms)
+    if before_id:
+        where.append("id < ?")
+        params.append(int(before_id))
+
+    sql = "SELECT id, ts, level, module, task, run_id, user_id, server_id, message FROM log_events"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(max(1, min(int(limit), QUERY_LIMIT)))
+    return [dict(r) for r in _db().execute(sql, params).fetchall()]
+
+
+def recent_runs(task=None, limit=50):
+    """Dernières exécutions de tâches : début, fin, nombre d'événements, pire niveau."""
+    sql = """
+        SELECT task, run_id, MIN(ts) AS started_at, MAX(ts) AS ended_at,
+               COUNT(*) AS events, MAX(levelno) AS max_levelno
+        FROM log_events
+        WHERE run_id IS NOT NULL {task_filter}
+        GROUP BY run_id
+        ORDER BY MAX(id) DESC
+        LIMIT ?
+    """.format(task_filter="AND task = ?" if task else "")
+    params = ([task] if task else []) + [max(1, min(int(limit), QUERY_LIMIT))]
+    runs = [dict(r) for r in _db().execute(sql, params).fetchall()]
+    for run in runs:
+        run["max_level"] = logging.getLevelName(run.pop("max_levelno"))
+    return runs
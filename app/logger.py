@@ -1,48 +1,203 @@
+"""
+Logging commun (app Flask, bot Discord, scripts cron).
+
+Les appels logger.xxx() ne font jamais d'écriture : ils déposent l'enregistrement dans une file,
+un seul thread ("log-writer") écrit dans app.log (rotation), sur la console et, par lots,
+dans le journal structuré logs.db (cf. log_store.py).
+
+Niveaux : settings.log_level, relu par le thread d'écriture toutes les LEVEL_CHECK_INTERVAL secondes.
+Un niveau global, éventuellement suivi de niveaux par module ou par logger :
+    "INFO"
+    "INFO,update_plex_users=DEBUG,plexapi=WARNING"
+Les modules Vodum loggent tous via le logger racine : ils sont distingués par leur nom de fichier
+(record.module). Les loggers nommés (plexapi, werkzeug, urllib3, discord...) par leur nom.
+
+Messages : préférer logger.debug("... %s", valeur) à une f-string, le texte n'est alors construit
+que si le niveau est actif.
+"""
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+import log_store
+from config import APPDATA_DIR
 
 # Création du dossier logs si besoin
-LOG_DIR = "/app/appdata/logs"
+LOG_DIR = os.path.join(APPDATA_DIR, "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 
 LOG_FILE = os.path.join(LOG_DIR, "app.log")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 5          # app.log.1 .. app.log.5 (cf. log_reader.py)
+DEFAULT_LEVEL = os.getenv("VODUM_LOG_LEVEL", "INFO")
+LEVEL_CHECK_INTERVAL = 5.0    # secondes entre deux relectures de settings.log_level
 
 # Formatter personnalisé pour forcer une seule ligne
 class SingleLineFormatter(logging.Formatter):
     def format(self, record):
-        if record.args:
-            record.msg = str(record.msg).replace("\n", " ").replace("\r", " ")
-        else:
-            record.msg = record.msg.replace("\n", " ").replace("\r", " ")
+        record.msg = str(record.msg).replace("\n", " ").replace("\r", " ")
         return super().format(record).replace("\n", " ").replace("\r", " ").strip()
 
 
+formatter = SingleLineFormatter("%(asctime)s [%(levelname)s] %(message)s")
 
-# Logger configuré
-logger = logging.getLogger()  # logger racine
-logger.setLevel(logging.DEBUG)
-
-# Handler fichier
+# Handler fichier (utilisé seulement par le thread d'écriture)
 handler = RotatingFileHandler(
     LOG_FILE,
-    maxBytes=5 * 1024 * 1024,
-    backupCount=5,
+    maxBytes=LOG_MAX_BYTES,
+    backupCount=LOG_BACKUP_COUNT,
     encoding="utf-8"
 )
-
-formatter = SingleLineFormatter("%(asctime)s [%(levelname)s] %(message)s")
 handler.setFormatter(formatter)
-handler.setLevel(logging.DEBUG)
-logger.debug("🧪 DEBUG activé dans logger.py")
-
 
 # Console
 console = logging.StreamHandler()
 console.setFormatter(formatter)
-console.setLevel(logging.DEBUG)
 
-# Ajout des handlers (une seule fois)
-#if not logger.hasHandlers():
-logger.addHandler(handler)
-logger.addHandler(console)
+# Journal structuré (SQLite), écrit par lots
+store = log_store.StoreHandler()
+
+_handlers = (handler, console, store)
+
+
+# --- Niveaux par module ---
+
+_default_level = logging.INFO
+_overrides = {}        # nom de module / de logger -> niveau
+_applied_spec = None
+
+
+def _to_level(name, fallback):
+    level = logging.getLevelName(str(name).strip().upper())
+    return level if isinstance(level, int) else fallback
+
+
+def parse_levels(spec):
+    """'INFO,plexapi=WARNING' -> (logging.INFO, {'plexapi': logging.WARNING})."""
+    default, overrides = _to_level(DEFAULT_LEVEL, logging.INFO), {}
+    for part in str(spec or "").split(","):
+        if "=" in part:
+            name, level = part.split("=", 1)
+            if name.strip():
+                overrides[name.strip()] = _to_level(level, default)
+        elif part.strip():
+            default = _to_level(part, default)
+    return default, overrides
+
+
+def _level_for(record):
+    if _overrides:
+        name = record.module if record.name == "root" else record.name
+        while name:
+            level = _overrides.get(name)
+            if level is not None:
+                return level
+            name = name.rpartition(".")[0]
+    return _default_level
+
+
+class _LevelFilter(logging.Filter):
+    """Applique le niveau du module avant la mise en file (aucun formatage pour un message filtré)."""
+
+    def filter(self, record):
+        return record.levelno >= _level_for(record)
+
+
+def configure_levels(spec=None):
+    """
+    Applique un niveau global + niveaux par module. Sans argument : settings.log_level
+    (défaut VODUM_LOG_LEVEL). Appelé au démarrage et par le thread d'écriture.
+    """
+    global _default_level, _overrides, _applied_spec
+    if spec is None:
+        try:
+            from settings_helper import get_str
+            spec = get_str("log_level", DEFAULT_LEVEL)
+        except Exception:
+            spec = DEFAULT_LEVEL
+    if spec == _applied_spec:
+        return
+    default, overrides = parse_levels(spec)
+
+    for name in set(_overrides) - set(overrides):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    for name, level in overrides.items():
+        logging.getLogger(name).setLevel(level)
+    _default_level, _overrides, _applied_spec = default, overrides, spec
+    # le logger racine laisse passer le plus bas des niveaux, le filtre tranche par module
+    logger.setLevel(min([default, *overrides.values()]))
+
+
+# --- File + thread d'écriture ---
+
+_queue = queue.SimpleQueue()
+_STOP = object()
+
+
+def _write(record):
+    for h in _handlers:
+        try:
+            h.handle(record)
+        except Exception:
+            h.handleError(record)
+
+
+def _flush():
+    for h in _handlers:
+        try:
+            h.flush()
+        except Exception:
+            pass
+
+
+def _writer():
+    next_check = time.monotonic()  # settings.log_level lu dès le démarrage
+    while True:
+        try:
+            record = _queue.get(timeout=LEVEL_CHECK_INTERVAL)
+        except queue.Empty:
+            record = None
+        if record is _STOP:
+            break
+        if record is not None:
+            _write(record)
+        if _queue.empty():
+            _flush()  # fin de rafale : un seul lot écrit dans logs.db
+        if time.monotonic() >= next_check:
+            configure_levels()
+            next_check = time.monotonic() + LEVEL_CHECK_INTERVAL
+
+
+def _flush_at_exit():
+    _queue.put(_STOP)
+    _writer_thread.join(timeout=5)
+    # enregistrements arrivés après l'arrêt (autres hooks atexit)
+    while True:
+        try:
+            record = _queue.get_nowait()
+        except queue.Empty:
+            break
+        if record is not _STOP:
+            _write(record)
+    _flush()
+
+
+# Logger configuré
+logger = logging.getLogger()  # logger racine
+
+queue_handler = QueueHandler(_queue)
+queue_handler.addFilter(_LevelFilter())
+queue_handler.addFilter(log_store.ContextFilter())  # tâche / utilisateur / serveur courants
+
+configure_levels(DEFAULT_LEVEL)
+
+# Ajout du handler (une seule fois, même si le module est rechargé)
+if not any(isinstance(h, QueueHandler) for h in logger.handlers):
+    logger.addHandler(queue_handler)
+    _writer_thread = threading.Thread(target=_writer, name="log-writer", daemon=True)
+    _writer_thread.start()
+    atexit.register(_flush_at_exit)
@@ -1,75 +1,260 @@
 import smtplib
 import ssl
+import time
+from email.utils import parseaddr
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 import os
-import sqlite3
 
 from logger import logger
-from config import DATABASE_PATH
+from settings_helper import get_settings
 
 
-def send_email(to, subject, body, attachment_path=None):
+SMTP_TIMEOUT = 30             # secondes (connexion et commandes SMTP)
+MAX_MESSAGES_PER_CONNECTION = 100
+KEEPALIVE_AFTER = 60          # secondes d'inactivité avant un NOOP de vérification
+
+
+def _connection_lost(e):
+    """Vrai si l'erreur signifie que la connexion est perdue (timeout serveur, 421...) et qu'on peut réessayer."""
+    # ⚠️ SMTPException hérite d'OSError : on ne peut pas simplement attraper OSError
+    if isinstance(e, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)):
+        return True
+    return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code == 421
+
+
+def load_smtp_config():
     """
-    Envoie un email HTML (optionnellement avec pièce jointe) en utilisant les paramètres SMTP définis dans la base.
+    Lit les paramètres SMTP (table settings, via le cache de settings_helper).
+    Retourne (config, None) ou (None, message d'erreur).
     """
-    try:
-        # 🔧 Lecture directe des paramètres SMTP depuis la table settings
-        conn = sqlite3.connect(DATABASE_PATH)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM settings LIMIT 1")
-        row = cur.fetchone()
-        conn.close()
-
-        if not row:
-            logger.error("❌ Aucune configuration SMTP trouvée dans la table settings.")
-            return False, "Configuration SMTP manquante."
-
-        smtp_server = row["smtp_host"]
-        smtp_port = int(row["smtp_port"] or 587)
-        smtp_user = row["smtp_user"]
-        smtp_password = row["smtp_pass"]
-        mail_from = row["mail_from"]
-
-        if not smtp_server or not smtp_user or not smtp_password:
-            logger.error("❌ Paramètres SMTP manquants : impossible d’envoyer l’email.")
-            return False, "Paramètres SMTP manquants."
-
-        # 📧 Construction du message (multipart si pièce jointe)
-        if attachment_path:
-            msg = MIMEMultipart()
-            msg.attach(MIMEText(body, "html"))
-            try:
-                with open(attachment_path, "rb") as f:
-                    part = MIMEApplication(f.read())
-                part.add_header(
-                    "Content-Disposition",
-                    "attachment",
-                    filename=os.path.basename(attachment_path),
-                )
-                msg.attach(part)
-            except Exception as e:
-                logger.error(f"❌ Erreur lecture pièce jointe: {e}")
-                return False, f"Erreur lecture pièce jointe: {e}"
-        else:
-            msg = MIMEText(body, "html")
+    row = get_settings()
+
+    if not row:
+        logger.error("❌ Aucune configuration SMTP trouvée dans la table settings.")
+        return None, "Configuration SMTP manquante."
+
+    config = {
+        "host": row["smtp_host"],
+        "port": int(row["smtp_port"] or 587),
+        "user": row["smtp_user"],
+        "password": row["smtp_pass"],
+        "mail_from": row["mail_from"],
+    }
+
+    if not config["host"] or not config["user"] or not config["password"]:
+        logger.error("❌ Paramètres SMTP manquants : impossible d’envoyer l’email.")
+        return None, "Paramètres SMTP manquants."
+
+    return config, None
 
-        msg["Subject"] = subject
-        msg["From"] = mail_from
+
+def build_message(to, subject, body, mail_from, attachment_path=None):
+    """Construit le message HTML (multipart si pièce jointe). Lève une exception si la pièce jointe est illisible."""
+    if attachment_path:
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(body, "html"))
+        with open(attachment_path, "rb") as f:
+            part = MIMEApplication(f.read())
+        part.add_header(
+            "Content-Disposition",
+            "attachment",
+            filename=os.path.basename(attachment_path),
+        )
+        msg.attach(part)
+    else:
+        msg = MIMEText(body, "html")
+
+    msg["Subject"] = subject
+    msg["From"] = mail_from
+    if to:
         msg["To"] = to
+    return msg
+
+
+class PreparedMessage:
+    """
+    Message de campagne construit et encodé une seule fois (corps HTML + pièce jointe en base64).
+    Pour chaque destinataire, seul l'en-tête To est ajouté devant les octets déjà sérialisés.
+
+    Usage :
+        prepared = PreparedMessage(subject, body, config["mail_from"], attachment_path)
+        session.send_prepared(prepared, "user@example.com")
+    """
+
+    def __init__(self, subject, body, mail_from, attachment_path=None):
+        msg = build_message(None, subject, body, mail_from, attachment_path)
+        self.subject = subject
+        self.envelope_from = parseaddr(mail_from or "")[1] or mail_from
+        # même sérialisation que smtplib.send_message (politique du message, fins de ligne CRLF)
+        self._policy = msg.policy.clone(linesep="\r\n")
+        data = msg.as_bytes(policy=self._policy)
+        # En-têtes communs / corps : le To de chaque destinataire s'insère entre les deux
+        self._headers, self._body = data.split(b"\r\n\r\n", 1)
+
+    def render(self, to, headers=None):
+        """Octets du message pour `to` (+ en-têtes propres au destinataire, optionnels)."""
+        stamped = self._policy.fold_binary("To", to)
+        for name, value in (headers or {}).items():
+            stamped += self._policy.fold_binary(name, value)
+        return self._headers + b"\r\n" + stamped + b"\r\n" + self._body
+
+
+class MailSession:
+    """
+    Connexion SMTP authentifiée réutilisée pour un lot de mails.
+
+    - connexion ouverte à la demande (STARTTLS + login une seule fois)
+    - reconnexion automatique si le serveur a coupé (timeout, 421) puis nouvel essai
+    - reconnexion après MAX_MESSAGES_PER_CONNECTION messages (limite de nombreux serveurs)
+    - NOOP de vérification si la connexion est restée inactive plus de KEEPALIVE_AFTER secondes
+
+    Usage :
+        with MailSession() as session:
+            for to in recipients:
+                ok, err = session.send(to, subject, body)
+    """
+
+    def __init__(self, config=None, max_per_connection=MAX_MESSAGES_PER_CONNECTION,
+                 keepalive_after=KEEPALIVE_AFTER):
+        if config is None:
+            config, self.config_error = load_smtp_config()
+        else:
+            self.config_error = None
+        self.config = config
+        self.max_per_connection = max_per_connection
+        self.keepalive_after = keepalive_after
+        self._server = None
+        self._sent_on_connection = 0
+        self._last_used = 0.0
+
+    # --- connexion ---
 
-        # 🔐 Connexion SMTP sécurisée
+    def _connect(self):
         context = ssl.create_default_context()
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
+        server = smtplib.SMTP(self.config["host"], self.config["port"], timeout=SMTP_TIMEOUT)
+        try:
             server.starttls(context=context)
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+            server.login(self.config["user"], self.config["password"])
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self._sent_on_connection = 0
+        self._last_used = time.monotonic()
+        logger.debug(f"🔌 Connexion SMTP ouverte ({self.config['host']}:{self.config['port']})")
+
+    def _disconnect(self, polite=True):
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            if polite:
+                server.quit()
+            else:
+                server.close()
+        except Exception:
+            server.close()
+
+    def _ensure_connection(self):
+        if self._server is not None and self._sent_on_connection >= self.max_per_connection:
+            logger.debug("🔁 Limite de messages par connexion atteinte, reconnexion SMTP")
+            self._disconnect()
+
+        if self._server is not None and time.monotonic() - self._last_used > self.keepalive_after:
+            try:
+                code, _ = self._server.noop()
+                alive = code == 250
+            except Exception:
+                alive = False
+            if not alive:
+                logger.debug("🔁 Connexion SMTP expirée côté serveur, reconnexion")
+                self._disconnect(polite=False)
+
+        if self._server is None:
+            self._connect()
+
+    # --- envoi ---
+
+    def _deliver(self, to, subject, send):
+        """Appelle send(server) avec reconnexion / nouvel essai si la connexion est perdue."""
+        if self.config is None:
+            return False, self.config_error
+
+        for attempt in (1, 2):
+            try:
+                self._ensure_connection()
+                send(self._server)
+                self._sent_on_connection += 1
+                self._last_used = time.monotonic()
+                logger.info(f"✅ Mail envoyé à {to} : {subject}")
+                return True, None
+            except Exception as e:
+                if attempt == 1 and _connection_lost(e):
+                    logger.debug(f"🔁 Connexion SMTP perdue ({e}), nouvel essai pour {to}")
+                    self._disconnect(polite=False)
+                    continue
+                logger.error(f"❌ Erreur lors de l’envoi du mail à {to} : {e}")
+                return False, str(e)
 
-        logger.info(f"✅ Mail envoyé à {to} : {subject}")
-        return True, None
+    def send_message(self, msg):
+        """Envoie un message déjà construit. Retourne (True, None) ou (False, erreur)."""
+        return self._deliver(msg["To"], msg["Subject"], lambda server: server.send_message(msg))
 
+    def send_prepared(self, prepared, to, headers=None):
+        """Envoie un PreparedMessage à `to` sans reconstruire le MIME. Retourne (True, None) ou (False, erreur)."""
+        data = prepared.render(to, headers)
+        return self._deliver(
+            to, prepared.subject, lambda server: server.sendmail(prepared.envelope_from, [to], data)
+        )
+
+    def send(self, to, subject, body, attachment_path=None):
+        """Construit puis envoie un mail HTML. Retourne (True, None) ou (False, erreur)."""
+        if self.config is None:
+            return False, self.config_error
+        try:
+            msg = build_message(to, subject, body, self.config["mail_from"], attachment_path)
+        except Exception as e:
+            logger.error(f"❌ Erreur lecture pièce jointe: {e}")
+            return False, f"Erreur lecture pièce jointe: {e}"
+        return self.send_message(msg)
+
+    def send_batch(self, messages):
+        """
+        Envoie une série de mails sur la même connexion.
+        messages : itérable de dicts {to, subject, body, attachment_path?}
+        Retourne la liste des (ok, erreur) dans le même ordre.
+        """
+        return [
+            self.send(m["to"], m["subject"], m["body"], attachment_path=m.get("attachment_path"))
+            for m in messages
+        ]
+
+    def close(self):
+        self._disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def send_batch(messages):
+    """Envoie un lot de mails avec une seule session SMTP (cf. MailSession.send_batch)."""
+    with MailSession() as session:
+        return session.send_batch(messages)
+
+
+def send_email(to, subject, body, attachment_path=None):
+    """
+    Envoie un email HTML (optionnellement avec pièce jointe) en utilisant les paramètres SMTP définis dans la base.
+    Pour plusieurs mails, préférer MailSession / send_batch qui réutilisent la connexion.
+    """
+    try:
+        with MailSession() as session:
+            return session.send(to, subject, body, attachment_path=attachment_path)
     except Exception as e:
         logger.error(f"❌ Erreur lors de l’envoi du mail à {to} : {e}")
         return False, str(e)
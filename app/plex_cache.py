@@ -0,0 +1,185 @@
+# /app/plex_cache.py
+"""
+Cache disque des réponses plex.tv en lecture, partagé entre l'app, le bot et les crons.
+
+- clé = URL + en-tête Accept + hash du token (le token lui-même n'est jamais stocké)
+- durée de vie par endpoint (TTL_RULES) ; les URL non listées ne sont pas mises en cache
+- revalidation conditionnelle (If-None-Match / If-Modified-Since) une fois le TTL passé
+- invalidate() après toute écriture côté Plex (partage, retrait, unfriend)
+
+Usage :
+    import plex_cache
+    r = plex_cache.get("https://plex.tv/api/users", headers={"X-Plex-Token": token})
+"""
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import http_client
+from config import DATABASE_PATH
+from logger import logger
+
+CACHE_PATH = os.path.join(os.path.dirname(DATABASE_PATH), "plex_cache.db")
+STALE_KEEP = 86400  # secondes : une entrée expirée reste un jour pour la revalidation
+
+# (préfixe d'URL, TTL en secondes) — le premier préfixe qui correspond gagne
+TTL_RULES = [
+    ("https://plex.tv/users/account", 3600),
+    ("https://plex.tv/api/resources", 3600),
+    ("https://plex.tv/api/users", 600),
+    ("https://plex.tv/api/home/users", 600),
+    ("https://plex.tv/api/servers", 600),          # /api/servers et /api/servers/<id>/shared_servers
+    ("https://plex.tv/api/shared_servers", 300),
+    ("https://plex.tv/pms/friends/all", 300),
+    ("https://plex.tv/api/friends", 300),
+]
+
+_KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+_local = threading.local()
+
+
+def _db():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_PATH, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS http_cache (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                token_hash TEXT,
+                headers TEXT,
+                body BLOB,
+                encoding TEXT,
+                fetched_at REAL,
+                expires_at REAL
+            )
+        """)
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def _ttl_for(url):
+    for prefix, ttl in TTL_RULES:
+        if url.startswith(prefix):
+            return ttl
+    return None
+
+
+def _token_hash(token):
+    return hashlib.sha256((token or "").encode()).hexdigest()[:16]
+
+
+def _key(url, headers):
+    accept = headers.get("Accept", "")
+    return hashlib.sha256(f"{url}|{accept}|{_token_hash(headers.get('X-Plex-Token'))}".encode()).hexdigest()
+
+
+def _to_response(url, row):
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.url = url
+    response._content = row["body"]
+    response.encoding = row["encoding"]
+    response.headers = CaseInsensitiveDict(json.loads(row["headers"] or "{}"))
+    return response
+
+
+def _store(key, url, headers, response, ttl):
+    now = time.time()
+    kept = {h: response.headers[h] for h in _KEPT_HEADERS if h in response.headers}
+    conn = _db()
+    conn.execute("""
+        INSERT OR REPLACE INTO http_cache
+            (key, url, token_hash, headers, body, encoding, fetched_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (key, url, _token_hash(headers.get("X-Plex-Token")), json.dumps(kept),
+          response.content, response.encoding, now, now + ttl))
+    conn.execute("DELETE FROM http_cache WHERE expires_at < ?", (now - STALE_KEEP,))
+    conn.commit()
+
+
+def get(url, headers=None, **kwargs) -> requests.Response:
+    """
+    GET via http_client, servi depuis le cache si l'endpoint a un TTL et que l'entrée est fraîche.
+    Seules les réponses 200 sont mises en cache ; les appels avec `params` ne le sont pas.
+    """
+    headers = dict(headers or {})
+    ttl = _ttl_for(url)
+    if ttl is None or kwargs.get("params"):
+        return http_client.get(url, headers=headers, **kwargs)
+
+    key = _key(url, headers)
+    try:
+        row = _db().execute("SELECT * FROM http_cache WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error as e:
+        logger.debug(f"⚠️ Cache plex.tv indisponible ({e}), appel direct")
+        return http_client.get(url, headers=headers, **kwargs)
+
+    if row and row["expires_at"] > time.time():
+        logger.debug(f"📦 Cache plex.tv : {url}")
+        return _to_response(url, row)
+
+    request_headers = dict(headers)
+    if row:
+        cached_headers = json.loads(row["headers"] or "{}")
+        if cached_headers.get("ETag"):
+            request_headers["If-None-Match"] = cached_headers["ETag"]
+        if cached_headers.get("Last-Modified"):
+            request_headers["If-Modified-Since"] = cached_headers["Last-Modified"]
+
+    response = http_client.get(url, headers=request_headers, **kwargs)
+
+    try:
+        if response.status_code == 304 and row:
+            logger.debug(f"📦 Cache plex.tv revalidé : {url}")
+            conn = _db()
+            conn.execute("UPDATE http_cache SET expires_at = ? WHERE key = ?", (time.time() + ttl, key))
+            conn.commit()
+            return _to_response(url, row)
+        if response.status_code == 200:
+            _store(key, url, headers, response, ttl)
+    except sqlite3.Error as e:
+        logger.debug(f"⚠️ Écriture du cache plex.tv impossible : {e}")
+
+    return response
+
+
+def invalidate(url_prefix=None):
+    """Vide le cache (ou seulement les URL commençant par url_prefix). À appeler après une écriture Plex."""
+    try:
+        conn = _db()
+        if url_prefix:
+            conn.execute("DELETE FROM http_cache WHERE url LIKE ? || '%'", (url_prefix,))
+        else:
+            conn.execute("DELETE FROM http_cache")
+        conn.commit()
+        logger.debug(f"🧹 Cache plex.tv invalidé ({url_prefix or 'tout'})")
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ Invalidation du cache plex.tv impossible : {e}")
+
+
+def invalidates_cache(func):
+    """Décorateur pour les fonctions qui modifient des partages Plex : vide le cache en sortie."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            invalidate()
+    return wrapper
+
+
+if __name__ == "__main__":
+    invalidate()
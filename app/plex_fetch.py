@@ -0,0 +1,72 @@
+# /app/plex_fetch.py
+"""
+Requêtes GET parallèles vers plex.tv et les serveurs Plex pendant une synchro.
+
+- pool de threads borné (MAX_WORKERS)
+- limite de requêtes simultanées par hôte (PER_HOST_LIMIT), pour ne pas
+  se faire throttler par plex.tv
+- dédoublonnage : une même (url, token) n'est demandée qu'une fois par synchro,
+  les appels suivants récupèrent le même Future
+
+Usage :
+    with PlexFetcher() as fetcher:
+        f1 = fetcher.submit("https://plex.tv/users/account", token)
+        f2 = fetcher.submit("https://plex.tv/api/users", token)
+        account = f1.result()   # requests.Response (ou exception levée)
+
+Les requêtes passent par plex_cache (cache disque des endpoints plex.tv),
+puis http_client (keep-alive, timeouts, reprises sur 429/5xx).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import plex_cache
+from logger import logger
+
+MAX_WORKERS = 8
+PER_HOST_LIMIT = 4
+
+
+class PlexFetcher:
+    def __init__(self, max_workers=MAX_WORKERS, per_host=PER_HOST_LIMIT):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plex-fetch")
+        self._per_host = per_host
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._futures = {}
+
+    def _slot(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self._per_host)
+            return self._host_slots[host]
+
+    def _get(self, url, token):
+        with self._slot(url):
+            logger.debug("📡 GET %s", url)
+            return plex_cache.get(url, headers={"X-Plex-Token": token})
+
+    def submit(self, url, token):
+        """Planifie le GET (une seule fois par couple url/token) et retourne son Future."""
+        key = (url, token)
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = self._executor.submit(self._get, url, token)
+                self._futures[key] = future
+            return future
+
+    def get(self, url, token):
+        """GET bloquant, mais partagé avec les autres appels identiques de la synchro."""
+        return self.submit(url, token).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,4 +1,5 @@
-import requests
+import http_client
+import plex_cache
 import json
 from logger import logger
 import sqlite3
@@ -6,15 +7,12 @@ from config import DATABASE_PATH
 from plexapi.myplex import MyPlexAccount
 from plexapi.server import PlexServer
 import logging
-import http.client as http_client
 from plexapi.exceptions import NotFound, BadRequest
 import xml.etree.ElementTree as ET
 
 
 
-logging.getLogger("plexapi").setLevel(logging.DEBUG)
-http_client.HTTPConnection.debuglevel = 1
-
+@plex_cache.invalidates_cache
 def update_user_libraries(plex_token, shared_server_id, machine_id, library_names):
     """
     Met à jour les bibliothèques partagées à un utilisateur Plex.
@@ -40,7 +38,7 @@ def update_user_libraries(plex_token, shared_server_id, machine_id, library_name
     }
 
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = http_client.post(url, headers=headers, data=json.dumps(payload))
         if response.status_code in (200, 204):
             logger.info(f"✅ Partage mis à jour avec succès pour shared_server_id={shared_server_id}")
         else:
@@ -51,6 +49,7 @@ def update_user_libraries(plex_token, shared_server_id, machine_id, library_name
         return None, str(e)
 
 
+@plex_cache.invalidates_cache
 def create_or_update_share(plex_token, target_user_id, machine_id, library_names):
     url = "https://plex.tv/api/v2/shared_servers"
     headers = {
@@ -68,7 +67,7 @@ def create_or_update_share(plex_token, target_user_id, machine_id, library_names
     }
 
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = http_client.post(url, headers=headers, data=json.dumps(payload))
         if response.status_code in (200, 201):
             logger.info(f"✅ Partage JBOPS appliqué pour user={target_user_id}, serveur={machine_id}, bibliothèques={library_names}")
         else:
@@ -99,7 +98,7 @@ def get_shared_server_id(plex_token, target_user_id, machine_id):
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = plex_cache.get(url, headers=headers)
         if response.status_code != 200:
             logger.warning(f"⚠️ Impossible de récupérer les partages : {response.status_code} - {response.text}")
             return None
@@ -118,6 +117,7 @@ def get_shared_server_id(plex_token, target_user_id, machine_id):
         return None
 
 
+@plex_cache.invalidates_cache
 def disable_user_libraries(plex_token, plex_url, username, server_name, library_names):
     """
     Supprime l'accès d'un utilisateur à toutes les bibliothèques sur un serveur Plex spécifique (via IP/token).
@@ -128,7 +128,7 @@ def disable_user_libraries(plex_token, plex_url, username, server_name, library_
         from plexapi.exceptions import NotFound, BadRequest
 
         logger.info(f"🔗 Connexion à PlexServer via URL '{plex_url}' et token...")
-        plex = PlexServer(plex_url, plex_token)
+        plex = PlexServer(plex_url, plex_token, session=http_client.get_session())
         account = plex.myPlexAccount()
 
         logger.info(f"🔍 Recherche de l'utilisateur Plex '{username}' via myPlexAccount...")
@@ -186,6 +186,7 @@ def disable_user_libraries(plex_token, plex_url, username, server_name, library_
         return False
 
 
+@plex_cache.invalidates_cache
 def unshare_all_libraries(plex_token, plex_url, username):
     logger.info(f"🔒 Suppression de l'accès aux bibliothèques Plex pour {username} sans retirer l'amitié")
 
@@ -204,10 +205,11 @@ def unshare_all_libraries(plex_token, plex_url, username):
 
 
 
+@plex_cache.invalidates_cache
 def share_user_libraries(plex_token, plex_url, username, section_ids):
     from plexapi.server import PlexServer
     try:
-        plex = PlexServer(plex_url, plex_token)
+        plex = PlexServer(plex_url, plex_token, session=http_client.get_session())
         account = plex.myPlexAccount()
         user = account.user(username)
         account.updateFriend(user=user, server=plex, removeSections=True, sections=section_ids)
@@ -217,16 +219,19 @@ def share_user_libraries(plex_token, plex_url, username, section_ids):
         logger.error(f"❌ Impossible de partager à {username} sur {plex_url}: {e}")
         return False
 
+@plex_cache.invalidates_cache
 def set_user_libraries(plex_token, plex_url, username, library_names, allowSync, camera, channels, filterMovies, filterTelevision, filterMusic):
     """
     Partage (ou retire) les bibliothèques via leur nom.
     Si library_names est vide : retire tous les accès (unshare complet).
     """
     from plexapi.server import PlexServer
-    plex = PlexServer(plex_url, plex_token)
+    plex = PlexServer(plex_url, plex_token, session=http_client.get_session())
     account = plex.myPlexAccount()
-    logger.debug(f"[plex_share_helper] Recherche du user dans Plex avec username='{username}'")
-    logger.debug(f"[plex_share_helper] Liste des users connus : {[u.title for u in account.users()]}")
+    logger.debug("[plex_share_helper] Recherche du user dans Plex avec username='%s'", username)
+    if logger.isEnabledFor(logging.DEBUG):
+        # account.users() est une requête plex.tv : seulement si le message sera écrit
+        logger.debug("[plex_share_helper] Liste des users connus : %s", [u.title for u in account.users()])
 
     user = account.user(username)
     logger.info(f"Maj des accès Plex : user={username}, libraries={library_names}")
@@ -245,6 +250,7 @@ def set_user_libraries(plex_token, plex_url, username, library_names, allowSync,
 
 
 
+@plex_cache.invalidates_cache
 def set_user_libraries_via_api(
     plex_token, plex_url, username, library_names,
     allowSync, camera, channels, filterMovies, filterTelevision, filterMusic
@@ -256,8 +262,8 @@ def set_user_libraries_via_api(
 
     # 1. Récupère l'user_id Plex cible via l'API Plex.tv (XML)
     users_url = "https://plex.tv/api/users"
-    r = requests.get(users_url, headers=headers)
-    logger.debug(f"[PlexAPI] /api/users code={r.status_code} content={r.text[:300]}")
+    r = plex_cache.get(users_url, headers=headers)
+    logger.debug("[PlexAPI] /api/users code=%s content=%.300s", r.status_code, r.text)
     if r.status_code != 200:
         logger.error(f"[PlexAPI] Erreur HTTP {r.status_code} sur /api/users : {r.text[:300]}")
         raise Exception(f"Erreur HTTP {r.status_code} sur /api/users : {r.text[:300]}")
@@ -290,8 +296,8 @@ def set_user_libraries_via_api(
 
     # 2. Récupère le vrai server_id Plex.tv à partir du machineIdentifier local
     libs_url = f"{plex_url.rstrip('/')}/library/sections"
-    libs_r = requests.get(libs_url, headers=headers)
-    logger.debug(f"[PlexAPI] /library/sections code={libs_r.status_code} content={libs_r.text[:300]}")
+    libs_r = http_client.get(libs_url, headers=headers)
+    logger.debug("[PlexAPI] /library/sections code=%s content=%.300s", libs_r.status_code, libs_r.text)
     if libs_r.status_code != 200:
         logger.error(f"[PlexAPI] Erreur HTTP {libs_r.status_code} sur /library/sections : {libs_r.text[:300]}")
         raise Exception(f"Erreur HTTP {libs_r.status_code} sur /library/sections : {libs_r.text[:300]}")
@@ -300,7 +306,7 @@ def set_user_libraries_via_api(
     if not machine_identifier:
         # 2e essai : requête sur /
         root_url = f"{plex_url.rstrip('/')}/"
-        root_r = requests.get(root_url, headers=headers)
+        root_r = http_client.get(root_url, headers=headers)
         if root_r.status_code == 200:
             try:
                 machine_identifier = root_r.json()['MediaContainer'].get('machineIdentifier')
@@ -317,7 +323,7 @@ def set_user_libraries_via_api(
 
     # Récupère le server_id sur plex.tv correspondant au bon machineIdentifier
     servers_url = "https://plex.tv/api/servers"
-    s = requests.get(servers_url, headers=headers)
+    s = plex_cache.get(servers_url, headers=headers)
     try:
         stree = ET.fromstring(s.text)
         server_id = None
@@ -361,8 +367,8 @@ def set_user_libraries_via_api(
 
     # 4. Envoie le POST vers l’API Plex.tv !
     share_url = "https://plex.tv/api/v2/shared_servers"
-    resp = requests.post(share_url, headers=headers, json=data)
-    logger.debug(f"[PlexAPI] POST {share_url} code={resp.status_code} content={resp.text[:300]}")
+    resp = http_client.post(share_url, headers=headers, json=data)
+    logger.debug("[PlexAPI] POST %s code=%s content=%.300s", share_url, resp.status_code, resp.text)
     if resp.status_code not in (200, 201):
         logger.error(f"[PlexAPI] Echec partage : code={resp.status_code} data={resp.text}")
         raise Exception(f"[PlexAPI] Echec partage : code={resp.status_code} data={resp.text}")
@@ -370,6 +376,7 @@ def set_user_libraries_via_api(
 
 
 
+@plex_cache.invalidates_cache
 def share_user_libraries_plexapi(
     plex_url, plex_token, username, library_names,
     allowSync, camera, channels, filterMovies, filterTelevision, filterMusic
@@ -377,7 +384,7 @@ def share_user_libraries_plexapi(
     import logging
     logger = logging.getLogger("plex_share")
     try:
-        plex = PlexServer(plex_url, plex_token)
+        plex = PlexServer(plex_url, plex_token, session=http_client.get_session())
         account = plex.myPlexAccount()
         user = account.user(username)
         logger.info(f"[Plex] Found user: {user.title} ({user.email})")
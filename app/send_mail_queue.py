@@ -1,14 +1,84 @@
-import sqlite3
 import sys, os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import queue
+import socket
+import threading
 import time
-from datetime import datetime
-from mailer import send_email
+import uuid
+from mailer import MailSession, PreparedMessage, load_smtp_config
 from logger import logger
-from config import DATABASE_PATH
+from db import get_db, close_db
+from db_indexes import hot_query
+from settings_helper import get_int
 
 
+# Valeurs par défaut si les colonnes settings ne sont pas renseignées
+DEFAULT_WORKERS = 4                  # sessions SMTP en parallèle
+DEFAULT_RATE_PER_MINUTE = 120        # tous destinataires confondus
+DEFAULT_DOMAIN_RATE_PER_MINUTE = 30  # par domaine destinataire (gmail.com, ...)
+COMMIT_EVERY = 50                    # statuts mail_queue écrits par lot
+COMMIT_INTERVAL = 2.0                # ... ou au plus tard toutes les N secondes
+
+# File d'envoi : chaque ligne est "louée" par un worker le temps de l'envoyer.
+# Une location non renouvelée (worker tué, conteneur redémarré) remet la ligne en 'pending'.
+LEASE_SECONDS = 300                  # durée d'une location, renouvelée à chaque écriture de lot
+CLAIM_BATCH = 100                    # lignes réservées par réclamation
+POLL_INTERVAL = 2.0                  # secondes entre deux vérifications de PRAGMA data_version
+REQUEUE_INTERVAL = 60.0              # secondes entre deux recyclages des locations expirées
+
+# Création des campagnes : destinataires = utilisateurs avec ces statuts et un email renseigné
+RECIPIENT_STATUSES = ("active", "pre_expired", "reminder", "actif", "préavis", "preavis", "relance")
+ENQUEUE_CHUNK = 5000                 # lignes mail_queue insérées par transaction
+
+_STATUS_PLACEHOLDERS = ", ".join("?" for _ in RECIPIENT_STATUSES)
+
+# Dernier users.id de la tranche suivante : (last_id, *RECIPIENT_STATUSES, chunk_size)
+RECIPIENT_PAGE_SQL = hot_query("send_mail_queue.iter_recipient_chunks.page", f"""
+    SELECT MAX(id) AS last_id FROM (
+        SELECT id FROM users
+        WHERE id > ?
+          AND LOWER(status) IN ({_STATUS_PLACEHOLDERS})
+          AND email IS NOT NULL
+          AND TRIM(email) <> ''
+        ORDER BY id
+        LIMIT ?
+    )
+""")
+
+# File de la tranche : (campaign_id, server_id, last_id, page_last_id, *RECIPIENT_STATUSES)
+ENQUEUE_RECIPIENTS_SQL = hot_query("send_mail_queue.iter_recipient_chunks.enqueue", f"""
+    INSERT OR IGNORE INTO mail_queue (campaign_id, user_id, server_id, email, status)
+    SELECT ?, id, ?, TRIM(email), 'pending'
+    FROM users
+    WHERE id > ? AND id <= ?
+      AND LOWER(status) IN ({_STATUS_PLACEHOLDERS})
+      AND email IS NOT NULL
+      AND TRIM(email) <> ''
+""")
+
+# Réservation d'un lot : (lease_owner, durée de location, taille du lot)
+CLAIM_SQL = hot_query("send_mail_queue.claim", """
+    UPDATE mail_queue
+    SET status='sending', lease_owner=?, lease_expires_at=datetime('now', ?)
+    WHERE id IN (
+        SELECT q.id
+        FROM mail_queue q
+        JOIN mail_campaigns c ON c.id = q.campaign_id
+        WHERE q.status = 'pending'
+          AND c.status IN ('pending', 'sending')
+        ORDER BY q.campaign_id, q.id
+        LIMIT ?
+    )
+    RETURNING id, campaign_id, email, subject, html_content
+""")
+
+REQUEUE_EXPIRED_SQL = hot_query("send_mail_queue.requeue_expired", """
+    UPDATE mail_queue
+    SET status='pending', lease_owner=NULL, lease_expires_at=NULL
+    WHERE status='sending'
+      AND (lease_expires_at IS NULL OR lease_expires_at < datetime('now'))
+""")
 
 
 def mark_campaign_status(cur, campaign_id, new_status):
@@ -34,21 +104,19 @@ def mark_campaign_status(cur, campaign_id, new_status):
 
 def cleanup_old_campaigns(cur, conn):
     """
-    Nettoie les campagnes bloquées ou anciennes :
-    - Marque comme 'finished' celles restées en 'sending' plus de 6h ou sans started_at
-    - Supprime les campagnes 'finished' vieilles de plus de 30 jours
+    Supprime les campagnes 'finished' vieilles de plus de 30 jours, et les campagnes
+    restées en 'preparing' (création interrompue en cours de remplissage de la file).
+    (Les campagnes bloquées n'existent plus : les locations expirées sont remises en file
+    par MailQueueWorker.requeue_expired.)
     """
     try:
-        # 🧹 Campagnes bloquées
         cur.execute("""
-            UPDATE mail_campaigns
-            SET status='finished', finished_at=datetime('now')
-            WHERE status='sending'
-              AND (started_at IS NULL OR started_at < datetime('now','-6 hours'));
+            DELETE FROM mail_campaigns
+            WHERE status='preparing'
+              AND created_at < datetime('now','-1 day');
         """)
-        rows_blocked = cur.rowcount
-        if rows_blocked > 0:
-            logger.info(f"🧹 {rows_blocked} campagne(s) bloquée(s) marquée(s) comme terminée (6h+).")
+        if cur.rowcount > 0:
+            logger.info(f"🗑️ {cur.rowcount} campagne(s) jamais finalisée(s) supprimée(s).")
 
         # 🗑️ Campagnes trop anciennes
         cur.execute("""
@@ -66,96 +134,444 @@ def cleanup_old_campaigns(cur, conn):
         logger.error(f"❌ Erreur lors du nettoyage des campagnes : {e}")
 
 
-def main():
-    db_path = DATABASE_PATH
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-
-    # 🧹 Nettoyage automatique avant traitement
-    cleanup_old_campaigns(cur, conn)
-
-    # Débloquer les campagnes bloquées depuis plus de 2h ou sans started_at
-    cur.execute("""
-        UPDATE mail_campaigns
-        SET status='pending', started_at=NULL, finished_at=NULL
-        WHERE status='sending' 
-          AND (started_at IS NULL OR started_at < datetime('now','-2 hours'))
-    """)
-    rows = cur.rowcount
-    if rows > 0:
-        logger.info(f"🔁 {rows} campagne(s) réinitialisée(s) depuis 'sending' vers 'pending'")
-    conn.commit()
+def iter_recipient_chunks(conn, campaign_id, server_id, chunk_size=ENQUEUE_CHUNK):
+    """
+    Remplit mail_queue pour une campagne par INSERT ... SELECT depuis users, par tranches
+    de chunk_size utilisateurs (pagination sur users.id, une transaction par tranche pour
+    ne pas garder le verrou d'écriture sur de très grosses audiences).
+    Les lignes ne contiennent que le destinataire : sujet / contenu restent dans mail_campaigns.
+    Génère le nombre de lignes insérées par tranche.
+    """
+    last_id = 0
+    while True:
+        row = conn.execute(RECIPIENT_PAGE_SQL, (last_id, *RECIPIENT_STATUSES, chunk_size)).fetchone()
+        if row["last_id"] is None:
+            return
 
+        cur = conn.execute(
+            ENQUEUE_RECIPIENTS_SQL,
+            (campaign_id, server_id, last_id, row["last_id"], *RECIPIENT_STATUSES),
+        )
+        conn.commit()
+        last_id = row["last_id"]
+        yield cur.rowcount
 
-    # Récupère la prochaine campagne à envoyer
-    cur.execute(
-        """
-        SELECT id, subject, html_content, attachment_path
-        FROM mail_campaigns
-        WHERE status = 'pending'
-        ORDER BY id ASC
-        LIMIT 1
-        """
-    )
-    campaign = cur.fetchone()
 
-    if not campaign:
-        logger.info("⏳ Aucune campagne mail en attente.")
-        conn.close()
-        return
+def create_campaign(conn, server_id, subject, html_content, attachment_path=None):
+    """
+    Crée une campagne et sa file d'envoi. La campagne reste en 'preparing' (ignorée par
+    les workers) tant que la file n'est pas complète, puis passe en 'pending'.
+    Retourne (campaign_id, nombre de destinataires) ; campaign_id vaut None si personne n'est ciblé.
+    """
+    cur = conn.execute("""
+        INSERT INTO mail_campaigns (server_id, subject, html_content, attachment_path, status, created_at)
+        VALUES (?, ?, ?, ?, 'preparing', datetime('now'))
+    """, (server_id, subject, html_content, attachment_path))
+    campaign_id = cur.lastrowid
+    conn.commit()
+
+    try:
+        count = sum(iter_recipient_chunks(conn, campaign_id, server_id))
+    except Exception:
+        conn.rollback()
+        conn.execute("DELETE FROM mail_queue WHERE campaign_id=?", (campaign_id,))
+        conn.execute("DELETE FROM mail_campaigns WHERE id=?", (campaign_id,))
+        conn.commit()
+        raise
 
-    campaign_id, subject, html_content, attachment_path = campaign
+    if count == 0:
+        conn.execute("DELETE FROM mail_campaigns WHERE id=?", (campaign_id,))
+        conn.commit()
+        return None, 0
 
-    mark_campaign_status(cur, campaign_id, "sending")
+    conn.execute("UPDATE mail_campaigns SET status='pending' WHERE id=?", (campaign_id,))
     conn.commit()
-    logger.info(f"🚀 Début de l’envoi de la campagne ID={campaign_id}")
+    wake()
+    return campaign_id, count
+
+
+class TokenBucket:
+    """Seau à jetons thread-safe : `rate` jetons par seconde, rafale max `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Limite globale + limite par domaine destinataire (0 = pas de limite)."""
+
+    def __init__(self, per_minute, domain_per_minute):
+        self._global = TokenBucket(per_minute / 60.0) if per_minute > 0 else None
+        self._domain_rate = domain_per_minute / 60.0 if domain_per_minute > 0 else None
+        self._domains = {}
+        self._lock = threading.Lock()
+
+    def _domain_bucket(self, email):
+        domain = email.rsplit("@", 1)[-1].lower()
+        with self._lock:
+            if domain not in self._domains:
+                self._domains[domain] = TokenBucket(self._domain_rate)
+            return self._domains[domain]
+
+    def acquire(self, email):
+        if self._domain_rate:
+            self._domain_bucket(email).acquire()
+        if self._global:
+            self._global.acquire()
+
+
+def load_sender_options():
+    return {
+        "workers": max(1, get_int("mail_workers", DEFAULT_WORKERS)),
+        "rate_per_minute": get_int("mail_rate_per_minute", DEFAULT_RATE_PER_MINUTE),
+        "domain_rate_per_minute": get_int("mail_domain_rate_per_minute", DEFAULT_DOMAIN_RATE_PER_MINUTE),
+    }
+
+
+def split_recipients(to_email):
+    """Découpe un to_email ("a@x, b@y") en liste d'adresses, sans les entrées vides."""
+    return [a.strip() for a in (to_email or "").split(",") if a.strip()]
+
+
+def _sender_worker(smtp_config, jobs, results, limiter):
+    """
+    Thread d'envoi : une session SMTP, consomme `jobs`, publie (queue_id, ok, err) dans `results`.
+    Un job porte soit le PreparedMessage de sa campagne, soit son propre (sujet, corps) personnalisé
+    (rappels). `addresses` est la liste déjà découpée de to_email (cf. split_recipients) : un mail
+    par adresse, la ligne n'est envoyée que si tous les envois réussissent.
+    """
+    with MailSession(config=smtp_config) as session:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            queue_id, addresses, message = job
+            try:
+                ok, err = True, None
+                for address in addresses:
+                    limiter.acquire(address)
+                    if isinstance(message, PreparedMessage):
+                        sent, error = session.send_prepared(message, address)
+                    else:
+                        sent, error = session.send(address, *message)
+                    if not sent:
+                        ok, err = False, error
+            except Exception as e:
+                ok, err = False, str(e)
+            # Toujours un résultat par job : le thread principal en attend exactement autant
+            results.put((queue_id, ok, err))
+
 
-    # Récupère la file d’attente liée
-    cur.execute(
+class MailQueueWorker:
+    """
+    Worker de la file mail_queue, utilisable dans le process Flask (start_worker)
+    ou en process dédié (python3 send_mail_queue.py --worker).
+
+    - réclame les lignes 'pending' par lots : status='sending' + lease_owner/lease_expires_at,
+      en un seul UPDATE, donc plusieurs workers (ou le cron) peuvent tourner en même temps
+    - renouvelle ses locations à chaque écriture de résultats
+    - remet en 'pending' les lignes dont la location a expiré (worker mort)
+    - passe une campagne en 'finished' dès qu'il ne lui reste plus de ligne à envoyer
+    - se réveille via wake() (même process) ou quand PRAGMA data_version change (autre process)
+    """
+
+    def __init__(self, lease_seconds=LEASE_SECONDS, batch_size=CLAIM_BATCH, poll_interval=POLL_INTERVAL):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    # --- contrôle ---
+
+    def wake(self):
+        """Signale qu'il y a (peut-être) de nouvelles lignes à envoyer."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    # --- file ---
+
+    def _lease(self):
+        return f"+{int(self.lease_seconds)} seconds"
+
+    def requeue_expired(self, conn):
+        """Remet en 'pending' les lignes 'sending' dont la location a expiré."""
+        cur = conn.execute(REQUEUE_EXPIRED_SQL)
+        conn.commit()
+        if cur.rowcount > 0:
+            logger.warning(f"🔁 {cur.rowcount} mail(s) dont la location a expiré remis en file")
+        return cur.rowcount
+
+    def claim(self, conn):
+        """Réserve jusqu'à batch_size lignes 'pending' pour ce worker. Retourne les lignes réservées."""
+        rows = conn.execute(CLAIM_SQL, (self.owner, self._lease(), self.batch_size)).fetchall()
+
+        started = []
+        for campaign_id in sorted({r["campaign_id"] for r in rows}):
+            if conn.execute("SELECT status FROM mail_campaigns WHERE id=?", (campaign_id,)).fetchone()["status"] == "pending":
+                mark_campaign_status(conn.cursor(), campaign_id, "sending")
+                started.append(campaign_id)
+        conn.commit()
+        for campaign_id in started:
+            logger.info(f"🚀 Début de l’envoi de la campagne ID={campaign_id}")
+        return rows
+
+    def _flush(self, conn, pending):
+        """Écrit un lot de résultats (seulement sur les lignes encore louées par ce worker) et renouvelle la location."""
+        sent = [(self.owner, queue_id) for queue_id, ok, _ in pending if ok]
+        failed = [(err, self.owner, queue_id) for queue_id, ok, err in pending if not ok]
+        # Rappels : l'historique sent_emails n'est écrit qu'une fois le mail réellement parti
+        conn.executemany("""
+            INSERT INTO sent_emails (user_id, type, date_sent, expiration_snapshot)
+            SELECT q.user_id, q.reminder_type, date('now', 'localtime'), q.expiration_snapshot
+            FROM mail_queue q
+            WHERE q.lease_owner=? AND q.id=?
+              AND q.reminder_type IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM sent_emails s
+                  WHERE s.user_id = q.user_id
+                    AND s.type = q.reminder_type
+                    AND s.expiration_snapshot = q.expiration_snapshot
+              )
+        """, sent)
+        conn.executemany("""
+            UPDATE mail_queue
+            SET status='sent', sent_at=datetime('now'), lease_owner=NULL, lease_expires_at=NULL
+            WHERE lease_owner=? AND id=?
+        """, sent)
+        conn.executemany("""
+            UPDATE mail_queue
+            SET status='error', error_message=?, lease_owner=NULL, lease_expires_at=NULL
+            WHERE lease_owner=? AND id=?
+        """, failed)
+        conn.execute("""
+            UPDATE mail_queue SET lease_expires_at=datetime('now', ?)
+            WHERE lease_owner=? AND status='sending'
+        """, (self._lease(), self.owner))
+        conn.commit()
+        pending.clear()
+        return len(sent)
+
+    def finalize_campaigns(self, conn):
+        """Passe en 'finished' les campagnes sans ligne 'pending'/'sending' restante."""
+        finished = conn.execute("""
+            UPDATE mail_campaigns
+            SET status='finished', finished_at=datetime('now')
+            WHERE status IN ('pending', 'sending')
+              AND NOT EXISTS (
+                  SELECT 1 FROM mail_queue q
+                  WHERE q.campaign_id = mail_campaigns.id
+                    AND q.status IN ('pending', 'sending')
+              )
+            RETURNING id
+        """).fetchall()
+        conn.commit()
+        for row in finished:
+            counts = conn.execute("""
+                SELECT COUNT(*) AS total, COALESCE(SUM(status='sent'), 0) AS sent
+                FROM mail_queue WHERE campaign_id=?
+            """, (row["id"],)).fetchone()
+            logger.info(f"✅ Campagne terminée ID={row['id']} ({counts['sent']}/{counts['total']} mails envoyés)")
+        return len(finished)
+
+    def _has_pending(self, conn):
+        return conn.execute("""
+            SELECT 1 FROM mail_queue q
+            JOIN mail_campaigns c ON c.id = q.campaign_id
+            WHERE q.status = 'pending' AND c.status IN ('pending', 'sending')
+            LIMIT 1
+        """).fetchone() is not None
+
+    # --- envoi ---
+
+    def _prepare(self, conn, campaign_id, smtp_config):
         """
-        SELECT id, user_id, email
-        FROM mail_queue
-        WHERE campaign_id = ? AND status = 'pending'
-        """,
-        (campaign_id,),
-    )
-    rows = cur.fetchall()
-
-    sent_count = 0
-    for row in rows:
-        queue_id, user_id, to_email = row
-        if not to_email:
-            cur.execute(
-                "UPDATE mail_queue SET status='error', error='Email vide' WHERE id=?",
-                (queue_id,),
+        Construit le message d'une campagne une seule fois pour tout le run
+        (corps + pièce jointe encodés). Retourne le PreparedMessage ou le message d'erreur.
+        """
+        campaign = conn.execute(
+            "SELECT subject, html_content, attachment_path FROM mail_campaigns WHERE id=?",
+            (campaign_id,),
+        ).fetchone()
+        try:
+            return PreparedMessage(
+                campaign["subject"] or "(sans sujet)",
+                campaign["html_content"] or "",
+                smtp_config["mail_from"],
+                attachment_path=campaign["attachment_path"],
             )
-            continue
+        except Exception as e:
+            logger.error(f"❌ Campagne ID={campaign_id} : message impossible à préparer ({e})")
+            return f"Erreur lecture pièce jointe: {e}"
+
+    def run_once(self):
+        """
+        Vide la file : réclame des lots jusqu'à ce qu'il n'y ait plus rien à envoyer.
+        Les sessions SMTP, le limiteur de débit et les messages préparés (un par campagne)
+        sont partagés par tous les lots du run.
+        Retourne le nombre de mails envoyés.
+        """
+        conn = get_db()
+        self.requeue_expired(conn)
+        self.finalize_campaigns(conn)
+
+        if not self._has_pending(conn):
+            return 0
 
-        ok, err = send_email(
-            to_email, subject or "(sans sujet)", html_content or "", attachment_path=attachment_path
+        smtp_config, error = load_smtp_config()
+        if smtp_config is None:
+            logger.error(f"❌ Campagnes non envoyées : {error}")
+            return 0
+
+        options = load_sender_options()
+        limiter = RateLimiter(options["rate_per_minute"], options["domain_rate_per_minute"])
+        logger.info(
+            f"📬 Envoi de la file mail — {options['workers']} session(s) SMTP, "
+            f"{options['rate_per_minute']}/min global, {options['domain_rate_per_minute']}/min par domaine"
         )
 
-        if ok:
-            cur.execute(
-                "UPDATE mail_queue SET status='sent', sent_at=datetime('now') WHERE id=?",
-                (queue_id,),
-            )
-            sent_count += 1
-        else:
-            cur.execute(
-                "UPDATE mail_queue SET status='error', error=? WHERE id=?",
-                (err, queue_id),
-            )
+        jobs = queue.Queue()
+        results = queue.Queue()
+        senders = []
+        campaigns = {}
+        sent_count = 0
+        try:
+            while not self._stop.is_set():
+                rows = self.claim(conn)
+                if not rows:
+                    break
 
-        conn.commit()
-        time.sleep(0.2)  # petit délai entre les mails
+                pending = []
+                expected = 0
+                for row in rows:
+                    addresses = split_recipients(row["email"])
+                    if not addresses:
+                        # vide ou uniquement des séparateurs (",", " , ") : rien à envoyer
+                        pending.append((row["id"], False, "Email vide"))
+                        continue
+                    if row["html_content"] is not None:
+                        # contenu personnalisé porté par la ligne (rappels)
+                        jobs.put((row["id"], addresses, (row["subject"] or "(sans sujet)", row["html_content"])))
+                        expected += 1
+                        continue
+                    if row["campaign_id"] not in campaigns:
+                        campaigns[row["campaign_id"]] = self._prepare(conn, row["campaign_id"], smtp_config)
+                    prepared = campaigns[row["campaign_id"]]
+                    if isinstance(prepared, str):
+                        pending.append((row["id"], False, prepared))
+                        continue
+                    jobs.put((row["id"], addresses, prepared))
+                    expected += 1
 
-    mark_campaign_status(cur, campaign_id, "finished")
-    conn.commit()
-    conn.close()
+                # Les threads d'envoi sont démarrés à la demande et gardés jusqu'à la fin du run
+                for _ in range(min(options["workers"] - len(senders), expected)):
+                    t = threading.Thread(
+                        target=_sender_worker,
+                        args=(smtp_config, jobs, results, limiter),
+                        daemon=True,
+                    )
+                    t.start()
+                    senders.append(t)
+
+                last_flush = time.monotonic()
+                for _ in range(expected):
+                    pending.append(results.get())
+                    if len(pending) >= COMMIT_EVERY or time.monotonic() - last_flush >= COMMIT_INTERVAL:
+                        sent_count += self._flush(conn, pending)
+                        last_flush = time.monotonic()
+                sent_count += self._flush(conn, pending)
+                self.finalize_campaigns(conn)
+        finally:
+            for _ in senders:
+                jobs.put(None)  # une sentinelle de fin par thread
+            for t in senders:
+                t.join()
 
-    logger.info(f"✅ Campagne terminée ID={campaign_id} ({sent_count} mails envoyés)")
+        return sent_count
+
+    def run_forever(self):
+        """Boucle résidente : vide la file à chaque réveil, recycle périodiquement les locations expirées."""
+        logger.info(f"📮 Worker mail_queue démarré ({self.owner})")
+        conn = get_db()
+        cleanup_old_campaigns(conn.cursor(), conn)
+        last_version = None
+        last_requeue = 0.0
+        try:
+            while not self._stop.is_set():
+                try:
+                    # data_version change dès qu'une autre connexion (autre thread ou process) a commit
+                    version = conn.execute("PRAGMA data_version").fetchone()[0]
+                    due = time.monotonic() - last_requeue >= REQUEUE_INTERVAL
+                    if self._wake.is_set() or version != last_version or due:
+                        self._wake.clear()
+                        self.run_once()
+                        if due:
+                            last_requeue = time.monotonic()
+                        # nos propres écritures ne comptent pas dans data_version
+                        last_version = conn.execute("PRAGMA data_version").fetchone()[0]
+                except Exception as e:
+                    logger.error(f"❌ Erreur du worker mail_queue : {e}")
+                    conn.rollback()
+                self._wake.wait(self.poll_interval)
+        finally:
+            close_db()
+            logger.info(f"📮 Worker mail_queue arrêté ({self.owner})")
+
+
+# =======================
+# Worker du process Flask
+# =======================
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_worker():
+    """Démarre (une seule fois) le worker résident dans un thread du process courant."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = MailQueueWorker()
+            threading.Thread(target=_worker.run_forever, name="mail-queue-worker", daemon=True).start()
+    return _worker
+
+
+def wake():
+    """Réveille le worker du process courant (sans effet s'il n'est pas démarré : il verra data_version)."""
+    if _worker is not None:
+        _worker.wake()
+
+
+def main():
+    conn = get_db()
+    cleanup_old_campaigns(conn.cursor(), conn)
+    sent = MailQueueWorker().run_once()
+    if sent == 0:
+        logger.info("⏳ Aucun mail en attente.")
+    close_db()
 
 
 if __name__ == "__main__":
-    main()
+    if "--worker" in sys.argv:
+        MailQueueWorker().run_forever()
+    else:
+        main()
@@ -1,172 +1,157 @@
 import sqlite3
-import time
 from datetime import datetime, timedelta
-from mailer import send_email
-from config import DATABASE_PATH
-from settings_helper import get_settings
+from db import get_db, transaction
+from db_indexes import hot_query
+from settings_helper import get_bool
 from logger import logger
+import send_mail_queue
 
 # Intervalle avant nouvel envoi (non utilisé, laissé pour compatibilité éventuelle)
 UPDATE_INTERVAL = 86400  # 24h
 
+# Modèles de email_templates envoyés automatiquement
+REMINDER_TYPES = ("preavis", "relance", "fin")
+
+# email_templates (3 modèles) pilote la jointure ; users est lu en plage sur idx_users_expiration
+DUE_REMINDERS_SQL = hot_query("send_reminder_emails.get_due_reminders", f"""
+    SELECT u.id AS user_id, u.username, u.email, u.second_email, u.expiration_date,
+           t.type, t.subject, t.body,
+           CAST(julianday(u.expiration_date) - julianday(date('now', 'localtime')) AS INTEGER) AS days_left
+    FROM email_templates t
+    JOIN users u
+      -- fenêtre du modèle en plage sur idx_users_expiration : seuls les utilisateurs dus sont lus
+      ON u.expiration_date BETWEEN date('now', 'localtime')
+                               AND date('now', 'localtime', '+' || t.days_before || ' days')
+    WHERE t.type IN ({", ".join("?" for _ in REMINDER_TYPES)})
+      AND u.status != 'unfriended'
+      AND COALESCE(TRIM(u.email), '') <> ''   -- évite les adresses vides
+      AND days_left BETWEEN 0 AND t.days_before
+      AND NOT EXISTS (
+          SELECT 1 FROM sent_emails s
+          WHERE s.user_id = u.id AND s.type = t.type AND s.expiration_snapshot = u.expiration_date
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM mail_queue q
+          WHERE q.user_id = u.id AND q.reminder_type = t.type
+            AND q.expiration_snapshot = u.expiration_date
+            AND q.status IN ('pending', 'sending')
+      )
+    ORDER BY t.type, u.id
+""", expect_scan=("t",))
+
 class SafeDict(dict):
     def __missing__(self, key):
         return ""
 
 def load_templates():
     """Charge les modèles d'email depuis la base."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT type, subject, body, days_before FROM email_templates")
-    templates = {row[0]: {"subject": row[1], "body": row[2], "days_before": row[3]} for row in cursor.fetchall()}
-    conn.close()
+    rows = get_db().execute("SELECT type, subject, body, days_before FROM email_templates").fetchall()
+    templates = {row[0]: {"subject": row[1], "body": row[2], "days_before": row[3]} for row in rows}
     return templates
 
-def get_users():
-    """Récupère tous les utilisateurs éligibles à un mail (hors 'unfriended')."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT *
-        FROM users
-        WHERE expiration_date IS NOT NULL
-          AND status != 'unfriended'
-          AND COALESCE(TRIM(email), '') <> ''   -- évite les adresses vides
-    """)
-    users = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return users
-
-
-def should_send(days_left, template_days):
-    """Détermine si le mail doit être envoyé selon le nombre de jours restants."""
-    return 0 <= days_left <= template_days
-
-def already_sent(user_id, mail_type, expiration_date):
-    """Vérifie si le mail a déjà été envoyé pour ce type et cette date d'expiration."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT 1 FROM sent_emails
-        WHERE user_id = ? AND type = ? AND expiration_snapshot = ?
-        LIMIT 1
-    """, (user_id, mail_type, expiration_date))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+def get_due_reminders():
+    """
+    Rappels dus et pas encore envoyés, en une requête : utilisateurs × modèles de rappel
+    dont le nombre de jours restants est dans la fenêtre du modèle (0 <= jours <= days_before),
+    sans trace dans sent_emails ni rappel identique déjà en file.
+    La fenêtre est une plage sur expiration_date (date ISO AAAA-MM-JJ, comparable en texte) :
+    la requête ne touche que les utilisateurs dus, jamais l'historique (expirés, unfriended).
+    """
+    cursor = get_db().execute(DUE_REMINDERS_SQL, REMINDER_TYPES)
+    return cursor.fetchall()
+
+
+def enqueue_reminders(due):
+    """
+    Met les rappels dus dans mail_queue : une campagne par type de rappel, une ligne par
+    utilisateur (adresse principale + second email) avec sujet / corps personnalisés.
+    L'envoi (débit limité) et l'écriture de sent_emails sont faits par le worker de la file.
+    Retourne le nombre de rappels mis en file.
+    """
+    by_type = {}
+    for row in due:
+        by_type.setdefault(row["type"], []).append(row)
+
+    with transaction() as conn:
+        for mail_type, rows in by_type.items():
+            cur = conn.execute("""
+                INSERT INTO mail_campaigns (subject, status, created_at)
+                VALUES (?, 'pending', datetime('now'))
+            """, (f"Rappels {mail_type} du {datetime.now().date().isoformat()}",))
+            campaign_id = cur.lastrowid
+
+            queued = []
+            for row in rows:
+                values = SafeDict({"username": row["username"] or "", "days_left": row["days_left"]})
+                emails = [row["email"].strip()]
+                if (row["second_email"] or "").strip():
+                    emails.append(row["second_email"].strip())
+                queued.append((
+                    campaign_id, row["user_id"], ", ".join(emails),
+                    row["subject"].format_map(values), row["body"].format_map(values),
+                    mail_type, row["expiration_date"],
+                ))
+                logger.debug(f"📨 Rappel '{mail_type}' mis en file pour {row['username']} (J-{row['days_left']})")
+
+            conn.executemany("""
+                INSERT INTO mail_queue
+                    (campaign_id, user_id, email, subject, html_content, reminder_type, expiration_snapshot, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'pending')
+            """, queued)
+            logger.info(f"📬 {len(queued)} rappel(s) '{mail_type}' mis en file (campagne ID={campaign_id})")
+
+    send_mail_queue.wake()
+    return len(due)
+
 
 def acquire_lock():
     """Empêche l’exécution concurrente (pour éviter les doublons d’envois)."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO locks (name, acquired_at) VALUES ('reminder_lock', ?)", (datetime.now().isoformat(),))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("INSERT INTO locks (name, acquired_at) VALUES ('reminder_lock', ?)", (datetime.now().isoformat(),))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def release_lock():
     """Libère le verrou."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM locks WHERE name = 'reminder_lock'")
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM locks WHERE name = 'reminder_lock'")
 
 def auto_reminders():
     """
-    Fonction principale : envoie les mails de rappel aux utilisateurs selon leur date d’expiration.
+    Fonction principale : met en file les mails de rappel dus selon leur date d’expiration.
+    L'envoi (au débit configuré) est fait par le worker de la file mail (send_mail_queue).
     À lancer une seule fois (mode cron/Supercronic).
     """
     if not acquire_lock():
         logger.warning("🔒 Un autre processus gère déjà l'envoi des rappels. Abandon.")
         return
 
-    settings = get_settings()
-    if not settings.get("send_reminders"):
+    if not get_bool("send_reminders"):
         logger.info("⏸️ Envoi de mails désactivé dans les paramètres.")
         release_lock()
         return
 
-    templates = load_templates()
-    today = datetime.now().date()
-    logger.info("⏸️ Envoi des mails pour les abonnements expirés ou bientôt expirés.")
-
-    for user in get_users():
-        if not user.get("email"):
-            continue
-        if (user.get("status") or "") == "unfriended":
-            continue
-
-        try:
-            expiration_date = datetime.strptime(user["expiration_date"], "%Y-%m-%d").date()
-            days_left = (expiration_date - today).days
-        except Exception as e:
-            logger.warning(f"⚠️ Utilisateur {user['id']} : date invalide → {e}")
-            continue
-
-        for mail_type in ["preavis", "relance", "fin"]:
-            tpl = templates.get(mail_type)
-            if not tpl:
-                continue
-            logger.debug(f"👀 {user['username']} expire dans {days_left} jours – checking {mail_type} (J-{tpl['days_before']})")
-
-            date_str = today.isoformat()
-            if already_sent(user["id"], mail_type, user["expiration_date"]):
-                logger.info(f"📭 Mail déjà envoyé ({mail_type}) à {user['username']} aujourd’hui")
-                continue
-
-            if should_send(days_left, tpl["days_before"]):
-                subject = tpl["subject"].format_map(SafeDict({
-                    "username": user.get("username", ""),
-                    "days_left": days_left
-                }))
-
-                body = tpl["body"].format_map(SafeDict({
-                    "username": user.get("username", ""),
-                    "days_left": days_left
-                }))
-
-                emails = [user["email"]]
-                if user.get("second_email"):
-                    emails.append(user["second_email"])
-
-                success = True
-                for e in emails:
-                    s, _ = send_email(e, subject, body)
-                    success = success and s
-
-                if success:
-                    logger.info(f"📧 Mail '{mail_type}' envoyé à {user['email']} ({user['username']})")
-                    conn = sqlite3.connect(DATABASE_PATH)
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        INSERT INTO sent_emails (user_id, type, date_sent, expiration_snapshot)
-                        VALUES (?, ?, ?, ?)
-                    """, (user["id"], mail_type, date_str, user["expiration_date"]))
-                    conn.commit()
-                    conn.close()
-                    time.sleep(30)  # Pause anti-spam
-
-    release_lock()
+    try:
+        due = get_due_reminders()
+        if due:
+            enqueue_reminders(due)
+        else:
+            logger.info("📭 Aucun rappel à envoyer aujourd’hui.")
+    finally:
+        release_lock()
     update_task_status("send_reminders")  # Tu peux ajouter le champ 'interval' si tu le souhaites
 
 def update_task_status(task_name):
     """Met à jour la table de suivi pour l’historique des envois."""
     now = datetime.now()
     next_run = None
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT OR REPLACE INTO task_status (name, last_run, next_run)
-        VALUES (?, ?, ?)
-    """, (task_name, now.isoformat(), next_run))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO task_status (name, last_run, next_run)
+            VALUES (?, ?, ?)
+        """, (task_name, now.isoformat(), next_run))
 
 if __name__ == "__main__":
     auto_reminders()
@@ -1,12 +1,101 @@
+# /app/settings_helper.py
+"""
+Paramètres (table settings, une seule ligne) mis en cache pour tout le process.
+
+- get_settings()               : copie du dict des paramètres
+- get_setting(key, default)    : valeur brute (default si absente ou vide)
+- get_int / get_bool / get_str : accesseurs typés (default si absente ou illisible)
+- invalidate()                 : oublie le cache (après une écriture ou une restauration de la base)
+
+La ligne porte un compteur `version`, incrémenté par un trigger à chaque UPDATE (cf. update_vodum) :
+au plus toutes les CHECK_INTERVAL secondes, on relit ce seul entier pour savoir si un autre
+process (app, cron, bot) a modifié les paramètres, sans relire toute la ligne.
+"""
 import sqlite3
-from config import DATABASE_PATH
+import threading
+import time
+
+from db import get_db
+
+CHECK_INTERVAL = 2.0   # secondes entre deux vérifications du compteur de version
+
+_lock = threading.Lock()
+_settings = None       # dict en cache (None = à charger)
+_version = None
+_checked_at = 0.0
+
+_TRUE = {"1", "true", "yes", "on", "oui"}
+
+
+def _read_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM settings LIMIT 1").fetchone()
+    except sqlite3.OperationalError:
+        return None  # colonne pas encore créée (avant update_vodum)
+    return row[0] if row else None
+
+
+def _load():
+    global _settings, _version, _checked_at
+    conn = get_db()
+    row = conn.execute("SELECT * FROM settings LIMIT 1").fetchone()
+    settings = dict(row) if row else {}
+    with _lock:
+        _settings = settings
+        _version = settings.get("version")
+        _checked_at = time.monotonic()
+    return settings
+
+
+def _current():
+    global _checked_at
+    with _lock:
+        settings, version, checked_at = _settings, _version, _checked_at
+    if settings is None:
+        return _load()
+    if time.monotonic() - checked_at < CHECK_INTERVAL:
+        return settings
+    if version is None or _read_version(get_db()) != version:
+        return _load()
+    with _lock:
+        _checked_at = time.monotonic()
+    return settings
+
+
+def invalidate():
+    """Le prochain accès relit la table settings."""
+    global _settings
+    with _lock:
+        _settings = None
 
 
 def get_settings():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM settings LIMIT 1")
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else {}
+    return dict(_current())
+
+
+def get_setting(key, default=None):
+    value = _current().get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return default
+    return value
+
+
+def get_int(key, default=0):
+    try:
+        return int(get_setting(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_bool(key, default=False):
+    value = get_setting(key)
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in _TRUE
+    return bool(value)
+
+
+def get_str(key, default=""):
+    value = get_setting(key, default)
+    return str(value).strip() if value is not None else default
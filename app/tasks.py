@@ -1,10 +1,10 @@
 # /app/tasks.py
-import sqlite3
 from flask import Blueprint, render_template, redirect, url_for
 from datetime import datetime, UTC, timedelta
-from config import DATABASE_PATH
+from db import get_db, transaction
 from logger import logger
 from zoneinfo import ZoneInfo
+from settings_helper import get_str
 from clean_temp_files import main as clean_temp_files_main
 
 tasks_bp = Blueprint("tasks", __name__)
@@ -37,22 +37,14 @@ TASKS = {
 
 
 def update_task_status(name: str, next_run: str | None = None):
-    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
-    try:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA busy_timeout=5000;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        cur = conn.cursor()
-        cur.execute("""
+    with transaction() as conn:
+        conn.execute("""
             INSERT INTO task_status (name, last_run, next_run)
             VALUES (?, ?, ?)
             ON CONFLICT(name) DO UPDATE SET
               last_run = excluded.last_run,
               next_run = excluded.next_run
         """, (name, datetime.now(UTC).isoformat(), next_run))
-        conn.commit()
-    finally:
-        conn.close()
 
 
 def get_all_tasks():
@@ -60,27 +52,19 @@ def get_all_tasks():
 
 
 def get_timezone():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT timezone FROM settings LIMIT 1")
-    row = cursor.fetchone()
-    conn.close()
-    if row and row[0]:
+    name = get_str("timezone")
+    if name:
         try:
-            return ZoneInfo(row[0])
+            return ZoneInfo(name)
         except Exception:
-            logger.warning(f"⚠️ Fuseau horaire invalide en BDD : {row[0]}, fallback UTC")
+            logger.warning(f"⚠️ Fuseau horaire invalide en BDD : {name}, fallback UTC")
     return ZoneInfo("UTC")
 
 
 def get_task_status():
     tz = get_timezone()
 
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, last_run, next_run FROM task_status")
-    rows = cursor.fetchall()
-    conn.close()
+    rows = get_db().execute("SELECT name, last_run, next_run FROM task_status").fetchall()
 
     results = []
     for name, last_run, next_run in rows:
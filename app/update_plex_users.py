@@ -1,6 +1,6 @@
 import os
-import sqlite3
-import requests
+import http_client
+import plex_cache
 import time
 import threading  # Permet d'exécuter la tâche en arrière-plan
 import xml.etree.ElementTree as ET
@@ -9,6 +9,10 @@ from logger import logger
 import threading
 from datetime import datetime, timedelta
 import rebuild_user_servers
+import events
+from db import get_db, transaction
+from db_indexes import hot_query
+from plex_fetch import PlexFetcher
 #import logging
 
 
@@ -21,7 +25,6 @@ import rebuild_user_servers
 
 # Configuration
 
-DATABASE_PATH = "/app/appdata/database.db"
 UPDATE_INTERVAL = 43200  # Temps en secondes (ex: 3600s = 1h)
 
 # Configuration du logging
@@ -42,22 +45,29 @@ def auto_sync():
 
 
 def update_task_status(task_name, interval_seconds):
-    from config import DATABASE_PATH
     now = datetime.now()
     next_run = now + timedelta(seconds=interval_seconds)
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT OR REPLACE INTO task_status (name, last_run, next_run)
-        VALUES (?, ?, ?)
-    """, (task_name, now.isoformat(), next_run.isoformat()))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO task_status (name, last_run, next_run)
+            VALUES (?, ?, ?)
+        """, (task_name, now.isoformat(), next_run.isoformat()))
+
+PLEX_ACCOUNT_URL = "https://plex.tv/users/account"
+PLEX_USERS_URL = "https://plex.tv/api/users"
+PLEX_HOME_USERS_URL = "https://plex.tv/api/home/users"
+PLEX_SHARED_SERVERS_URL = "https://plex.tv/api/servers/{server_id}/shared_servers"
+
 
-def get_admin_id(token):
-    url = "https://plex.tv/users/account"
-    headers = {"X-Plex-Token": token}
-    response = requests.get(url, headers=headers)
+def _http_get(url, token, fetcher=None):
+    """GET Plex : via le fetcher de la synchro s'il y en a un (parallèle + dédoublonné)."""
+    if fetcher is not None:
+        return fetcher.get(url, token)
+    return plex_cache.get(url, headers={"X-Plex-Token": token})
+
+
+def get_admin_id(token, fetcher=None):
+    response = _http_get(PLEX_ACCOUNT_URL, token, fetcher)
     if response.status_code == 200:
         root = ET.fromstring(response.text)
         return int(root.attrib.get("id", -1))
@@ -68,7 +78,7 @@ def get_admin_id(token):
 
 def initialize_database():
     """🗄️ Initialise la base de données en créant les tables si elles n'existent pas."""
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
+    conn = get_db()
     cursor = conn.cursor()
 
     # Vérifie si la table 'plex_stats' existe déjà
@@ -84,13 +94,10 @@ def initialize_database():
 
     #threading.Thread(target=auto_sync, daemon=True).start()
     conn.commit()
-    conn.close()
 
 def get_plex_servers():
     """Récupère la liste des serveurs Plex depuis la base SQLite (sans appel à l’API Plex)."""
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    cursor = conn.cursor()
-    cursor.execute("""
+    cursor = get_db().execute("""
         SELECT server_id, name, plex_url, plex_token, plex_status,
                tautulli_url, tautulli_api_key, tautulli_status,
                local_url, public_url
@@ -98,7 +105,6 @@ def get_plex_servers():
     """)
 
     rows = cursor.fetchall()
-    conn.close()
 
     servers = []
     for row in rows:
@@ -119,20 +125,17 @@ def get_plex_servers():
 def discover_plex_servers():
     """Interroge l’API Plex pour détecter les serveurs liés au compte (utiliser lors de l'initialisation)."""
     servers = []
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    cursor = conn.cursor()
-    cursor.execute("""
+    cursor = get_db().execute("""
         SELECT DISTINCT plex_token
         FROM servers
         WHERE plex_token IS NOT NULL AND plex_token != ''
     """)
     tokens = [row[0] for row in cursor.fetchall()]
-    conn.close()
 
     for token in tokens:
         headers = {"X-Plex-Token": token}
         try:
-            r = requests.get("https://plex.tv/api/resources?includeHttps=1", headers=headers)
+            r = plex_cache.get("https://plex.tv/api/resources?includeHttps=1", headers=headers)
             r.raise_for_status()
             root = ET.fromstring(r.text)
 
@@ -165,16 +168,19 @@ def discover_plex_servers():
                     })
 
         except Exception as e:
-            logger.warning(f"⚠️ Erreur de découverte avec token {token[:6]}... : {e}")
+            logger.warning("⚠️ Erreur de découverte des serveurs Plex : %s", e)
 
     return servers
 
 
 
-def get_plex_users():
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    cursor = conn.cursor()
-    cursor.execute("""
+def get_plex_users(fetcher=None):
+    if fetcher is None:
+        with PlexFetcher() as own_fetcher:
+            return get_plex_users(own_fetcher)
+
+    conn = get_db()
+    cursor = conn.execute("""
         SELECT DISTINCT name, plex_token
         FROM servers
         WHERE plex_status = '🟢 OK'
@@ -182,62 +188,76 @@ def get_plex_users():
           AND plex_token != ''
     """)
     rows = cursor.fetchall()
-    conn.close()
+
+    # Champs gérés localement (non fournis par Plex), chargés en une seule requête
+    local_fields = {
+        row["plex_id"]: row
+        for row in conn.execute("""
+            SELECT plex_id, firstname, lastname, second_email
+            FROM users
+            WHERE plex_id IS NOT NULL
+        """)
+    }
 
     users = {}
     utilisateurs_ignorés = []
 
     def fetch(endpoint, token):
         try:
-            headers = {"X-Plex-Token": token}
-            res = requests.get(endpoint, headers=headers)
+            res = fetcher.get(endpoint, token)
             res.raise_for_status()
             return ET.fromstring(res.text).findall("User")
         except Exception as e:
-            logger.warning(f"⚠ Échec de récupération depuis {endpoint} avec token {token[:6]}... : {e}")
+            logger.warning("⚠ Échec de récupération depuis %s : %s", endpoint, e)
             return []
-            
-    admin_id_map = {token: get_admin_id(token) for _, token in rows}
+
+    # 🚀 Toutes les requêtes partent en parallèle ; /users/account n'est appelé qu'une fois par token
+    for _, token in rows:
+        for url in (PLEX_ACCOUNT_URL, PLEX_USERS_URL, PLEX_HOME_USERS_URL):
+            fetcher.submit(url, token)
 
     for name, token in rows:
-        account_url = "https://plex.tv/users/account"
-        account_response = requests.get(account_url, headers={"X-Plex-Token": token})
-        logger.debug(f"📡 Résultat /users/account pour {name} → HTTP {account_response.status_code}")
-        logger.debug(account_response.content.decode() if account_response.ok else account_response.text)
+        owner_email = owner_username = owner_id = None
+        try:
+            account_response = fetcher.get(PLEX_ACCOUNT_URL, token)
+            logger.debug("📡 Résultat /users/account pour %s → HTTP %s", name, account_response.status_code)
+        except Exception as e:
+            logger.warning("⚠ Échec de récupération depuis %s pour %s : %s", PLEX_ACCOUNT_URL, name, e)
+            account_response = None
 
-        if account_response.status_code == 200:
+        if account_response is not None and account_response.status_code == 200:
             account_data = ET.fromstring(account_response.content)
-            logger.debug(f"🧾 Contenu XML /users/account : {account_response.content.decode()}")
+            logger.debug("🧾 Contenu XML /users/account : %s", account_response.text)
             owner_email = account_data.attrib.get("email")
             owner_username = account_data.attrib.get("username")
             owner_id = account_data.attrib.get("id")
-            logger.debug(f"🔑 OWNER ID: {owner_id} / USERNAME: {owner_username} / EMAIL: {owner_email}")
+            logger.debug("🔑 OWNER ID: %s / USERNAME: %s / EMAIL: %s", owner_id, owner_username, owner_email)
+        elif account_response is not None:
+            logger.warning(f"⚠️ Impossible de récupérer l'ID admin via /users/account (HTTP {account_response.status_code})")
 
-        else:
-            owner_email = owner_username = owner_id = None
+        admin_id = str(owner_id or "-1")
 
         temp_users = {}
 
-        for user in fetch("https://plex.tv/api/users", token) + fetch("https://plex.tv/api/home/users", token):
+        for user in fetch(PLEX_USERS_URL, token) + fetch(PLEX_HOME_USERS_URL, token):
             username = user.get("username") or user.get("title") or "inconnu"
             email = user.get("email", "")
             thumb = user.get("thumb", "")
             user_id = str(user.get("id"))
             plex_id = user_id
-            is_admin = user_id == str(admin_id_map.get(token, "-1"))
+            is_admin = user_id == admin_id
 
 
 
 
 
-            logger.debug(f"🧪 CHECK {user.get('username')} / ID {user.get('id')} → ADMIN = {is_admin}")
-            logger.debug(f"[{logger.name}][{logger.level}] 🧪 CHECK {user.get('username')} / ID {user.get('id')} → ADMIN = {is_admin}")
+            logger.debug("🧪 CHECK %s / ID %s → ADMIN = %s", user.get("username"), user.get("id"), is_admin)
 
 
 
             key = (email or f"id_{user_id}").strip().lower()
 
-            logger.debug(f"👥 Candidat utilisateur : username={username} / email={email} / id={plex_id}")
+            logger.debug("👥 Candidat utilisateur : username=%s / email=%s / id=%s", username, email, plex_id)
             if not (username or email):
                 logger.warning(f"❌ Utilisateur ignoré : username/email manquant : {ET.tostring(user)}")
                 utilisateurs_ignorés.append({
@@ -248,11 +268,7 @@ def get_plex_users():
                 continue
 
             if key not in users:
-                conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-                cursor = conn.cursor()
-                cursor.execute("SELECT firstname, lastname, second_email FROM users WHERE plex_id = ?", (plex_id,))
-                row = cursor.fetchone()
-                conn.close()
+                row = local_fields.get(plex_id)
 
                 users[key] = {
                     "plex_id": plex_id,
@@ -260,9 +276,9 @@ def get_plex_users():
                     "email": email,
                     "is_admin": is_admin,
                     "avatar": thumb,
-                    "firstname": row[0] if row else "",
-                    "lastname": row[1] if row else "",
-                    "second_email": row[2] if row else "",
+                    "firstname": row["firstname"] if row else "",
+                    "lastname": row["lastname"] if row else "",
+                    "second_email": row["second_email"] if row else "",
                     "unique_key": key
                 }
             else:
@@ -287,127 +303,169 @@ def get_plex_users():
 
 
 
-def update_database(users, servers):
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-    cursor = conn.cursor()
-
-    for srv in servers:
-        if not srv.get("server_id"):
-            logger.warning(f"❌ Serveur ignoré (server_id manquant) : {srv}")
-            continue
-
-        cursor.execute("""
-            INSERT OR REPLACE INTO servers (
-                server_id, name, plex_url, plex_token, plex_status,
-                tautulli_url, tautulli_api_key, tautulli_status,
-                local_url, public_url
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            srv["server_id"], srv["name"], srv["plex_url"], srv["plex_token"],
-            srv["plex_status"], srv["tautulli_url"], srv["tautulli_api_key"],
-            srv["tautulli_status"], srv["local_url"], srv["public_url"]
-        ))
-
-    for user in users:
-        logger.debug(f"💾 Traitement utilisateur {user['username']} ({user['unique_key']})")
-        logger.debug("📥 Insertion en base...")
-        # On vérifie si un utilisateur avec ce plex_id existe
-        cursor.execute("SELECT 1 FROM users WHERE plex_id = ?", (user["plex_id"],))
-        exists = cursor.fetchone()
-
-        if exists:
-            # Mise à jour utilisateur existant (on NE TOUCHE PAS à expiration_date)
-            cursor.execute("""
-                UPDATE users SET
-                    username = ?, email = ?, avatar = ?, is_admin = ?,
-                    firstname = ?, lastname = ?, second_email = ?
-                WHERE plex_id = ?
-            """, (
-                user["username"],
-                user["email"],
-                user.get("avatar", ""),
-                int(user.get("is_admin", False)),
-                user.get("firstname", ""),
-                user.get("lastname", ""),
-                user.get("second_email", ""),
-                user["plex_id"]
-            ))
-        else:
-            # Nouvel utilisateur → on fixe expiration_date = maintenant + 1 mois
-            expiration_date = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
-
-            cursor.execute("""
-                INSERT INTO users (
-                    plex_id, username, email, avatar, is_admin,
-                    firstname, lastname, second_email, expiration_date
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                user["plex_id"],
-                user["username"],
-                user["email"],
-                user.get("avatar", ""),
-                int(user.get("is_admin", False)),
-                user.get("firstname", ""),
-                user.get("lastname", ""),
-                user.get("second_email", ""),
-                expiration_date
-            ))
-
-
+# Tables temporaires de la synchro (cf. _stage_sync_tables), aussi utilisées par le
+# rapport EXPLAIN des requêtes ci-dessous (cf. db_indexes.hot_query)
+SYNC_TABLES_DDL = (
+    """CREATE TEMP TABLE sync_users (
+           plex_id TEXT PRIMARY KEY,
+           username TEXT, email TEXT, avatar TEXT, is_admin INTEGER,
+           firstname TEXT, lastname TEXT, second_email TEXT
+       )""",
+    """CREATE TEMP TABLE sync_shares (
+           plex_id TEXT, section_id TEXT, server_id TEXT,
+           PRIMARY KEY (plex_id, section_id, server_id)
+       )""",
+    """CREATE TEMP TABLE sync_libraries (
+           section_id TEXT, server_id TEXT, name TEXT,
+           PRIMARY KEY (section_id, server_id)
+       )""",
+    # clé primaire : les NOT EXISTS de la réconciliation y cherchent chaque lien existant
+    """CREATE TEMP TABLE sync_links (
+           user_id INTEGER, library_id INTEGER,
+           PRIMARY KEY (user_id, library_id)
+       )""",
+)
+
+INSERT_LIBRARIES_SQL = hot_query("update_plex_users.insert_libraries", """
+    INSERT INTO libraries (section_id, name, server_id)
+    SELECT sl.section_id, sl.name, sl.server_id
+    FROM sync_libraries sl
+    JOIN servers s ON s.server_id = sl.server_id
+    WHERE NOT EXISTS (
+        SELECT 1 FROM libraries l
+        WHERE l.name = sl.name AND l.server_id = sl.server_id
+    )
+    ON CONFLICT(section_id, server_id) DO UPDATE SET
+        name = excluded.name
+""", setup=SYNC_TABLES_DDL, expect_scan=("sl",))
+
+UPDATE_USERS_SQL = hot_query("update_plex_users.update_users", """
+    UPDATE users SET
+        username = su.username, email = su.email, avatar = su.avatar,
+        is_admin = su.is_admin, firstname = su.firstname,
+        lastname = su.lastname, second_email = su.second_email
+    FROM sync_users su
+    WHERE users.plex_id = su.plex_id
+""", setup=SYNC_TABLES_DDL, expect_scan=("su",))
+
+# Paramètre : (expiration_date,)
+INSERT_NEW_USERS_SQL = hot_query("update_plex_users.insert_new_users", """
+    INSERT INTO users (
+        plex_id, username, email, avatar, is_admin,
+        firstname, lastname, second_email, expiration_date
+    )
+    SELECT su.plex_id, su.username, su.email, su.avatar, su.is_admin,
+           su.firstname, su.lastname, su.second_email, ?
+    FROM sync_users su
+    WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.plex_id = su.plex_id)
+""", setup=SYNC_TABLES_DDL, expect_scan=("su",))
+
+# Réconciliation complète : le planificateur peut aussi parcourir users une fois
+BUILD_LINKS_SQL = hot_query("update_plex_users.build_links", """
+    INSERT OR IGNORE INTO sync_links (user_id, library_id)
+    SELECT u.id, l.id
+    FROM sync_shares ss
+    JOIN users u ON u.plex_id = ss.plex_id
+    JOIN libraries l ON l.section_id = ss.section_id AND l.server_id = ss.server_id
+""", setup=SYNC_TABLES_DDL, expect_scan=("ss", "u"))
+
+DELETE_STALE_LINKS_SQL = hot_query("update_plex_users.delete_stale_links", """
+    DELETE FROM user_libraries
+    WHERE user_id IN (
+        SELECT u.id FROM users u JOIN sync_users su ON su.plex_id = u.plex_id
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM sync_links sl
+        WHERE sl.user_id = user_libraries.user_id
+          AND sl.library_id = user_libraries.library_id
+    )
+""", setup=SYNC_TABLES_DDL, expect_scan=("su",))
+
+INSERT_LINKS_SQL = hot_query("update_plex_users.insert_links", """
+    INSERT INTO user_libraries (user_id, library_id)
+    SELECT sl.user_id, sl.library_id
+    FROM sync_links sl
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_libraries ul
+        WHERE ul.user_id = sl.user_id AND ul.library_id = sl.library_id
+    )
+""", setup=SYNC_TABLES_DDL, expect_scan=("sl",))
+
+LIBRARY_ACCESS_SQL = hot_query("update_plex_users.library_access", """
+    UPDATE users SET library_access = COALESCE((
+        SELECT GROUP_CONCAT(l.section_id, ',')
+        FROM user_libraries ul
+        JOIN libraries l ON l.id = ul.library_id
+        WHERE ul.user_id = users.id
+    ), '')
+    WHERE plex_id IN (SELECT plex_id FROM sync_users)
+""", setup=SYNC_TABLES_DDL, expect_scan=("sync_users",))
+
+LINK_USER_SERVERS_SQL = hot_query("update_plex_users.link_user_servers", """
+    INSERT INTO user_servers (
+        user_id, server_id, source,
+        allow_sync, allow_camera_upload, allow_channels,
+        filter_movies, filter_television, filter_music
+    )
+    SELECT DISTINCT u.id, s.id, 'api', 1, 0, 1, '', '', ''
+    FROM sync_shares ss
+    JOIN users u ON u.plex_id = ss.plex_id
+    JOIN servers s ON s.server_id = ss.server_id
+    WHERE true
+    ON CONFLICT(user_id, server_id) DO UPDATE SET
+        source = excluded.source,
+        allow_sync = excluded.allow_sync,
+        allow_camera_upload = excluded.allow_camera_upload,
+        allow_channels = excluded.allow_channels,
+        filter_movies = excluded.filter_movies,
+        filter_television = excluded.filter_television,
+        filter_music = excluded.filter_music
+""", setup=SYNC_TABLES_DDL, expect_scan=("ss",))
+
+
+def _drop_sync_tables(cursor):
+    for table in ("sync_users", "sync_shares", "sync_libraries", "sync_links"):
+        cursor.execute(f"DROP TABLE IF EXISTS temp.{table}")
+
+
+def _stage_sync_tables(cursor, users, libraries):
+    """
+    Charge les données Plex de la synchro dans des tables temporaires :
+      sync_users     : un utilisateur par plex_id
+      sync_shares    : (plex_id, section_id, server_id) partagés à chaque utilisateur
+      sync_libraries : toutes les bibliothèques vues (partagées + sections des serveurs)
+    sync_links (liens attendus) est créée vide, remplie par update_database.
+    """
+    # Pas d'executescript() : il ferait un COMMIT implicite de la transaction en cours
+    _drop_sync_tables(cursor)
+    for ddl in SYNC_TABLES_DDL:
+        cursor.execute(ddl)
 
+    user_rows, share_rows, library_rows = [], [], []
 
-        cursor.execute("SELECT id FROM users WHERE plex_id = ?", (user["plex_id"],))
-        user_row = cursor.fetchone()
-        if not user_row:
+    for lib in libraries:
+        try:
+            section_id = str(int(lib["section_id"]))
+        except (ValueError, TypeError):
             continue
+        library_rows.append((section_id, lib.get("server_id"), lib.get("name")))
 
-        user_db_id = user_row[0]
-        seen_libs = set()
-        linked_server_ids = set()
-
-        # 🔄 Synchronisation des bibliothèques partagées pour cet utilisateur
-        current_libs = user.get("libraries", [])
-        current_section_ids = [int(lib["section_id"]) for lib in current_libs if lib.get("section_id")]
-        
-        # Récupérer les library_id déjà en base pour cet utilisateur
-        cursor.execute("""
-            SELECT l.id, l.section_id, l.server_id
-            FROM libraries l
-            JOIN user_libraries ul ON ul.library_id = l.id
-            WHERE ul.user_id = ?
-        """, (user_db_id,))
-        existing_links = cursor.fetchall()
-        
-        existing_section_ids = set()
-        section_to_library_id = {}
-        for lib_id, section_id, server_id in existing_links:
-            existing_section_ids.add(int(section_id))
-            section_to_library_id[int(section_id)] = lib_id
-        
-        # ➕ Ajout des nouveaux liens
-        for lib in current_libs:
-            try:
-                section_id = int(lib["section_id"])
-            except:
-                continue
-            if section_id not in existing_section_ids:
-                cursor.execute("SELECT id FROM libraries WHERE section_id = ? AND server_id = ?", (section_id, lib["server_id"]))
-                row = cursor.fetchone()
-                if row:
-                    library_id = row[0]
-                    cursor.execute("INSERT INTO user_libraries (user_id, library_id) VALUES (?, ?)", (user_db_id, library_id))
-
-        # ➖ Suppression des liens obsolètes
-        for section_id in existing_section_ids:
-            if section_id not in current_section_ids:
-                lib_id = section_to_library_id.get(section_id)
-                if lib_id:
-                    cursor.execute("DELETE FROM user_libraries WHERE user_id = ? AND library_id = ?", (user_db_id, lib_id))
-
+    for user in users:
+        logger.debug("💾 Traitement utilisateur %s (%s)", user["username"], user["unique_key"])
+        user_rows.append((
+            user["plex_id"],
+            user["username"],
+            user["email"],
+            user.get("avatar", ""),
+            int(user.get("is_admin", False)),
+            user.get("firstname", ""),
+            user.get("lastname", ""),
+            user.get("second_email", ""),
+        ))
 
         for lib in user.get("libraries", []):
             try:
-                section_id = int(lib["section_id"])
+                section_id = str(int(lib["section_id"]))
             except (ValueError, TypeError):
                 logger.warning(f"❌ section_id invalide : {lib.get('section_id')}")
                 continue
@@ -417,77 +475,104 @@ def update_database(users, servers):
                 logger.warning(f"❌ server_id manquant pour bibliothèque : {lib}")
                 continue
 
-            # Vérifie que ce serveur existe
-            cursor.execute("SELECT id FROM servers WHERE server_id = ?", (server_id,))
-            row = cursor.fetchone()
-            if not row:
-                logger.warning(f"❌ Aucun serveur trouvé pour server_id = {server_id}")
-                continue
+            share_rows.append((user["plex_id"], section_id, server_id))
+            library_rows.append((section_id, server_id, lib.get("name")))
+
+    # INSERT OR IGNORE : en cas de doublon, la première occurrence gagne
+    cursor.executemany("INSERT OR IGNORE INTO sync_users VALUES (?, ?, ?, ?, ?, ?, ?, ?)", user_rows)
+    cursor.executemany("INSERT OR IGNORE INTO sync_shares VALUES (?, ?, ?)", share_rows)
+    cursor.executemany("INSERT OR IGNORE INTO sync_libraries VALUES (?, ?, ?)", library_rows)
+
 
-            internal_server_id = row[0]
-            key = (lib["name"], server_id)
-            if key in seen_libs:
+def update_database(users, servers, libraries=()):
+    """
+    Réconcilie en une seule transaction les serveurs, bibliothèques, utilisateurs,
+    user_libraries et user_servers avec l'état renvoyé par Plex.
+
+    Les données sont d'abord chargées dans des tables temporaires, puis appliquées
+    avec quelques requêtes ensemblistes (au lieu de ~10 requêtes par utilisateur).
+    """
+    with transaction() as conn:
+        cursor = conn.cursor()
+
+        server_rows = []
+        for srv in servers:
+            if not srv.get("server_id"):
+                logger.warning(f"❌ Serveur ignoré (server_id manquant) : {srv}")
                 continue
-            seen_libs.add(key)
-            linked_server_ids.add((server_id, internal_server_id))
-
-            cursor.execute("""
-                SELECT 1 FROM libraries WHERE name = ? AND server_id = ?
-            """, key)
-            if not cursor.fetchone():
-                cursor.execute("""
-                    INSERT INTO libraries (section_id, name, server_id)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(section_id, server_id) DO UPDATE SET
-                        name = excluded.name
-                """, (section_id, lib["name"], server_id))
-                logger.info(f"➕ Nouvelle bibliothèque ajoutée : {lib['name']} (serveur: {server_id})")
+            server_rows.append((
+                srv["server_id"], srv["name"], srv["plex_url"], srv["plex_token"],
+                srv["plex_status"], srv["tautulli_url"], srv["tautulli_api_key"],
+                srv["tautulli_status"], srv["local_url"], srv["public_url"]
+            ))
+
+        # Upsert (et non INSERT OR REPLACE) : servers.id reste stable pour user_servers
+        # et les colonnes non listées (type, url, token...) sont conservées
+        cursor.executemany("""
+            INSERT INTO servers (
+                server_id, name, plex_url, plex_token, plex_status,
+                tautulli_url, tautulli_api_key, tautulli_status,
+                local_url, public_url
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(server_id) DO UPDATE SET
+                name = excluded.name,
+                plex_url = excluded.plex_url,
+                plex_token = excluded.plex_token,
+                plex_status = excluded.plex_status,
+                tautulli_url = excluded.tautulli_url,
+                tautulli_api_key = excluded.tautulli_api_key,
+                tautulli_status = excluded.tautulli_status,
+                local_url = excluded.local_url,
+                public_url = excluded.public_url
+        """, server_rows)
+
+        _stage_sync_tables(cursor, users, libraries)
+
+        # 📚 Bibliothèques : ajout si aucune bibliothèque du même nom sur ce serveur
+        cursor.execute(INSERT_LIBRARIES_SQL)
+        if cursor.rowcount > 0:
+            logger.info(f"➕ {cursor.rowcount} bibliothèque(s) ajoutée(s) ou renommée(s)")
+
+        # 👤 Utilisateurs existants (on NE TOUCHE PAS à expiration_date)
+        cursor.execute(UPDATE_USERS_SQL)
+
+        # 👤 Nouveaux utilisateurs → expiration_date = maintenant + 1 mois
+        expiration_date = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+        cursor.execute(INSERT_NEW_USERS_SQL, (expiration_date,))
+        if cursor.rowcount > 0:
+            logger.info(f"➕ {cursor.rowcount} nouvel(s) utilisateur(s) Plex")
+
+        # 🔗 Liens attendus (user_id, library_id) d'après les partages Plex
+        cursor.execute(BUILD_LINKS_SQL)
+
+        # ➖ Suppression des liens obsolètes (uniquement pour les utilisateurs synchronisés)
+        cursor.execute(DELETE_STALE_LINKS_SQL)
+        removed = cursor.rowcount
+
+        # ➕ Ajout des nouveaux liens
+        cursor.execute(INSERT_LINKS_SQL)
+        logger.info(f"🔗 user_libraries : {cursor.rowcount} lien(s) ajouté(s), {removed} supprimé(s)")
 
         # ➕ Mise à jour du champ library_access
-        cursor.execute("""
-            SELECT l.section_id
-            FROM libraries l
-            JOIN user_libraries ul ON ul.library_id = l.id
-            WHERE ul.user_id = ?
-        """, (user_db_id,))
-        lib_ids = [str(row[0]) for row in cursor.fetchall()]
-        library_access_value = ",".join(lib_ids)
-        cursor.execute("UPDATE users SET library_access = ? WHERE id = ?", (library_access_value, user_db_id))
+        cursor.execute(LIBRARY_ACCESS_SQL)
 
         # Lien avec les serveurs vérifiés
-        for server_id, internal_server_id in linked_server_ids:
-            cursor.execute("""
-                INSERT INTO user_servers (
-                    user_id, server_id, source,
-                    allow_sync, allow_camera_upload, allow_channels,
-                    filter_movies, filter_television, filter_music
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(user_id, server_id) DO UPDATE SET
-                    source = excluded.source,
-                    allow_sync = excluded.allow_sync,
-                    allow_camera_upload = excluded.allow_camera_upload,
-                    allow_channels = excluded.allow_channels,
-                    filter_movies = excluded.filter_movies,
-                    filter_television = excluded.filter_television,
-                    filter_music = excluded.filter_music
-            """, (
-                user_db_id, internal_server_id, "api",
-                1, 0, 1, "", "", ""
-            ))
+        cursor.execute(LINK_USER_SERVERS_SQL)
 
-    logger.info("✅ Commit effectué avec succès")
-    conn.commit()
-    conn.close()
-    logger.info("✅ Base de données mise à jour avec succès.")
+        _drop_sync_tables(cursor)
 
+        # Tableaux de l'UI entièrement rechargés (publié avec la réconciliation)
+        for kind in events.KINDS:
+            events.publish(kind)
+
+    logger.info("✅ Base de données mise à jour avec succès.")
 
 
 
-def get_all_sections(server_url, plex_token, server_id):
-    import xml.etree.ElementTree as ET
 
+def get_all_sections(server_url, plex_token, server_id, fetcher=None):
     try:
-        res = requests.get(f"{server_url}/library/sections", headers={"X-Plex-Token": plex_token}, timeout=10)
+        res = _http_get(f"{server_url}/library/sections", plex_token, fetcher)
         res.raise_for_status()
         root = ET.fromstring(res.text)
 
@@ -513,18 +598,46 @@ def sync_plex_users():
         logger.info("🔄 Synchronisation automatique des utilisateurs Plex...")
 
     servers = get_plex_servers()
-    users = get_plex_users()
+    synced_servers = [
+        s for s in servers
+        if s.get("server_id") and s.get("plex_token") and s.get("plex_url")
+    ]
+
+    with PlexFetcher() as fetcher:
+        # 🚀 Requêtes par serveur lancées avant celles des utilisateurs : tout se chevauche
+        for server in synced_servers:
+            fetcher.submit(PLEX_SHARED_SERVERS_URL.format(server_id=server["server_id"]), server["plex_token"])
+            fetcher.submit(f"{server['plex_url']}/library/sections", server["plex_token"])
+
+        users = get_plex_users(fetcher)
+        shared_libraries_map, all_libraries = _collect_server_libraries(synced_servers, fetcher)
+
+    logger.info(f"🧪 shared_libraries_map contient {len(shared_libraries_map)} utilisateurs")
+    logger.debug("🧪 Exemple clés: %s", list(shared_libraries_map)[:5])
 
+    for user in users:
+        logger.debug("👤 Utilisateur: %s → Plex ID: %s", user["username"], user["plex_id"])
+        user["libraries"] = shared_libraries_map.get(user["plex_id"], [])
+
+    if users:
+        update_database(users, servers, all_libraries)
+        rebuild_user_servers.rebuild_user_servers()
+        return "✅ Synchronisation terminée avec succès !"
+    if all_libraries:
+        # Pas d'utilisateur : on enregistre quand même les bibliothèques des serveurs
+        update_database([], servers, all_libraries)
+    return "⚠ Aucune mise à jour effectuée (aucun utilisateur trouvé)."
+
+
+def _collect_server_libraries(servers, fetcher):
+    """Retourne ({plex_id: [bibliothèques partagées]}, [toutes les bibliothèques vues])."""
     shared_libraries_map = {}
     all_libraries = []
     seen_libraries = set()
 
     for server in servers:
-        if not server.get("server_id") or not server.get("plex_token") or not server.get("plex_url"):
-            continue
-
         # 📚 Bibliothèques partagées par utilisateur
-        shared = get_shared_libraries(server["server_id"], server["plex_token"])
+        shared = get_shared_libraries(server["server_id"], server["plex_token"], fetcher)
         for uid, libs in shared.items():
             if uid not in shared_libraries_map:
                 shared_libraries_map[uid] = []
@@ -537,52 +650,14 @@ def sync_plex_users():
                     all_libraries.append(lib)
 
         # 📚 Toutes les bibliothèques du serveur
-        all_sections = get_all_sections(server["plex_url"], server["plex_token"], server["server_id"])
+        all_sections = get_all_sections(server["plex_url"], server["plex_token"], server["server_id"], fetcher)
         for lib in all_sections:
             key = (lib["section_id"], lib["server_id"])
             if key not in seen_libraries:
                 seen_libraries.add(key)
                 all_libraries.append(lib)
 
-    # 💾 Insertion unique des bibliothèques
-    if all_libraries:
-        conn = sqlite3.connect(DATABASE_PATH, timeout=10)
-        cursor = conn.cursor()
-        for lib in all_libraries:
-            try:
-                section_id = int(lib["section_id"])
-            except (ValueError, TypeError):
-                continue
-
-            cursor.execute("""
-                SELECT 1 FROM libraries WHERE name = ? AND server_id = ?
-            """, (lib["name"], lib["server_id"]))
-
-            if not cursor.fetchone():
-                cursor.execute("""
-                    INSERT INTO libraries (section_id, name, server_id)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(section_id, server_id) DO UPDATE SET
-                        name = excluded.name
-                """, (section_id, lib["name"], lib["server_id"]))
-
-                logger.info(f"➕ Nouvelle bibliothèque ajoutée : {lib['name']} (serveur: {lib['server_id']})")
-
-        conn.commit()
-        conn.close()
-
-    logger.info(f"🧪 shared_libraries_map contient {len(shared_libraries_map)} utilisateurs")
-    logger.debug(f"🧪 Exemple clés: {list(shared_libraries_map.keys())[:5]}")
-
-    for user in users:
-        logger.debug(f"👤 Utilisateur: {user['username']} → Plex ID: {user['plex_id']}")
-        user["libraries"] = shared_libraries_map.get(user["plex_id"], [])
-
-    if users:
-        update_database(users, servers)
-        rebuild_user_servers.rebuild_user_servers()
-        return "✅ Synchronisation terminée avec succès !"
-    return "⚠ Aucune mise à jour effectuée (aucun utilisateur trouvé)."
+    return shared_libraries_map, all_libraries
 
 
 
@@ -608,7 +683,7 @@ def get_user_libraries(user_id, server_token, server_url):
         "X-Plex-Token": server_token
     }
     try:
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         response.raise_for_status()
         xml_data = ElementTree.fromstring(response.content)
         libraries = []
@@ -628,37 +703,41 @@ def get_user_libraries(user_id, server_token, server_url):
 
 
 
-def get_shared_libraries(server_id, plex_token):
-    url = f"https://plex.tv/api/servers/{server_id}/shared_servers"
-    headers = {"X-Plex-Token": plex_token}
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        xml_root = ET.fromstring(response.text)
+def fetch_shared_servers(server_id, plex_token, fetcher=None):
+    """
+    Un seul appel plex.tv /shared_servers → {plex_user_id: [bibliothèques partagées]}.
+    Lève une exception si la réponse est inexploitable (contrairement à get_shared_libraries).
+    """
+    response = _http_get(PLEX_SHARED_SERVERS_URL.format(server_id=server_id), plex_token, fetcher)
+    response.raise_for_status()
+    xml_root = ET.fromstring(response.text)
 
-        shared_info = {}
-        for shared in xml_root.findall("SharedServer"):
-            user_id = shared.attrib["userID"]
+    shared_info = {}
+    for shared in xml_root.findall("SharedServer"):
+        user_id = shared.attrib["userID"]
 
-            # 🔒 Sécurise que server_id est bien défini ici
-            current_server_id = shared.attrib.get("machineIdentifier", server_id)
+        # 🔒 Sécurise que server_id est bien défini ici
+        current_server_id = shared.attrib.get("machineIdentifier", server_id)
 
-            if user_id not in shared_info:
-                shared_info[user_id] = []
+        if user_id not in shared_info:
+            shared_info[user_id] = []
 
-            for section in shared.findall("Section"):
-                if section.attrib.get("shared") != "1":
-                    continue  # 🔒 ignorer les bibliothèques non partagées
+        for section in shared.findall("Section"):
+            if section.attrib.get("shared") != "1":
+                continue  # 🔒 ignorer les bibliothèques non partagées
 
-                shared_info[user_id].append({
-                    "section_id": section.attrib["id"],
-                    "name": section.attrib["title"],
-                    "server_id": current_server_id
-                })
+            shared_info[user_id].append({
+                "section_id": section.attrib["id"],
+                "name": section.attrib["title"],
+                "server_id": current_server_id
+            })
 
+    return shared_info
 
-        return shared_info
 
+def get_shared_libraries(server_id, plex_token, fetcher=None):
+    try:
+        return fetch_shared_servers(server_id, plex_token, fetcher)
     except Exception as e:
         logger.error(f"❌ Impossible de récupérer les bibliothèques partagées du serveur {server_id} : {e}")
         return {}
@@ -670,9 +749,7 @@ def get_shared_libraries(server_id, plex_token):
 if __name__ == "__main__":
     #main()
     initialize_database()
-    sync_plex_users()
-    trigger_user_refresh_flag()
-    trigger_library_refresh_flag()
+    sync_plex_users()  # l'UI est notifiée par update_database (cf. events.py)
 
 
 
@@ -1,60 +1,129 @@
-import sqlite3
-from config import DATABASE_PATH
-from logger import logger
-
-def add_column_if_not_exists(cur, table, column, coltype):
-    """
-    Ajoute une colonne si elle n'existe pas déjà dans la table.
-    """
-    cur.execute(f"PRAGMA table_info({table})")
-    columns = [row[1] for row in cur.fetchall()]
-    if column not in columns:
-        logger.info(f"➕ Ajout de la colonne '{column}' dans '{table}'")
-        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {coltype}")
-    else:
-        logger.debug(f"✔️ Colonne '{column}' déjà présente dans '{table}'")
-
-def update_vodum():
-    """
-    Met à jour le schéma de la base Vodum (ajout colonnes, etc.)
-    """
-    logger.info("🚀 Démarrage de la mise à jour Vodum")
-    try:
-        conn = sqlite3.connect(DATABASE_PATH, timeout=30)
-        cur = conn.cursor()
-
-        # Limite les locks
-        cur.execute("PRAGMA journal_mode=WAL;")
-        cur.execute("PRAGMA busy_timeout=5000;")
-        cur.execute("PRAGMA synchronous=NORMAL;")
-
-        # Vérifier / ajouter colonnes dans la table users
-        add_column_if_not_exists(cur, "users", "status", "TEXT")
-        add_column_if_not_exists(cur, "users", "last_status", "TEXT")
-        add_column_if_not_exists(cur, "users", "status_changed_at", "DATETIME")
-        add_column_if_not_exists(cur, "users", "library_access", "TEXT")
-        
-        
-        # --- 👇👇 AJOUTER ICI les colonnes manquantes pour l'UI Edit User ---
-        add_column_if_not_exists(cur, "users", "allow_sync",      "INTEGER DEFAULT 0")
-        add_column_if_not_exists(cur, "users", "allow_deletion",  "INTEGER DEFAULT 0")
-        add_column_if_not_exists(cur, "users", "allow_sharing",   "INTEGER DEFAULT 1")
-        add_column_if_not_exists(cur, "users", "remote_quality",  "TEXT DEFAULT 'Auto'")
-        add_column_if_not_exists(cur, "users", "local_quality",   "TEXT DEFAULT 'Auto'")
-        add_column_if_not_exists(cur, "users", "audio_boost",     "INTEGER DEFAULT 0")
-        add_column_if_not_exists(cur, "users", "bandwidth_limit", "INTEGER")
-        add_column_if_not_exists(cur, "users", "content_restriction", "TEXT")
-
-        # (Optionnel) appliquer les valeurs par défaut sur les anciennes lignes
-        cur.execute("UPDATE users SET allow_sync=0 WHERE allow_sync IS NULL")
-        cur.execute("UPDATE users SET allow_deletion=0 WHERE allow_deletion IS NULL")
-        cur.execute("UPDATE users SET allow_sharing=1 WHERE allow_sharing IS NULL")
-        cur.execute("UPDATE users SET remote_quality='Auto' WHERE remote_quality IS NULL")
-        cur.execute("UPDATE users SET local_quality='Auto' WHERE local_quality IS NULL")
-        cur.execute("UPDATE users SET audio_boost=0 WHERE audio_boost IS NULL")
-
-        conn.commit()
-        conn.close()
-        logger.info("✅ Mise à jour Vodum terminée avec succès")
-    except Exception as e:
-        logger.error(f"❌ Erreur lors de la mise à jour Vodum : {e}")
+from db import transaction
+from db_indexes import ensure_indexes
+import events
+from dates import ISO_GLOB, normalize_date
+from logger import logger
+
+def add_column_if_not_exists(cur, table, column, coltype):
+    """
+    Ajoute une colonne si elle n'existe pas déjà dans la table.
+    """
+    cur.execute(f"PRAGMA table_info({table})")
+    columns = [row[1] for row in cur.fetchall()]
+    if column not in columns:
+        logger.info(f"➕ Ajout de la colonne '{column}' dans '{table}'")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {coltype}")
+    else:
+        logger.debug(f"✔️ Colonne '{column}' déjà présente dans '{table}'")
+
+def normalize_date_column(cur, table, column):
+    """
+    Réécrit en AAAA-MM-JJ les dates encore stockées sous une autre forme (JJ/MM/AAAA, avec heure...).
+    Ne réécrit que les lignes non canoniques : après le premier passage, il n'y en a plus.
+    Les valeurs illisibles sont laissées telles quelles (et signalées).
+    """
+    rows = cur.execute(f"""
+        SELECT rowid, {column} FROM {table}
+        WHERE {column} IS NOT NULL AND {column} NOT GLOB '{ISO_GLOB}'
+    """).fetchall()
+    fixed, invalid = [], []
+    for rowid, value in rows:
+        normalized = normalize_date(value)
+        if normalized:
+            fixed.append((normalized, rowid))
+        elif str(value).strip() == "":
+            fixed.append((None, rowid))
+        else:
+            invalid.append(value)
+    cur.executemany(f"UPDATE {table} SET {column} = ? WHERE rowid = ?", fixed)
+    if fixed:
+        logger.info(f"📅 {len(fixed)} date(s) normalisée(s) dans {table}.{column}")
+    if invalid:
+        logger.warning(f"⚠️ {len(invalid)} date(s) illisible(s) laissée(s) telles quelles dans {table}.{column} : {invalid[:5]}")
+
+
+def update_vodum():
+    """
+    Met à jour le schéma de la base Vodum (ajout colonnes, etc.)
+    """
+    logger.info("🚀 Démarrage de la mise à jour Vodum")
+    try:
+        with transaction() as conn:
+            cur = conn.cursor()
+
+            # Vérifier / ajouter colonnes dans la table users
+            add_column_if_not_exists(cur, "users", "status", "TEXT")
+            add_column_if_not_exists(cur, "users", "last_status", "TEXT")
+            add_column_if_not_exists(cur, "users", "status_changed_at", "DATETIME")
+            add_column_if_not_exists(cur, "users", "library_access", "TEXT")
+
+            # Liens Discord utilisés par le bot, supprimés par la reconstruction de users (updates.sql)
+            add_column_if_not_exists(cur, "users", "discord_user_id",   "TEXT")
+            add_column_if_not_exists(cur, "users", "discord_id",        "TEXT")
+            add_column_if_not_exists(cur, "users", "last_notification", "TIMESTAMP")
+
+        
+            # --- 👇👇 AJOUTER ICI les colonnes manquantes pour l'UI Edit User ---
+            add_column_if_not_exists(cur, "users", "allow_sync",      "INTEGER DEFAULT 0")
+            add_column_if_not_exists(cur, "users", "allow_deletion",  "INTEGER DEFAULT 0")
+            add_column_if_not_exists(cur, "users", "allow_sharing",   "INTEGER DEFAULT 1")
+            add_column_if_not_exists(cur, "users", "remote_quality",  "TEXT DEFAULT 'Auto'")
+            add_column_if_not_exists(cur, "users", "local_quality",   "TEXT DEFAULT 'Auto'")
+            add_column_if_not_exists(cur, "users", "audio_boost",     "INTEGER DEFAULT 0")
+            add_column_if_not_exists(cur, "users", "bandwidth_limit", "INTEGER")
+            add_column_if_not_exists(cur, "users", "content_restriction", "TEXT")
+
+            # (Optionnel) appliquer les valeurs par défaut sur les anciennes lignes
+            cur.execute("UPDATE users SET allow_sync=0 WHERE allow_sync IS NULL")
+            cur.execute("UPDATE users SET allow_deletion=0 WHERE allow_deletion IS NULL")
+            cur.execute("UPDATE users SET allow_sharing=1 WHERE allow_sharing IS NULL")
+            cur.execute("UPDATE users SET remote_quality='Auto' WHERE remote_quality IS NULL")
+            cur.execute("UPDATE users SET local_quality='Auto' WHERE local_quality IS NULL")
+            cur.execute("UPDATE users SET audio_boost=0 WHERE audio_boost IS NULL")
+
+            # Compteur de version des paramètres, incrémenté à chaque UPDATE (cf. settings_helper.py)
+            add_column_if_not_exists(cur, "settings", "version", "INTEGER DEFAULT 0")
+            cur.execute("""
+                CREATE TRIGGER IF NOT EXISTS settings_version_bump
+                AFTER UPDATE ON settings
+                WHEN NEW.version IS OLD.version
+                BEGIN
+                    UPDATE settings SET version = COALESCE(OLD.version, 0) + 1 WHERE rowid = NEW.rowid;
+                END
+            """)
+
+            # Débit des campagnes mailing (cf. send_mail_queue.py)
+            add_column_if_not_exists(cur, "settings", "mail_workers",                "INTEGER DEFAULT 4")
+            add_column_if_not_exists(cur, "settings", "mail_rate_per_minute",        "INTEGER DEFAULT 120")
+            add_column_if_not_exists(cur, "settings", "mail_domain_rate_per_minute", "INTEGER DEFAULT 30")
+
+            # Locations de la file d'envoi (cf. MailQueueWorker)
+            add_column_if_not_exists(cur, "mail_queue", "lease_owner",      "TEXT")
+            add_column_if_not_exists(cur, "mail_queue", "lease_expires_at", "DATETIME")
+            # Rappels passés par la file : type de rappel + date d'expiration au moment de l'envoi
+            add_column_if_not_exists(cur, "mail_queue", "reminder_type",       "TEXT")
+            add_column_if_not_exists(cur, "mail_queue", "expiration_snapshot", "TEXT")
+
+            # Le sujet / contenu des campagnes ne sont plus copiés dans chaque ligne de file
+            # (lus dans mail_campaigns) ; seuls les rappels personnalisés les gardent
+            cur.execute("""
+                UPDATE mail_queue SET subject=NULL, html_content=NULL
+                WHERE reminder_type IS NULL
+                  AND (subject IS NOT NULL OR html_content IS NOT NULL)
+            """)
+
+            # Dates d'expiration canoniques AAAA-MM-JJ (cf. dates.py), y compris les
+            # instantanés des rappels déjà envoyés pour que la déduplication reste valable
+            normalize_date_column(cur, "users", "expiration_date")
+            normalize_date_column(cur, "sent_emails", "expiration_snapshot")
+            normalize_date_column(cur, "mail_queue", "expiration_snapshot")
+
+            # Bus de notifications entre process (cf. events.py)
+            events.ensure_tables(cur)
+
+            # Index des requêtes chaudes (cf. db_indexes.py)
+            ensure_indexes(cur)
+
+        logger.info("✅ Mise à jour Vodum terminée avec succès")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la mise à jour Vodum : {e}")
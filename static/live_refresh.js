@@ -0,0 +1,86 @@
+// /static/live_refresh.js
+// Rafraîchissement des tableaux poussé par le serveur (Server-Sent Events, /api/events).
+//
+// Un seul EventSource par page ; chaque tableau s'abonne à un type ("users", "servers", "libraries").
+// Un événement avec `ids` ne recharge que ces lignes (?ids=...) ; sans `ids`, ou avec plus de
+// MAX_IDS lignes (l'URL deviendrait trop longue pour un proxy / werkzeug), le tableau entier.
+//
+//   liveRefresh("servers", {
+//     tbody: document.getElementById("server-table"),
+//     url: "/api/servers",
+//     rowAttr: "data-server-id",
+//     onRows: function (rows) { ... rebrancher les listeners des nouvelles lignes ... }
+//   });
+//
+// Options facultatives pour les tableaux gérés par une librairie (DataTables) :
+//   findRow(id), replaceRow(oldRow, newRow), addRow(row), removeRow(row), replaceAll(rows), done()
+
+(function () {
+  const MAX_IDS = 200;
+  const handlers = {};
+  let source = null;
+
+  function connect() {
+    if (source || !window.EventSource) return;
+    source = new EventSource("/api/events");
+    source.addEventListener("change", function (e) {
+      const event = JSON.parse(e.data);
+      Object.keys(handlers).forEach(function (kind) {
+        if (event.kind === kind || event.kind === "*") {
+          handlers[kind](event.kind === "*" ? null : event.ids);
+        }
+      });
+    });
+  }
+
+  function parseRows(html) {
+    const tpl = document.createElement("template");
+    tpl.innerHTML = "<table><tbody>" + html + "</tbody></table>";
+    return Array.from(tpl.content.querySelectorAll("tbody > tr"));
+  }
+
+  window.liveRefresh = function (kind, options) {
+    const tbody = options.tbody;
+    const attr = options.rowAttr;
+    const ops = Object.assign({
+      findRow: function (id) { return tbody.querySelector("tr[" + attr + "='" + id + "']"); },
+      replaceRow: function (oldRow, newRow) { oldRow.replaceWith(newRow); },
+      addRow: function (row) { tbody.appendChild(row); },
+      removeRow: function (row) { row.remove(); },
+      replaceAll: function (rows) { tbody.replaceChildren.apply(tbody, rows); },
+      done: function () {}
+    }, options);
+
+    // Les mises à jour d'un même tableau sont appliquées dans l'ordre
+    let chain = Promise.resolve();
+
+    async function apply(ids) {
+      if (ids && ids.length > MAX_IDS) ids = null;
+      const url = ids ? ops.url + "?ids=" + ids.join(",") : ops.url;
+      const rows = parseRows(await fetch(url).then(function (r) { return r.text(); }));
+
+      if (!ids) {
+        ops.replaceAll(rows);
+      } else {
+        const byId = {};
+        rows.forEach(function (row) { byId[row.getAttribute(attr)] = row; });
+        ids.forEach(function (id) {
+          const current = ops.findRow(String(id));
+          const fresh = byId[String(id)];
+          if (current && fresh) ops.replaceRow(current, fresh);
+          else if (fresh) ops.addRow(fresh);
+          else if (current) ops.removeRow(current);  // ligne supprimée côté serveur
+        });
+      }
+      if (ops.onRows) ops.onRows(rows);
+      ops.done();
+    }
+
+    handlers[kind] = function (ids) {
+      chain = chain.then(function () { return apply(ids); }).catch(function (e) {
+        console.error("Refresh " + kind + " failed:", e);
+      });
+    };
+    connect();
+  };
+})();
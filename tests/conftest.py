@@ -0,0 +1,58 @@
+"""
+Tests sur une base SQLite temporaire, sans Plex / SMTP / Discord.
+
+Les modules de l'app sont importés depuis app/ (comme dans le conteneur) ; VODUM_APPDATA est
+fixé avant tout import pour que config / logger n'écrivent pas dans /app/appdata.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+os.environ.setdefault("VODUM_APPDATA", tempfile.mkdtemp(prefix="vodum-tests-"))
+sys.path.insert(0, APP_DIR)
+
+import db  # noqa: E402
+from update_vodum import update_vodum  # noqa: E402
+
+
+def _read(name):
+    with open(os.path.join(APP_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Base neuve par test, construite comme au démarrage : tables.sql, updates.sql (sur sa
+    propre connexion, cf. create_tables_once) puis update_vodum.
+    Retourne la connexion du thread courant (db.get_db()).
+    """
+    path = str(tmp_path / "database.db")
+    db.close_db()
+    monkeypatch.setattr(db, "DATABASE_PATH", path)
+
+    conn = sqlite3.connect(path)
+    conn.executescript(_read("tables.sql"))
+    conn.executescript(_read("updates.sql"))
+    conn.close()
+    update_vodum()
+
+    yield db.get_db()
+    db.close_db()
+
+
+@pytest.fixture
+def add_user(database):
+    """Insère un utilisateur et retourne son id."""
+    def _add(username, email=None, status="active", expiration_date=None, **columns):
+        columns.update(username=username, email=email, status=status, expiration_date=expiration_date)
+        names = ", ".join(columns)
+        marks = ", ".join("?" for _ in columns)
+        with db.transaction() as conn:
+            return conn.execute(f"INSERT INTO users ({names}) VALUES ({marks})", tuple(columns.values())).lastrowid
+    return _add
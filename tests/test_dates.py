@@ -0,0 +1,28 @@
+from datetime import date, datetime
+
+import pytest
+
+from dates import normalize_date, parse_date
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2025-01-31", "2025-01-31"),
+    ("31/01/2025", "2025-01-31"),
+    (" 31/01/2025 ", "2025-01-31"),
+    ("2025-01-31T10:20:30", "2025-01-31"),
+    ("2025-01-31 10:20:30", "2025-01-31"),
+    ("2025-01-31T10:20:30Z", "2025-01-31"),
+    (date(2025, 1, 31), "2025-01-31"),
+    (datetime(2025, 1, 31, 23, 59), "2025-01-31"),
+])
+def test_normalize_date(value, expected):
+    assert normalize_date(value) == expected
+
+
+@pytest.mark.parametrize("value", [None, "", "   ", "demain", "31/02/2025", "2025-13-01"])
+def test_normalize_date_unreadable(value):
+    assert normalize_date(value) is None
+
+
+def test_parse_date_returns_date():
+    assert parse_date("01/02/2025") == date(2025, 2, 1)
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+import db
+
+
+def _committed_names(path):
+    """Ce qu'un autre process verrait : lecture sur une connexion séparée."""
+    other = sqlite3.connect(path)
+    try:
+        return [row[0] for row in other.execute("SELECT name FROM libraries ORDER BY name")]
+    finally:
+        other.close()
+
+
+def test_nested_transaction_commits_only_at_outer_exit(database):
+    with db.transaction() as outer:
+        outer.execute("INSERT INTO libraries (section_id, name, server_id) VALUES ('1', 'A', 's')")
+        with db.transaction() as inner:
+            assert inner is outer
+            inner.execute("INSERT INTO libraries (section_id, name, server_id) VALUES ('2', 'B', 's')")
+        assert _committed_names(db.DATABASE_PATH) == []
+    assert _committed_names(db.DATABASE_PATH) == ["A", "B"]
+
+
+def test_error_in_nested_block_rolls_back_everything(database):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as outer:
+            outer.execute("INSERT INTO libraries (section_id, name, server_id) VALUES ('1', 'A', 's')")
+            with db.transaction() as inner:
+                inner.execute("INSERT INTO libraries (section_id, name, server_id) VALUES ('2', 'B', 's')")
+                raise RuntimeError("boom")
+    assert _committed_names(db.DATABASE_PATH) == []
+
+    # la connexion reste utilisable et repart à la profondeur 0
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO libraries (section_id, name, server_id) VALUES ('3', 'C', 's')")
+    assert _committed_names(db.DATABASE_PATH) == ["C"]
+
+
+def test_on_commit_runs_after_outer_commit_in_order(database):
+    calls = []
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO libraries (section_id, name, server_id) VALUES ('1', 'A', 's')")
+        db.on_commit(lambda: calls.append(("first", _committed_names(db.DATABASE_PATH))))
+        with db.transaction():
+            db.on_commit(lambda: calls.append(("second", None)))
+        assert calls == []
+    assert calls == [("first", ["A"]), ("second", None)]
+
+
+def test_on_commit_dropped_on_rollback(database):
+    calls = []
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.on_commit(lambda: calls.append("rolled back"))
+            raise RuntimeError("boom")
+    with db.transaction():
+        pass
+    assert calls == []
+
+
+def test_on_commit_outside_transaction_runs_immediately(database):
+    calls = []
+    db.on_commit(lambda: calls.append("now"))
+    assert calls == ["now"]
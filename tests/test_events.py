@@ -0,0 +1,55 @@
+import pytest
+
+import db
+import events
+
+
+def test_publish_then_read_since(database):
+    start = events.current_seq()
+    first = events.publish("users", [3, 1, 3])
+    second = events.publish("servers")
+
+    assert events.read_since(start) == [
+        {"seq": first, "kind": "users", "ids": [1, 3]},
+        {"seq": second, "kind": "servers", "ids": None},
+    ]
+    assert events.read_since(first) == [{"seq": second, "kind": "servers", "ids": None}]
+    assert events.read_since(second) == []
+    assert [e["kind"] for e in events.read_since(start, kinds=["servers"])] == ["servers"]
+
+
+def test_publish_unknown_kind(database):
+    with pytest.raises(ValueError):
+        events.publish("nope")
+
+
+def test_publish_follows_enclosing_transaction(database):
+    start = events.current_seq()
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            events.publish("users", [1])
+            raise RuntimeError("boom")
+    assert events.read_since(start) == []
+
+
+def test_future_sequence_asks_for_full_reload(database):
+    seq = events.publish("users")
+    # ex. navigateur revenu après une restauration d'une base plus ancienne
+    assert events.read_since(seq + 10) == [{"seq": seq, "kind": "*", "ids": None}]
+
+
+def test_purged_sequence_asks_for_full_reload(database):
+    first = events.publish("users", [1])
+    events.publish("users", [2])
+    last = events.publish("users", [3])
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM change_log WHERE seq <= ?", (first + 1,))
+
+    assert events.read_since(first - 1) == [{"seq": last, "kind": "*", "ids": None}]
+    # juste avant la plus ancienne séquence gardée : rien n'a été perdu
+    assert events.read_since(first + 1) == [{"seq": last, "kind": "users", "ids": [3]}]
+
+
+def test_format_sse():
+    event = {"seq": 7, "kind": "users", "ids": [1]}
+    assert events.format_sse(event) == 'id: 7\nevent: change\ndata: {"seq": 7, "kind": "users", "ids": [1]}\n\n'
@@ -0,0 +1,67 @@
+from datetime import date, timedelta
+
+import events
+from expirations import extend_expirations
+
+
+def _in_days(n):
+    return (date.today() + timedelta(days=n)).isoformat()
+
+
+def _expiration(conn, user_id):
+    return conn.execute("SELECT expiration_date FROM users WHERE id=?", (user_id,)).fetchone()[0]
+
+
+def _add_server(conn, server_id):
+    return conn.execute(
+        "INSERT INTO servers (server_id, name, type) VALUES (?, ?, 'plex')", (server_id, server_id)
+    ).lastrowid
+
+
+def test_base_is_today_or_current_date(database, add_user):
+    future = add_user("future", expiration_date=_in_days(10))
+    past = add_user("past", expiration_date=_in_days(-10))
+    unset = add_user("unset")
+    unreadable = add_user("unreadable", expiration_date="bientôt")
+
+    assert extend_expirations(30) == 4
+
+    assert _expiration(database, future) == _in_days(40)
+    assert _expiration(database, past) == _in_days(30)
+    assert _expiration(database, unset) == _in_days(30)
+    assert _expiration(database, unreadable) == _in_days(30)
+
+
+def test_filters_are_cumulative(database, add_user):
+    s1 = _add_server(database, "srv1")
+    s2 = _add_server(database, "srv2")
+    lib = database.execute("INSERT INTO libraries (section_id, name, server_id) VALUES ('1', 'Films', 'srv1')").lastrowid
+    a = add_user("a", status="active", expiration_date=_in_days(5))
+    b = add_user("b", status="expired", expiration_date=_in_days(5))
+    c = add_user("c", status="active", expiration_date=_in_days(5))
+    database.executemany("INSERT INTO user_servers (user_id, server_id) VALUES (?, ?)",
+                         [(a, "srv1"), (b, "srv1"), (c, "srv2")])
+    database.execute("INSERT INTO user_libraries (user_id, library_id) VALUES (?, ?)", (b, lib))
+    database.commit()
+
+    assert extend_expirations(1, server_row_id=s1) == 2
+    assert extend_expirations(1, server_row_id=s1, status="active") == 1
+    assert extend_expirations(1, library_id=lib) == 1
+    assert extend_expirations(1, server_row_id=s2, library_id=lib) == 0
+
+    assert _expiration(database, a) == _in_days(7)
+    assert _expiration(database, b) == _in_days(7)
+    assert _expiration(database, c) == _in_days(5)
+
+
+def test_publishes_extended_users(database, add_user):
+    a = add_user("a", expiration_date=_in_days(5))
+    add_user("b", status="expired", expiration_date=_in_days(5))
+    start = events.current_seq()
+
+    extend_expirations(3, status="active")
+    assert events.read_since(start) == [{"seq": start + 1, "kind": "users", "ids": [a]}]
+
+    # aucun utilisateur ciblé : pas d'événement
+    extend_expirations(3, status="invited")
+    assert events.read_since(start + 1) == []
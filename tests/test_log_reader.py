@@ -0,0 +1,72 @@
+import os
+
+import log_reader
+
+
+def _write(path, *lines, mode="a"):
+    with open(path, mode, encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+
+
+def _texts(entries):
+    return [e["text"] for e in entries]
+
+
+def test_read_since_returns_only_new_lines(tmp_path):
+    path = str(tmp_path / "app.log")
+    _write(path, "2025-01-31 10:00:00,000 [INFO] un")
+    _, cursor = log_reader.tail(path=path)
+
+    _write(path, "2025-01-31 10:00:01,000 [WARNING] deux", "2025-01-31 10:00:02,000 [INFO] trois")
+    lines, cursor = log_reader.read_since(cursor, path=path)
+    assert _texts(lines) == ["2025-01-31 10:00:02,000 [INFO] trois", "2025-01-31 10:00:01,000 [WARNING] deux"]
+    assert lines[1]["level"] == "WARNING"
+
+    assert log_reader.read_since(cursor, path=path)[0] == []
+
+
+def test_read_since_keeps_partial_line_for_next_call(tmp_path):
+    path = str(tmp_path / "app.log")
+    _write(path, "2025-01-31 10:00:00,000 [INFO] un")
+    _, cursor = log_reader.tail(path=path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("2025-01-31 10:00:01,000 [INFO] en cours")
+
+    lines, cursor = log_reader.read_since(cursor, path=path)
+    assert lines == []
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(" d'écriture\n")
+    lines, _ = log_reader.read_since(cursor, path=path)
+    assert _texts(lines) == ["2025-01-31 10:00:01,000 [INFO] en cours d'écriture"]
+
+
+def test_read_since_across_rotation(tmp_path):
+    path = str(tmp_path / "app.log")
+    _write(path, "2025-01-31 10:00:00,000 [INFO] vu")
+    _, cursor = log_reader.tail(path=path)
+
+    # suite écrite avant la rotation, puis rotation (comme RotatingFileHandler) et nouveau fichier
+    _write(path, "2025-01-31 10:00:01,000 [INFO] avant rotation")
+    os.rename(path, path + ".1")
+    _write(path, "2025-01-31 10:00:02,000 [ERROR] après rotation", mode="w")
+
+    lines, cursor = log_reader.read_since(cursor, path=path)
+    assert _texts(lines) == [
+        "2025-01-31 10:00:02,000 [ERROR] après rotation",
+        "2025-01-31 10:00:01,000 [INFO] avant rotation",
+    ]
+    assert log_reader.read_since(cursor, path=path)[0] == []
+
+    lines, _ = log_reader.read_since(cursor, levels={"ERROR"}, path=path)
+    assert lines == []
+
+
+def test_read_since_unknown_cursor_falls_back_to_tail(tmp_path):
+    path = str(tmp_path / "app.log")
+    _write(path, "2025-01-31 10:00:00,000 [INFO] un", "2025-01-31 10:00:01,000 [INFO] deux")
+
+    lines, _ = log_reader.read_since("pas-un-curseur", limit=1, path=path)
+    assert _texts(lines) == ["2025-01-31 10:00:01,000 [INFO] deux"]
+    lines, _ = log_reader.read_since("1-0", path=path)
+    assert len(lines) == 2
@@ -0,0 +1,77 @@
+import logging
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+import log_store
+
+
+# Dates récentes : les événements de plus de RETENTION_DAYS jours sont purgés à l'écriture
+D1, D2, D3 = ((datetime.now(UTC) - timedelta(days=n)).date().isoformat() for n in (3, 2, 1))
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """logs.db temporaire, rempli via StoreHandler (comme le thread d'écriture des logs)."""
+    monkeypatch.setattr(log_store, "LOG_DB_PATH", str(tmp_path / "logs.db"))
+    monkeypatch.setattr(log_store._local, "conn", None, raising=False)
+    handler = log_store.StoreHandler(level=logging.DEBUG)
+
+    def write(message, level=logging.INFO, at=f"{D3}T12:00:00", **fields):
+        record = logging.LogRecord("vodum", level, __file__, 1, message, None, None)
+        record.created = datetime.fromisoformat(at).replace(tzinfo=UTC).timestamp()
+        for name, value in fields.items():
+            setattr(record, name, value)
+        handler.emit(record)
+        handler.flush()
+
+    yield write
+    conn = getattr(log_store._local, "conn", None)
+    if conn is not None:
+        conn.close()
+
+
+def _messages(events):
+    return [e["message"] for e in events]
+
+
+def test_query_filters(store):
+    store("sync ok", task="sync_users", run_id="r1", at=f"{D1}T10:00:00")
+    store("plex down", level=logging.ERROR, task="check_servers", server_id=2, at=f"{D2}T10:00:00")
+    store("unfriend", level=logging.WARNING, user_id=12, at=f"{D3}T10:00:00")
+
+    assert _messages(log_store.query()) == ["unfriend", "plex down", "sync ok"]
+    assert _messages(log_store.query(min_level="warning")) == ["unfriend", "plex down"]
+    assert _messages(log_store.query(task="sync_users")) == ["sync ok"]
+    assert _messages(log_store.query(run_id="r1")) == ["sync ok"]
+    assert _messages(log_store.query(user_id="12")) == ["unfriend"]
+    assert _messages(log_store.query(server_id=2)) == ["plex down"]
+    assert _messages(log_store.query(since=D2, until=D2)) == ["plex down"]
+    # 11:00 en UTC+2 = 09:00 UTC
+    assert _messages(log_store.query(since=f"{D2}T11:00:00+02:00")) == ["unfriend", "plex down"]
+    assert _messages(log_store.query(since=f"{D2}T13:00:00+02:00")) == ["unfriend"]
+
+
+def test_query_text_and_pagination(store):
+    for i in range(5):
+        store(f"mail {i} envoyé")
+    store('guillemets "bizarres" AND OR')
+
+    assert _messages(log_store.query(text="envoyé 3")) == ["mail 3 envoyé"]
+    # les opérateurs FTS5 ne sont pas interprétés
+    assert _messages(log_store.query(text='"bizarres" AND')) == ['guillemets "bizarres" AND OR']
+
+    page = log_store.query(text="mail", limit=2)
+    assert _messages(page) == ["mail 4 envoyé", "mail 3 envoyé"]
+    page = log_store.query(text="mail", limit=2, before_id=page[-1]["id"])
+    assert _messages(page) == ["mail 2 envoyé", "mail 1 envoyé"]
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"since": "hier"},
+    {"until": "31/01/2025"},
+    {"min_level": "BAVARD"},
+])
+def test_query_rejects_unreadable_filters(store, kwargs):
+    with pytest.raises(ValueError):
+        log_store.query(**kwargs)
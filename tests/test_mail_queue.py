@@ -0,0 +1,86 @@
+import send_mail_queue
+from send_mail_queue import MailQueueWorker, create_campaign, split_recipients
+
+
+def _queue(conn):
+    return {
+        row["email"]: (row["status"], row["lease_owner"])
+        for row in conn.execute("SELECT email, status, lease_owner FROM mail_queue")
+    }
+
+
+def test_create_campaign_targets_active_users_with_email(database, add_user):
+    add_user("a", "a@example.com", status="active")
+    add_user("b", "  b@example.com ", status="reminder")
+    add_user("c", "c@example.com", status="expired")
+    add_user("d", "   ", status="active")
+    add_user("e", None, status="active")
+
+    campaign_id, count = create_campaign(database, None, "Sujet", "<p>Corps</p>")
+
+    assert count == 2
+    assert sorted(_queue(database)) == ["a@example.com", "b@example.com"]
+    status = database.execute("SELECT status FROM mail_campaigns WHERE id=?", (campaign_id,)).fetchone()[0]
+    assert status == "pending"
+
+
+def test_create_campaign_pages_through_users(database, add_user):
+    for i in range(7):
+        add_user(f"u{i}", f"u{i}@example.com")
+    chunks = list(send_mail_queue.iter_recipient_chunks(database, 1, None, chunk_size=3))
+    assert chunks == [3, 3, 1]
+
+
+def test_create_campaign_without_recipients(database, add_user):
+    add_user("c", "c@example.com", status="expired")
+    assert create_campaign(database, None, "Sujet", "<p>Corps</p>") == (None, 0)
+    assert database.execute("SELECT COUNT(*) FROM mail_campaigns").fetchone()[0] == 0
+
+
+def test_claim_leases_each_row_once(database, add_user):
+    for name in ("a", "b", "c"):
+        add_user(name, f"{name}@example.com")
+    campaign_id, _ = create_campaign(database, None, "Sujet", "<p>Corps</p>")
+    first = MailQueueWorker(batch_size=2)
+    second = MailQueueWorker(batch_size=2)
+
+    claimed_first = first.claim(database)
+    claimed_second = second.claim(database)
+
+    assert len(claimed_first) == 2
+    assert len(claimed_second) == 1
+    assert first.claim(database) == []
+    owners = [owner for _, owner in _queue(database).values()]
+    assert sorted(owners) == sorted([first.owner] * 2 + [second.owner])
+    assert all(status == "sending" for status, _ in _queue(database).values())
+    status = database.execute("SELECT status FROM mail_campaigns WHERE id=?", (campaign_id,)).fetchone()[0]
+    assert status == "sending"
+
+
+def test_requeue_expired_only_touches_expired_leases(database, add_user):
+    for name in ("a", "b", "c"):
+        add_user(name, f"{name}@example.com")
+    create_campaign(database, None, "Sujet", "<p>Corps</p>")
+    dead = MailQueueWorker(batch_size=2)
+    alive = MailQueueWorker(batch_size=2)
+    dead.claim(database)
+    alive.claim(database)
+    # le premier worker est mort : sa location n'a pas été renouvelée
+    database.execute(
+        "UPDATE mail_queue SET lease_expires_at=datetime('now', '-1 seconds') WHERE lease_owner=?",
+        (dead.owner,),
+    )
+    database.commit()
+
+    assert alive.requeue_expired(database) == 2
+
+    states = sorted(_queue(database).values(), key=lambda s: s[0])
+    assert states == [("pending", None), ("pending", None), ("sending", alive.owner)]
+    # les lignes remises en file sont de nouveau réclamables
+    assert len(alive.claim(database)) == 2
+
+
+def test_split_recipients():
+    assert split_recipients("a@x, b@y ,") == ["a@x", "b@y"]
+    assert split_recipients(" , ,") == []
+    assert split_recipients(None) == []